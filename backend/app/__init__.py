@@ -1,10 +1,33 @@
-from flask import Flask
+from flask import Flask, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+import importlib
 import os
+import threading
 from datetime import timedelta
 
+# 注册的蓝图：(模块, 蓝图变量名)
+BLUEPRINTS = (
+    ('.routes.ai_routes', 'ai_bp'),
+    ('.routes.relationship_routes', 'relationship_bp'),
+    ('.routes.chat_routes', 'chat_bp'),
+    ('.routes.conversation_routes', 'conversation_bp'),
+    ('.routes.chat_history_routes', 'chat_history_bp'),
+    ('.routes.auth_routes', 'auth_bp'),
+    ('.routes.vip_routes', 'vip_bp'),
+    ('.routes.agent_routes', 'agent_bp'),
+    ('.routes.image_routes', 'image_bp'),
+    ('.routes.file_routes', 'file_bp'),
+    # ('.routes.user_routes', 'user_bp'),  # 如果有用户路由
+    # ('.routes.promoter_routes', 'promoter_bp'),  # 链接管理、申请和提现仍依赖 flask_jwt_extended 和SQLAlchemy模型
+)
 
-def create_app():
+
+def create_app(init_database: bool = True):
+    """创建应用（唯一的应用工厂）
+
+    init_database 为True时初始化数据库连接池并预热连接（见 app.db.init_db）。
+    """
     app = Flask(__name__)
     
     # 加载配置
@@ -36,31 +59,53 @@ def create_app():
             response.status_code = 200
         return response
 
-    from .routes.ai_routes import ai_bp
-    from .routes.relationship_routes import relationship_bp
-    from .routes.chat_routes import chat_bp
-    from .routes.auth_routes import auth_bp
-    from .routes.vip_routes import vip_bp
-    from .routes.agent_routes import agent_bp
-    from .routes.image_routes import image_bp
-    from .routes.file_routes import file_bp
-    from .routes.conversation_routes import conversation_bp
-    from .routes.chat_history_routes import chat_history_bp
-    # from .routes.user_routes import user_bp  # 如果有用户路由
-
-    app.register_blueprint(ai_bp)
-    app.register_blueprint(relationship_bp)
-    app.register_blueprint(chat_bp)
-    app.register_blueprint(conversation_bp)
-    app.register_blueprint(chat_history_bp)
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(vip_bp)
-    app.register_blueprint(agent_bp)
-    app.register_blueprint(image_bp)
-    app.register_blueprint(file_bp)
-    # app.register_blueprint(user_bp)
+    # 反向代理后面的真实客户端地址和协议：PROXY_FIX_HOPS 为应用前面可信代理的层数，
+    # 默认0表示直接对外服务，不信任请求中的 X-Forwarded-* 头（限流按 remote_addr 识别匿名用户）
+    proxy_hops = int(os.environ.get('PROXY_FIX_HOPS', 0))
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops, x_host=proxy_hops)
+
+    # 蓝图按表注册；路由模块只在导入时定义路由，较重的依赖（openai、stripe、numpy等）在第一次使用时才加载
+    for module_name, blueprint_name in BLUEPRINTS:
+        module = importlib.import_module(module_name, __name__)
+        app.register_blueprint(getattr(module, blueprint_name))
+
+    # 限流放在所有蓝图之前执行，超限请求不会进入视图函数
+    from .middleware.rate_limit import init_rate_limiter
+    init_rate_limiter(app)
+
+    # 限流通过后再为请求设置处理时间预算
+    from .middleware.deadline import init_deadlines
+    init_deadlines(app)
+
+    # 下游依赖熔断时直接返回503，客户端按 Retry-After 稍后重试
+    from .utils.circuit_breaker import CircuitOpen
+
+    @app.errorhandler(CircuitOpen)
+    def handle_circuit_open(error):
+        response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response
+
+    if init_database:
+        from .db import init_db
+        init_db(app)
 
     return app
 
 
-app = create_app()
\ No newline at end of file
+# 模块级的 app 在第一次访问时才创建（如 `from app import app`、gunicorn 的 app:app），
+# 只导入 app 下的其他模块（如定时任务、脚本）时不会创建应用和连接数据库
+_app = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
\ No newline at end of file
@@ -1,20 +1,39 @@
 """
 彩虹城AI-Agent对话管理系统
 实现基于工具调用的多轮对话处理和上下文管理
+
+导出的类在第一次访问时才导入对应的子模块：导入 app.agent 下的轻量模块（如 admission）
+不会连带加载 openai、numpy 等较重的依赖。
 """
 
-from .context_builder import ContextBuilder
-from .llm_caller import LLMCaller, OpenAILLMCaller
-from .tool_invoker import ToolInvoker
-from .event_logger import EventLogger, LogEntry
-from .ai_assistant import AIAssistant
+import importlib
+
+# 导出名称 -> 所在的子模块
+_EXPORTS = {
+    'ContextBuilder': '.context_builder',
+    'LLMCaller': '.llm_caller',
+    'OpenAILLMCaller': '.llm_caller',
+    'ToolInvoker': '.tool_invoker',
+    'EventLogger': '.event_logger',
+    'LogEntry': '.event_logger',
+    'MemoryStore': '.memory_store',
+    'Embedder': '.memory_store',
+    'HashingEmbedder': '.memory_store',
+    'OpenAIEmbedder': '.memory_store',
+    'ResponseCache': '.response_cache',
+    'SingleFlight': '.single_flight',
+    'RoutingLLMCaller': '.llm_router',
+    'create_llm_caller': '.llm_router',
+    'select_model': '.model_selector',
+    'AIAssistant': '.ai_assistant',
+}
+
+__all__ = list(_EXPORTS)
+
 
-__all__ = [
-    'ContextBuilder',
-    'LLMCaller', 
-    'OpenAILLMCaller',
-    'ToolInvoker',
-    'EventLogger',
-    'LogEntry',
-    'AIAssistant'
-]
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
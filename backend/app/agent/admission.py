@@ -0,0 +1,184 @@
+"""
+LLM并发名额的优先级调度
+进程内同时进行的LLM调用数有上限，名额用完后请求按VIP等级分队列排队：
+有请求排队的等级先满足最低份额（见 app/models/quota.py 的 VIP_TIER_LLM_PRIORITY），
+其余名额按权重做加权公平分配（步长调度），排队超过期限的请求直接拒绝，不再占用上游容量。
+免费用户的突发流量只会让免费用户自己排队，付费用户仍能很快拿到名额。
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+import math
+import os
+import threading
+import time
+
+from app.models.enums import VIPLevel
+from app.models.quota import VIP_TIER_LLM_PRIORITY, parse_vip_level
+from app.utils import metrics
+from app.utils.deadline import time_left
+
+# 进程内同时进行的LLM调用数上限，设为0关闭调度
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 32))
+
+# 排队等待名额的最长时间（秒）
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 20))
+
+
+class AdmissionRejected(Exception):
+    """排队超时，请求被拒绝"""
+
+    def __init__(self, vip_level: VIPLevel, waited: float, retry_after: int = 5):
+        self.vip_level = vip_level
+        self.waited = waited
+        self.retry_after = retry_after
+        super().__init__(f"服务繁忙，请求排队 {waited:.1f} 秒仍未获得处理名额，请稍后重试")
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionScheduler:
+    """按VIP等级加权公平地分配LLM并发名额"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_wait: float = LLM_QUEUE_TIMEOUT,
+                 policies=VIP_TIER_LLM_PRIORITY):
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.weights = {level: policy['weight'] for level, policy in policies.items()}
+        self.min_slots = {level: math.floor(policy['min_share'] * max_concurrency)
+                          for level, policy in policies.items()}
+        self._queues: Dict[VIPLevel, Deque[_Waiter]] = {level: deque() for level in policies}
+        self._running = {level: 0 for level in policies}
+        # 步长调度的虚拟时间：每获得一个名额前进 1/权重，排队时取虚拟时间最小的等级
+        self._pass = {level: 0.0 for level in policies}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+
+        metrics.set_gauge('llm_admission.running', lambda: sum(self._running.values()))
+        for level in policies:
+            metrics.set_gauge(f'llm_admission.{level.name}.queued', lambda level=level: len(self._queues[level]))
+
+    @contextmanager
+    def slot(self, vip_level=None, timeout: Optional[float] = None):
+        """占用一个名额执行代码块，排队超时抛出 AdmissionRejected"""
+        level = parse_vip_level(vip_level)
+        self.acquire(level, timeout)
+        try:
+            yield
+        finally:
+            self.release(level)
+
+    def acquire(self, level: VIPLevel, timeout: Optional[float] = None) -> float:
+        """获取一个名额，返回排队时间（秒）"""
+        timeout = self.max_wait if timeout is None else timeout
+        start = time.monotonic()
+
+        with self._lock:
+            if sum(self._running.values()) < self.max_concurrency and not any(self._queues.values()):
+                self._grant(level)
+                waiter = None
+            else:
+                if not self._queues[level] and not self._running[level]:
+                    # 空闲的等级重新开始排队时不能带着积攒的虚拟时间优势
+                    self._pass[level] = max(self._pass[level], self._virtual_time)
+                waiter = _Waiter()
+                self._queues[level].append(waiter)
+
+        if waiter is not None and not waiter.event.wait(timeout):
+            with self._lock:
+                if not waiter.granted:
+                    self._queues[level].remove(waiter)
+                    waiter = None
+            if waiter is None:
+                waited = time.monotonic() - start
+                metrics.incr(f'llm_admission.{level.name}.shed')
+                raise AdmissionRejected(level, waited)
+
+        waited = time.monotonic() - start
+        metrics.incr(f'llm_admission.{level.name}.admitted')
+        metrics.incr(f'llm_admission.{level.name}.queue_seconds', waited)
+        return waited
+
+    def release(self, level: VIPLevel) -> None:
+        with self._lock:
+            self._running[level] -= 1
+            self._dispatch()
+
+    def _grant(self, level: VIPLevel) -> None:
+        self._running[level] += 1
+        self._virtual_time = self._pass[level]
+        self._pass[level] += 1.0 / self.weights[level]
+
+    def _dispatch(self) -> None:
+        """把空出的名额分给排队的请求（调用方持有锁）"""
+        while sum(self._running.values()) < self.max_concurrency:
+            waiting = [level for level, queue in self._queues.items() if queue]
+            if not waiting:
+                return
+            # 先照顾低于最低份额的等级，其次按虚拟时间
+            starved = [level for level in waiting if self._running[level] < self.min_slots[level]]
+            if starved:
+                level = min(starved, key=lambda level: self._running[level] / self.min_slots[level])
+            else:
+                level = min(waiting, key=lambda level: self._pass[level])
+            waiter = self._queues[level].popleft()
+            waiter.granted = True
+            self._grant(level)
+            waiter.event.set()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """各等级的排队数、进行数和平均排队时间"""
+        data = metrics.snapshot()
+        stats = {}
+        for level in self._queues:
+            admitted = data.get(f'llm_admission.{level.name}.admitted', 0)
+            queue_seconds = data.get(f'llm_admission.{level.name}.queue_seconds', 0)
+            stats[level.name] = {
+                'queued': len(self._queues[level]),
+                'running': self._running[level],
+                'admitted': admitted,
+                'shed': data.get(f'llm_admission.{level.name}.shed', 0),
+                'avg_queue_ms': round(queue_seconds / admitted * 1000, 1) if admitted else 0.0,
+            }
+        return stats
+
+
+_default_scheduler: Optional[AdmissionScheduler] = None
+
+
+def get_admission_scheduler() -> Optional[AdmissionScheduler]:
+    """进程内共享的调度器，LLM_MAX_CONCURRENCY=0 时不做调度"""
+    global _default_scheduler
+    if LLM_MAX_CONCURRENCY <= 0:
+        return None
+    if _default_scheduler is None:
+        _default_scheduler = AdmissionScheduler()
+    return _default_scheduler
+
+
+@contextmanager
+def llm_slot(vip_level=None):
+    """占用一个LLM并发名额，调度关闭时直接执行"""
+    scheduler = get_admission_scheduler()
+    if scheduler is None:
+        yield
+        return
+    # 排队时间不超过请求剩余的处理时间
+    with scheduler.slot(vip_level, timeout=time_left(scheduler.max_wait, '等待LLM名额')):
+        yield
+
+
+def tier_key(key: str, vip_level=None) -> str:
+    """请求合并（single_flight）的键加上VIP等级
+
+    不同等级的相同请求分开合并：付费用户的请求不会跟在排队中的免费请求后面等待，
+    也不会收到免费请求排队超时的 AdmissionRejected。
+    """
+    return f'{parse_vip_level(vip_level).name}:{key}'
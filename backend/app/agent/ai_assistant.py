@@ -3,103 +3,82 @@ AI助手主控制器
 整合上下文构建、LLM调用、工具调度和事件日志等模块，实现完整的对话处理流程
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from typing import Dict, Any, List, Optional
 import json
+import logging
+import os
 import uuid
 import time
 
 from .context_builder import ContextBuilder
-from .llm_caller import OpenAILLMCaller
-from .tool_invoker import ToolInvoker, get_weather, generate_ai_id, generate_frequency
+from .llm_router import create_llm_caller
+from .tool_invoker import ToolInvoker
 from .event_logger import EventLogger
+from .memory_store import MemoryStore, get_memory_store, format_exchange, parse_exchange
+from .model_selector import MODEL_TIERS, select_model, record_choice
+from app.utils import metrics
+from app.utils.circuit_breaker import CircuitOpen
+from app.utils.deadline import DeadlineExceeded, has_time
+
+# 每次从长期记忆中检索的片段数
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', 3))
+
+# 请求没有带上对话历史时，从长期记忆中取本会话最近的轮数放进上下文
+SESSION_HISTORY_TURNS = int(os.getenv('SESSION_HISTORY_TURNS', 6))
+
+# 写入长期记忆（向量化和数据库写入）的后台线程数，写入不占用请求的处理时间
+MEMORY_WRITE_WORKERS = int(os.getenv('MEMORY_WRITE_WORKERS', 4))
+
+_memory_writer = ThreadPoolExecutor(max_workers=MEMORY_WRITE_WORKERS, thread_name_prefix='memory-writer')
+
+# 执行工具并再调用一次LLM至少需要的时间（秒），请求剩余时间不足时跳过工具，直接返回已有的回答
+TOOL_PHASE_MIN_SECONDS = float(os.getenv('TOOL_PHASE_MIN_SECONDS', 8))
+
+PARTIAL_ANSWER_NOTICE = "本次请求的处理时间不足，以下回答可能不完整。"
 
 class AIAssistant:
     """主AI助手控制器，整合所有模块"""
     
-    def __init__(self, model_name: str = "gpt-4o"):
+    def __init__(self, model_name: Optional[str] = None, memory_store: Optional[MemoryStore] = None):
+        """model_name 不指定时每轮按问题的复杂度选择模型（见 model_selector），指定时固定使用这个模型"""
+        self.model_name = model_name
         self.context_builder = ContextBuilder()
-        self.llm_caller = OpenAILLMCaller(model_name)
+        self.llm_caller = create_llm_caller(model_name or MODEL_TIERS['standard'].model)
         self.tool_invoker = ToolInvoker()
         self.event_logger = EventLogger()
         
-        # 注册默认工具
-        self._register_default_tools()
+        # 长期记忆，设置 MEMORY_ENABLED=false 关闭
+        if memory_store is None and os.getenv('MEMORY_ENABLED', 'true').lower() != 'false':
+            memory_store = get_memory_store()
+        self.memory_store = memory_store
         
-    def _register_default_tools(self):
-        """注册默认工具"""
-        # 天气工具
-        self.tool_invoker.register_tool(
-            name="get_weather",
-            func=get_weather,
-            description="获取指定城市和日期的天气信息",
-            parameters={
-                "city": {
-                    "type": "string",
-                    "description": "城市名称，如北京、上海、新加坡等"
-                },
-                "date": {
-                    "type": "string",
-                    "description": "日期，如今天、明天、后天等",
-                    "optional": True
-                }
-            }
-        )
-        
-        # AI-ID生成工具
-        self.tool_invoker.register_tool(
-            name="generate_ai_id",
-            func=generate_ai_id,
-            description="生成唯一的AI-ID标识符",
-            parameters={
-                "name": {
-                    "type": "string",
-                    "description": "AI的名称（可选）",
-                    "optional": True
-                }
-            }
-        )
-        
-        # 频率编号生成工具
-        self.tool_invoker.register_tool(
-            name="generate_frequency",
-            func=generate_frequency,
-            description="基于AI-ID生成频率编号",
-            parameters={
-                "ai_id": {
-                    "type": "string",
-                    "description": "AI-ID标识符"
-                },
-                "personality_type": {
-                    "type": "string",
-                    "description": "人格类型代码，默认为P",
-                    "optional": True
-                },
-                "ai_type": {
-                    "type": "string",
-                    "description": "AI类型代码，默认为A",
-                    "optional": True
-                }
-            }
-        )
-    
-    def process_query(self, user_input: str, session_id: str = None, user_id: str = None, ai_id: str = None, image_data: str = None, file_data: Dict[str, Any] = None) -> Dict[str, Any]:
+    def process_query(self, user_input: str, session_id: str = None, user_id: str = None, ai_id: str = None, image_data: str = None, file_data: Dict[str, Any] = None, vip_level=None, history: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """处理用户查询的完整流程
         
         Args:
             user_input: 用户输入的文本
             session_id: 会话ID，如果不提供则自动生成
-            user_id: 用户ID，如果不提供则自动生成
+            user_id: 经过认证的用户ID，长期记忆只按它读写；不提供时自动生成，不使用长期记忆
             ai_id: AI ID，如果不提供则自动生成
             image_data: 图片数据（Base64格式）
             file_data: 文件数据，包含类型、数据和元信息
+            vip_level: 用户的VIP等级，LLM并发名额紧张时按等级排队
+            history: 本会话之前的消息（role/content），不提供时从长期记忆中读取本会话最近的轮次
         """
         
+        # 只有经过认证的用户和明确的AI才读写长期记忆，临时生成的标识符没有历史
+        use_memory = self.memory_store is not None and bool(user_id) and bool(ai_id)
+        
         # 生成会话ID和其他标识符（如果未提供）
         session_id = session_id or str(uuid.uuid4())
         user_id = user_id or "user_" + str(uuid.uuid4())[:8]
         ai_id = ai_id or "ai_" + str(uuid.uuid4())[:8]
         
-        # 设置上下文构建器的会话信息
+        # 设置上下文构建器的会话信息；换了会话时清空上一个会话的消息，模型分级只看本会话的对话
+        if self.context_builder.session_id != session_id:
+            self.context_builder.clear_context()
         self.context_builder.session_id = session_id
         self.context_builder.user_id = user_id
         self.context_builder.ai_id = ai_id
@@ -129,13 +108,46 @@ class AIAssistant:
             image_data=image_data,
             file_data=file_data
         )
+        
+        # 补上本会话之前的轮次，再从长期记忆中检索其他会话里与问题相关的片段
+        if history is None and use_memory:
+            history = self._session_history(user_id, ai_id, session_id)
+        if history:
+            self.context_builder.set_session_history(history[-SESSION_HISTORY_TURNS * 2:])
+        memories = self._recall_memories(user_id, ai_id, session_id, user_input) if use_memory else []
+        self.context_builder.set_memory_context(memories)
         messages = self.context_builder.get_conversation_history()
         
         # 3. 第一次LLM调用（带工具定义）
-        tool_definitions = self.tool_invoker.get_tool_definitions()
-        first_response = self.llm_caller.invoke(messages, tools=tool_definitions)
+        # 上下文中带有用户的个人记忆时，回复不能给其他请求复用
+        cacheable = not memories
+        # 按本轮问题的复杂度选择模型，两次调用使用同一个模型
+        choice = select_model(messages, has_file=bool(file_data))
+        if self.model_name:
+            choice = replace(choice, model=self.model_name)
+        call_options = {'cacheable': cacheable, 'vip_level': vip_level,
+                        'model': choice.model, 'max_tokens': choice.max_tokens}
+        # 只发送和本轮问题相关的工具定义，减少提示词
+        tool_definitions = self.tool_invoker.select_tool_definitions(
+            user_input, attachment='image' if image_data else file_type
+        )
+        started = time.monotonic()
+        first_response = self.llm_caller.invoke(messages, tools=tool_definitions, **call_options)
+        record_choice(choice, time.monotonic() - started)
         self.event_logger.log_llm_call(session_id, user_id, ai_id, messages, first_response, 1)
         
+        # 剩余时间不够执行工具和第二次调用时，跳过工具，返回部分回答
+        partial = False
+        if first_response.get("tool_calls") and not has_time(TOOL_PHASE_MIN_SECONDS):
+            partial = True
+            metrics.incr('deadline.tools_skipped')
+            logging.warning(f"会话 {session_id} 剩余时间不足，跳过 {len(first_response['tool_calls'])} 个工具调用")
+            first_response = {
+                **first_response,
+                "content": first_response["content"] or PARTIAL_ANSWER_NOTICE,
+                "tool_calls": []
+            }
+        
         # 4. 检查是否有工具调用
         if first_response.get("tool_calls"):
             # 处理所有工具调用
@@ -158,7 +170,12 @@ class AIAssistant:
             
             # 7. 第二次LLM调用（不带工具定义）
             updated_messages = self.context_builder.get_conversation_history()
-            final_response = self.llm_caller.invoke(updated_messages)
+            try:
+                final_response = self.llm_caller.invoke(updated_messages, **call_options)
+            except (DeadlineExceeded, CircuitOpen):
+                # 第二次调用没有时间完成或上游刚刚熔断，直接返回工具的结果
+                partial = True
+                final_response = {"content": self._partial_answer(), "tool_calls": [], "usage": {}}
             self.event_logger.log_llm_call(session_id, user_id, ai_id, updated_messages, final_response, 2)
             
             # 8. 添加助手回复到上下文
@@ -173,12 +190,18 @@ class AIAssistant:
             # 10. 保存日志
             log_file = self.event_logger.save_logs(session_id)
             
+            if use_memory:
+                self._remember(user_id, ai_id, session_id, user_input, final_response["content"])
+            
             # 返回结果
             return {
                 "response": final_response["content"],
                 "session_id": session_id,
                 "has_tool_calls": True,
                 "tool_results": self.context_builder.tool_results,
+                "memories_used": len(memories),
+                "model_tier": choice.tier,
+                "partial": partial,
                 "log_file": log_file
             }
         else:
@@ -195,15 +218,70 @@ class AIAssistant:
             # 保存日志
             log_file = self.event_logger.save_logs(session_id)
             
+            if use_memory:
+                self._remember(user_id, ai_id, session_id, user_input, first_response["content"])
+            
             # 返回结果
             return {
                 "response": first_response["content"],
                 "session_id": session_id,
                 "has_tool_calls": False,
                 "tool_results": [],
+                "memories_used": len(memories),
+                "model_tier": choice.tier,
+                "partial": partial,
                 "log_file": log_file
             }
     
+    def _partial_answer(self) -> str:
+        """用已经拿到的工具结果拼出部分回答"""
+        lines = [PARTIAL_ANSWER_NOTICE]
+        for tool_result in self.context_builder.tool_results:
+            lines.append(f"{tool_result['tool_name']}: {tool_result['result']}")
+        return "\n".join(lines)
+    
+    def _session_history(self, user_id: str, ai_id: str, session_id: str) -> List[Dict[str, Any]]:
+        """从长期记忆中还原本会话最近的轮次，失败时不影响对话"""
+        try:
+            exchanges = self.memory_store.session_history(user_id, ai_id, session_id, SESSION_HISTORY_TURNS)
+        except Exception as e:
+            logging.warning(f"读取会话历史失败: {str(e)}")
+            return []
+        turns = []
+        for memory in exchanges:
+            user_input, response = parse_exchange(memory.text)
+            turns += [{"role": "user", "content": user_input}, {"role": "assistant", "content": response}]
+        return turns
+    
+    def _recall_memories(self, user_id: str, ai_id: str, session_id: str, user_input: str) -> List[Any]:
+        """检索相关记忆，失败时不影响对话"""
+        try:
+            return self.memory_store.recall(user_id, ai_id, user_input, k=MEMORY_TOP_K, exclude_session=session_id)
+        except Exception as e:
+            logging.warning(f"检索长期记忆失败: {str(e)}")
+            return []
+    
+    def _remember(self, user_id: str, ai_id: str, session_id: str, user_input: str, response: str) -> None:
+        """在后台线程中把这一轮对话写入长期记忆并计入用户和AI的关系，不等待写入完成"""
+        if not user_input or not response:
+            return
+        _memory_writer.submit(self._write_memory, user_id, ai_id, session_id, format_exchange(user_input, response))
+        _memory_writer.submit(self._record_interaction, user_id, ai_id)
+    
+    def _write_memory(self, user_id: str, ai_id: str, session_id: str, text: str) -> None:
+        try:
+            self.memory_store.remember(user_id, ai_id, text, session_id)
+        except Exception as e:
+            logging.warning(f"保存长期记忆失败: {str(e)}")
+    
+    def _record_interaction(self, user_id: str, ai_id: str) -> None:
+        """增加关系的交互次数并增量更新RIS，用户和这个AI还没有关系时什么也不做"""
+        from app.utils.relationship_utils import record_pair_interaction
+        try:
+            record_pair_interaction(user_id, ai_id)
+        except Exception as e:
+            logging.warning(f"记录关系交互失败: {str(e)}")
+    
     def get_conversation_history(self, session_id: str) -> List[Dict[str, Any]]:
         """获取会话历史"""
         return self.context_builder.get_conversation_history() if self.context_builder.session_id == session_id else []
@@ -19,6 +19,7 @@ class ContextBuilder:
     session_id: str = ""
     user_id: str = ""
     ai_id: str = ""
+    memory_message: Optional[Dict[str, Any]] = None
     
     def build_initial_context(self, user_input: str) -> List[Dict[str, Any]]:
         """构建初始上下文"""
@@ -205,6 +206,48 @@ class ContextBuilder:
             # 如果不是有效的Base64，则将其作为文本处理
             return {"type": "text", "text": f"[Image data could not be processed: {image_data[:30]}...]"}
     
+    def set_memory_context(self, memories: List[Any]) -> List[Dict[str, Any]]:
+        """把检索到的历史对话片段作为系统消息放在最新的用户消息之前，替换上一轮放入的片段"""
+        if self.memory_message is not None:
+            self.messages = [msg for msg in self.messages if msg is not self.memory_message]
+            self.memory_message = None
+        
+        if not memories:
+            return self.messages
+        
+        snippets = "\n\n".join(f"[{memory.created_at[:10]}]\n{memory.text}" for memory in memories)
+        self.memory_message = {
+            "role": "system",
+            "content": f"以下是与当前问题相关的历史对话片段，仅在相关时参考：\n\n{snippets}"
+        }
+        
+        # 插入到最后一条用户消息之前
+        position = len(self.messages)
+        for i in range(len(self.messages) - 1, -1, -1):
+            if self.messages[i].get("role") == "user":
+                position = i
+                break
+        self.messages.insert(position, self.memory_message)
+        return self.messages
+    
+    def set_session_history(self, turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """把本会话之前的用户和助手消息放在最新的用户消息之前；每次请求新建上下文，之前的轮次要从外部补上"""
+        turns = [
+            {"role": turn["role"], "content": turn["content"]}
+            for turn in turns
+            if turn.get("role") in ("user", "assistant") and isinstance(turn.get("content"), str) and turn["content"]
+        ]
+        if not turns:
+            return self.messages
+        
+        position = len(self.messages)
+        for i in range(len(self.messages) - 1, -1, -1):
+            if self.messages[i].get("role") == "user":
+                position = i
+                break
+        self.messages[position:position] = turns
+        return self.messages
+    
     def get_conversation_history(self) -> List[Dict[str, Any]]:
         """获取对话历史"""
         return self.messages
@@ -213,3 +256,4 @@ class ContextBuilder:
         """清除上下文"""
         self.messages = []
         self.tool_results = []
+        self.memory_message = None
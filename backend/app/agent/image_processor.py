@@ -10,6 +10,9 @@ import base64
 import logging
 import os
 
+# 下载远程图片的超时（秒），请求剩余时间更短时按剩余时间
+REMOTE_FETCH_TIMEOUT = 10
+
 @dataclass
 class ImageData:
     """图片数据类，支持多种输入格式"""
@@ -34,7 +37,8 @@ class ImageData:
         """从URL获取图片内容"""
         if self.url:
             import requests
-            return requests.get(self.url).content
+            from app.utils.deadline import time_left
+            return requests.get(self.url, timeout=time_left(REMOTE_FETCH_TIMEOUT, '下载图片')).content
         return None
 
 
@@ -4,10 +4,63 @@ LLM调用器
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import copy
 import os
 import json
-from openai import OpenAI
+import threading
+
+from app.utils import metrics
+from app.utils.circuit_breaker import CircuitOpen, get_breaker
+from app.utils.deadline import DeadlineExceeded, remaining, time_left
+from .admission import LLM_QUEUE_TIMEOUT, AdmissionRejected, llm_slot, tier_key
+from .model_selector import VISION_MODELS, VISION_FALLBACK_MODEL
+from .response_cache import ResponseCache, default_temperature, get_response_cache, request_key
+from .single_flight import SingleFlight, llm_flight
+
+# 单次LLM请求的超时（秒），请求剩余时间更短时按剩余时间
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', 60))
+
+# (base_url, api_key) -> 客户端；每次请求都会新建调用器，客户端（和它的HTTP连接池）在进程内共享
+_clients: Dict[Tuple[Optional[str], Optional[str]], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_openai_client(base_url: Optional[str] = None, api_key: Optional[str] = None):
+    """进程内共享的OpenAI客户端，第一次使用时才导入openai并创建（复用HTTP连接池）
+
+    不指定 base_url 和 api_key 时是OpenAI官方接口的客户端。
+    """
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                from openai import OpenAI
+                client = _clients[key] = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), base_url=base_url)
+    return client
+
+
+def upstream_errors():
+    """计入熔断器的上游错误：连接失败和超时、5xx、限流；参数错误等4xx说明上游是正常的"""
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    return (APIConnectionError, InternalServerError, RateLimitError)
+
+def create_with_deadline(create, **params):
+    """调用 create(**params, timeout=...)，超时取 LLM_REQUEST_TIMEOUT 和请求剩余时间中较短的一个
+
+    超时比 LLM_REQUEST_TIMEOUT 短时，超时是请求的截止时间造成的，说明不了上游是否健康：
+    转成 DeadlineExceeded 抛出，不计入熔断器（APITimeoutError 是 APIConnectionError 的子类）。
+    """
+    from openai import APITimeoutError
+    timeout = time_left(LLM_REQUEST_TIMEOUT, 'LLM')
+    try:
+        return create(**params, timeout=timeout)
+    except APITimeoutError:
+        if timeout < LLM_REQUEST_TIMEOUT:
+            raise DeadlineExceeded('LLM')
+        raise
 
 class LLMCaller(ABC):
     """LLM调用抽象基类"""
@@ -20,18 +73,57 @@ class LLMCaller(ABC):
 class OpenAILLMCaller(LLMCaller):
     """基于OpenAI的LLM调用实现"""
     
-    def __init__(self, model_name: str = "gpt-4o"):
+    def __init__(self, model_name: str = "gpt-4o", cache: Optional[ResponseCache] = None,
+                 flight: Optional[SingleFlight] = None, base_url: Optional[str] = None,
+                 api_key: Optional[str] = None, model_override: bool = True, name: str = 'openai'):
+        """base_url 和 api_key 用于接入其他OpenAI兼容的接口，默认使用OpenAI官方接口；
+        只部署了一个模型的上游设置 model_override=False，忽略每次调用指定的模型；
+        name 为上游名称，同名上游共用一个熔断器"""
+        self.name = name
         self.model_name = model_name
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.model_override = model_override
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        self.cache = cache if cache is not None else get_response_cache()
+        self.flight = flight or llm_flight
+        self.breaker = get_breaker(f'llm.{name}')
+    
+    @property
+    def client(self):
+        """第一次调用时取得客户端，同一个上游的调用器共用进程内的客户端"""
+        if self._client is None:
+            self._client = get_openai_client(self.base_url, self.api_key)
+        return self._client
         
-    def invoke(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None, max_tokens: int = 1000) -> Dict[str, Any]:
-        """调用OpenAI模型"""
+    def invoke(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None, max_tokens: int = 1000,
+               temperature: Optional[float] = None, cacheable: bool = True, vip_level=None,
+               model: Optional[str] = None) -> Dict[str, Any]:
+        """调用OpenAI模型
+        
+        Args:
+            model: 本次调用使用的模型（见 model_selector），不指定时使用 model_name
+            temperature: 不指定时按 response_cache.default_temperature 选择，单轮的问题用可以缓存的温度
+            cacheable: 为False时不读写响应缓存（如上下文中包含用户的个人记忆）
+            vip_level: 请求用户的VIP等级，决定排队获取并发名额时的优先级
+        
+        Raises:
+            AdmissionRejected: 排队等待并发名额超时
+            DeadlineExceeded: 请求的处理时间已经用完
+            CircuitOpen: 上游的熔断器处于打开状态
+        """
         try:
+            # 本次调用的模型只放在局部变量里，不修改调用器的状态
+            if not model or not self.model_override:
+                model = self.model_name
+            if temperature is None:
+                temperature = default_temperature(messages, cacheable)
+            
             # 准备请求参数
             request_params = {
-                "model": self.model_name,
+                "model": model,
                 "messages": messages,
-                "temperature": 0.7,
+                "temperature": temperature,
                 "max_tokens": max_tokens,
             }
             
@@ -49,49 +141,83 @@ class OpenAILLMCaller(LLMCaller):
             # 如果有图片，添加特定参数
             if has_image:
                 # 确保模型支持图片
-                if self.model_name not in ["gpt-4o", "gpt-4-turbo"]:
-                    self.model_name = "gpt-4o"  # 自动切换到支持图片的模型
-                    request_params["model"] = self.model_name
+                if self.model_override and model not in VISION_MODELS:
+                    model = VISION_FALLBACK_MODEL  # 自动切换到支持图片的模型
+                    request_params["model"] = model
             
             # 如果提供了工具定义，添加到请求中
             if tools:
                 request_params["tools"] = tools
                 request_params["tool_choice"] = "auto"
             
-            # 调用API
-            response = self.client.chat.completions.create(**request_params)
+            # 相同（或近似相同）的请求直接返回缓存的回复
+            exact_key = context_key = None
+            if self.cache is not None:
+                if cacheable and not has_image and self.cache.cacheable(temperature):
+                    exact_key, context_key = self.cache.keys_for(model, messages, tools, temperature, max_tokens)
+                    cached = self.cache.get(exact_key, context_key, messages)
+                    if cached is not None:
+                        return cached
+                else:
+                    metrics.incr('llm_cache.bypassed')
             
-            # 解析响应
-            message = response.choices[0].message
-            content = message.content or ""
+            # 调用API，同一上游、同一VIP等级的相同请求正在进行时等待它的结果，最多等到请求的截止时间；
+            # 键里有上游名称，对冲到备用上游的请求不会合并到慢的主上游的调用上
+            request = exact_key or request_key(model, messages, tools, temperature, max_tokens)
+            flight_key = tier_key(f'{self.name}:{request}', vip_level)
+            result, shared = self.flight.do(
+                flight_key,
+                lambda: self._create(request_params, vip_level),
+                timeout=time_left(LLM_QUEUE_TIMEOUT + LLM_REQUEST_TIMEOUT, 'LLM'),
+            )
             
-            # 处理工具调用
-            tool_calls = []
-            if hasattr(message, 'tool_calls') and message.tool_calls:
-                for tool_call in message.tool_calls:
-                    tool_calls.append({
-                        "id": tool_call.id,
-                        "name": tool_call.function.name,
-                        "arguments": json.loads(tool_call.function.arguments)
-                    })
-            
-            # 构建结果
-            result = {
-                "content": content,
-                "tool_calls": tool_calls,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-            }
+            if exact_key is not None and not shared:
+                self.cache.set(exact_key, result, context_key, messages)
             
-            return result
+            # 发起调用的请求和等待的请求共享同一个结果对象，各自返回一份副本
+            return copy.deepcopy(result)
             
+        except (AdmissionRejected, DeadlineExceeded, CircuitOpen):
+            # 交给路由器换上游，或由接口返回503/504让客户端稍后重试
+            raise
         except Exception as e:
+            if remaining() == 0:
+                # 按请求剩余时间设置的超时到期
+                raise DeadlineExceeded('LLM')
             # 错误处理
             return {
                 "content": f"LLM调用出错: {str(e)}",
                 "tool_calls": [],
-                "usage": {}
+                "usage": {},
+                "error": str(e)
+            }
+    
+    def _create(self, request_params: Dict[str, Any], vip_level=None) -> Dict[str, Any]:
+        """获取并发名额后调用API并解析响应，上游熔断时不占用名额直接失败"""
+        with self.breaker.guard(upstream_errors()), llm_slot(vip_level):
+            response = create_with_deadline(self.client.chat.completions.create, **request_params)
+        
+        # 解析响应
+        message = response.choices[0].message
+        content = message.content or ""
+        
+        # 处理工具调用
+        tool_calls = []
+        if hasattr(message, 'tool_calls') and message.tool_calls:
+            for tool_call in message.tool_calls:
+                tool_calls.append({
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "arguments": json.loads(tool_call.function.arguments)
+                })
+        
+        # 构建结果
+        return {
+            "content": content,
+            "tool_calls": tool_calls,
+            "usage": {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
             }
+        }
@@ -0,0 +1,247 @@
+"""
+多上游LLM路由
+把多个 LLMCaller（不同地区或厂商的OpenAI兼容接口、本地部署的模型服务）组合成一个调用器：
+按最近一段时间的延迟（p50/p95）和错误率给上游排序，请求优先发给最快的健康上游，
+失败时依次换下一个；首选上游在它自己的p95延迟内还没返回时，再向下一个上游发一份对冲请求，
+先成功返回的结果生效，另一份的结果丢弃（尚未开始的直接取消）。
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import contextvars
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+
+from app.utils import metrics
+from app.utils.circuit_breaker import OPEN, CircuitOpen
+from app.utils.deadline import DeadlineExceeded, remaining
+from .admission import AdmissionRejected
+from .llm_caller import LLMCaller, OpenAILLMCaller
+
+logger = logging.getLogger(__name__)
+
+# 统计延迟和错误率的时间窗口（秒）和最多保留的样本数
+LLM_ROUTER_WINDOW = float(os.getenv('LLM_ROUTER_WINDOW', 300))
+MAX_SAMPLES = 200
+
+# 样本数少于这个值时延迟统计不可靠，不用它来决定对冲时间
+MIN_SAMPLES = 20
+
+# 错误率超过这个值的上游视为不健康，只在其他上游都失败时才使用
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv('LLM_ROUTER_MAX_ERROR_RATE', 0.5))
+
+# 对冲请求：设为false关闭；样本不足时的等待时间和最短等待时间（秒）
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'true').lower() != 'false'
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', 8))
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 0.5))
+
+# 执行上游调用的线程数
+LLM_ROUTER_WORKERS = int(os.getenv('LLM_ROUTER_WORKERS', 64))
+
+_executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix='llm-router')
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class BackendStats:
+    """单个上游在时间窗口内的延迟和成功率"""
+
+    def __init__(self, window: float = LLM_ROUTER_WINDOW):
+        self.window = window
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=MAX_SAMPLES)  # (时间, 延迟, 是否成功)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        # 过期的样本丢弃，不健康的上游在窗口过后会重新获得流量
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return list(self._samples)
+
+    def summary(self) -> Dict[str, float]:
+        samples = self._recent()
+        latencies = [latency for _time, latency, ok in samples if ok]
+        errors = sum(1 for _time, _latency, ok in samples if not ok)
+        return {
+            'samples': len(samples),
+            'p50': _percentile(latencies, 0.5) if latencies else 0.0,
+            'p95': _percentile(latencies, 0.95) if latencies else 0.0,
+            'error_rate': errors / len(samples) if samples else 0.0,
+        }
+
+
+# 上游名称 -> 统计；接口每次请求都会新建调用器，统计需要在进程内共享
+_backend_stats: Dict[str, BackendStats] = {}
+_backend_stats_lock = threading.Lock()
+
+
+def get_backend_stats(name: str) -> BackendStats:
+    with _backend_stats_lock:
+        return _backend_stats.setdefault(name, BackendStats())
+
+
+def all_backend_stats() -> Dict[str, Dict[str, float]]:
+    """所有上游最近的延迟和错误率"""
+    with _backend_stats_lock:
+        stats = dict(_backend_stats)
+    return {name: backend.summary() for name, backend in stats.items()}
+
+
+class RoutingLLMCaller(LLMCaller):
+    """在多个上游之间按延迟路由、失败切换并发送对冲请求"""
+
+    def __init__(self, backends: Dict[str, LLMCaller], hedge: bool = LLM_HEDGE_ENABLED,
+                 max_error_rate: float = LLM_ROUTER_MAX_ERROR_RATE):
+        if not backends:
+            raise ValueError("至少需要一个上游")
+        self.backends = dict(backends)
+        self.stats = {name: get_backend_stats(name) for name in self.backends}
+        self.hedge = hedge
+        self.max_error_rate = max_error_rate
+
+    def ranked(self) -> List[str]:
+        """健康的上游在前，同组内按p50延迟升序；没有样本的上游排在最前，以便尽快得到统计；
+        熔断中的上游排在最后"""
+        def key(name):
+            breaker = getattr(self.backends[name], 'breaker', None)
+            if breaker is not None and breaker.state == OPEN:
+                return True, True, float('inf')
+            summary = self.stats[name].summary()
+            unhealthy = summary['samples'] >= MIN_SAMPLES and summary['error_rate'] > self.max_error_rate
+            if summary['samples'] and not summary['p50']:
+                # 只有失败样本，排在有成功记录的上游之后
+                return False, unhealthy, float('inf')
+            return False, unhealthy, summary['p50']
+        return sorted(self.backends, key=key)
+
+    def hedge_delay(self, name: str) -> float:
+        summary = self.stats[name].summary()
+        if summary['samples'] < MIN_SAMPLES or not summary['p95']:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(summary['p95'], LLM_HEDGE_MIN_DELAY)
+
+    def _call(self, name: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            result = self.backends[name].invoke(messages, **kwargs)
+        except (AdmissionRejected, DeadlineExceeded, CircuitOpen):
+            raise
+        except Exception as e:
+            result = {"content": f"LLM调用出错: {str(e)}", "tool_calls": [], "usage": {}, "error": str(e)}
+        ok = not result.get('error')
+        # 缓存命中不代表上游的延迟
+        if not result.get('cached'):
+            self.stats[name].record(time.monotonic() - start, ok)
+        metrics.incr(f'llm_router.{name}.{"success" if ok else "errors"}')
+        return result
+
+    def invoke(self, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """按排序调用上游，返回第一个成功的结果；全部失败时返回最后一个错误，
+        所有上游都在熔断时抛出 CircuitOpen"""
+        order = self.ranked()
+        pending: Dict[Future, str] = {}
+        launched = 0
+        hedged = False
+        last_error = None
+        circuit_open: Optional[CircuitOpen] = None
+
+        def launch():
+            nonlocal launched
+            name = order[launched]
+            launched += 1
+            # 在工作线程中沿用请求的截止时间
+            context = contextvars.copy_context()
+            pending[_executor.submit(context.run, self._call, name, messages, kwargs)] = name
+
+        launch()
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and launched < len(order):
+                timeout = self.hedge_delay(order[0])
+            left = remaining()
+            if left is not None:
+                timeout = left if timeout is None else min(timeout, left)
+            done, _not_done = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done and left is not None and remaining() == 0:
+                for future in pending:
+                    future.cancel()
+                raise DeadlineExceeded('LLM')
+
+            if not done:
+                # 首选上游慢于它平时的p95，向下一个上游发对冲请求
+                hedged = True
+                metrics.incr('llm_router.hedged')
+                launch()
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except CircuitOpen as e:
+                    # 熔断中的上游立即返回，直接换下一个
+                    circuit_open = e
+                    continue
+                if not result.get('error'):
+                    for loser in pending:
+                        loser.cancel()
+                    if hedged and name != order[0]:
+                        metrics.incr('llm_router.hedge_wins')
+                    result['backend'] = name
+                    return result
+                last_error = result
+                logger.warning(f"LLM上游 {name} 调用失败: {result.get('error')}")
+
+            if not pending and launched < len(order):
+                metrics.incr('llm_router.failovers')
+                launch()
+
+        if last_error is None and circuit_open is not None:
+            raise circuit_open
+        return last_error
+
+
+def create_llm_caller(model_name: str = "gpt-4o") -> LLMCaller:
+    """按配置创建LLM调用器
+
+    LLM_BACKENDS 为JSON数组时，默认的OpenAI接口和列出的上游一起组成路由调用器，例如：
+    [{"name": "azure-east", "base_url": "https://.../v1", "api_key_env": "AZURE_OPENAI_KEY", "model": "gpt-4o"},
+     {"name": "local", "base_url": "http://localhost:8000/v1", "model": "qwen2.5-7b-instruct"}]
+    未指定 model 时使用 model_name。
+    """
+    config = os.getenv('LLM_BACKENDS')
+    if not config:
+        return OpenAILLMCaller(model_name)
+
+    try:
+        entries = json.loads(config)
+    except ValueError as e:
+        logger.error(f"LLM_BACKENDS 配置无法解析，只使用默认上游: {str(e)}")
+        return OpenAILLMCaller(model_name)
+
+    backends: Dict[str, LLMCaller] = {'openai': OpenAILLMCaller(model_name)}
+    for entry in entries:
+        api_key = os.getenv(entry['api_key_env']) if entry.get('api_key_env') else None
+        backends[entry['name']] = OpenAILLMCaller(
+            entry.get('model') or model_name,
+            base_url=entry.get('base_url'),
+            # 不能把默认的OpenAI密钥发给其他上游，本地服务通常不校验密钥
+            api_key=api_key or 'unused',
+            # 指定了模型的上游只部署了这一个模型，不按复杂度换模型
+            model_override=not entry.get('model'),
+            name=entry['name'],
+        )
+    return RoutingLLMCaller(backends)
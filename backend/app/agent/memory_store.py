@@ -0,0 +1,421 @@
+"""
+长期记忆存储
+把每轮对话（用户输入和AI回复）编码为向量，按用户和AI分别建立向量索引，
+处理新问题时检索最相关的若干条历史片段放进上下文，不需要把完整历史发送给模型。
+每个用户/AI组合最多保留 MAX_MEMORIES_PER_PAIR 条，更早的记忆从内存和数据库中一起删除；
+多进程部署时，各进程缓存的索引定期从数据库增量读取其他进程写入的记忆。
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.utils.circuit_breaker import get_breaker
+from app.utils.text_utils import tokenize
+
+# 每条记忆片段的最大长度
+MAX_SNIPPET_CHARS = 500
+
+logger = logging.getLogger(__name__)
+
+# 每个用户/AI组合保留的最大记忆条数（内存和数据库中相同）
+MAX_MEMORIES_PER_PAIR = int(os.getenv('MEMORY_MAX_PER_PAIR', 5000))
+
+# 缓存的索引每隔多少秒从数据库读取一次其他进程新写入的记忆
+MEMORY_SYNC_SECONDS = float(os.getenv('MEMORY_SYNC_SECONDS', 30))
+
+# 增量读取时往前多读的时间（秒），容忍各进程写入时间和提交顺序的差异，重复的记录按ID去掉
+MEMORY_SYNC_OVERLAP_SECONDS = 60
+
+# 内存中最多保留的用户/AI组合数
+MAX_CACHED_PAIRS = int(os.getenv('MEMORY_MAX_CACHED_PAIRS', 1000))
+
+# 记忆数量超过这个值且安装了hnswlib时使用HNSW近似检索，否则用NumPy暴力检索
+HNSW_THRESHOLD = 2000
+
+# 相似度低于这个值的片段不放入上下文
+MIN_MEMORY_SCORE = float(os.getenv('MEMORY_MIN_SCORE', 0.15))
+
+
+class Embedder(ABC):
+    """文本向量化抽象基类"""
+
+    name: str = ""
+    dim: int = 0
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """把文本编码为 (len(texts), dim) 的单位向量"""
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """特征哈希向量化，不依赖模型和网络，结果在不同进程间保持一致"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text, MAX_SNIPPET_CHARS * 4):
+                digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                # 最低位决定符号，减少哈希冲突带来的偏差
+                vectors[row, (value >> 1) % self.dim] += 1.0 if value & 1 else -1.0
+        return _normalize(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """基于OpenAI Embeddings接口的向量化"""
+
+    def __init__(self, model_name: str = "text-embedding-3-small", dim: int = 1536):
+        from .llm_caller import get_openai_client
+        self.client = get_openai_client()
+        self.breaker = get_breaker('llm.embeddings')
+        self.model_name = model_name
+        self.dim = dim
+        self.name = f"openai-{model_name}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # 接口故障时熔断，检索和写入记忆直接失败，不拖慢对话
+        from .llm_caller import upstream_errors
+        with self.breaker.guard(upstream_errors()):
+            response = self.client.embeddings.create(model=self.model_name, input=texts)
+        vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+        return _normalize(vectors)
+
+
+def create_embedder(kind: Optional[str] = None) -> Embedder:
+    """按配置创建向量化器（MEMORY_EMBEDDER=hashing|openai），默认使用离线的哈希向量化"""
+    kind = kind or os.getenv('MEMORY_EMBEDDER', 'hashing')
+    if kind == 'openai':
+        return OpenAIEmbedder(os.getenv('MEMORY_EMBEDDING_MODEL', 'text-embedding-3-small'))
+    return HashingEmbedder()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+@dataclass
+class Memory:
+    """一条记忆片段"""
+    text: str
+    session_id: str = ""
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    score: float = 0.0
+    id: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "text": self.text,
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "score": self.score
+        }
+
+
+class VectorIndex:
+    """单个用户/AI组合的向量索引：向量按行存放在按倍数扩容的矩阵中"""
+
+    def __init__(self, dim: int, capacity: int = MAX_MEMORIES_PER_PAIR):
+        self.dim = dim
+        self.capacity = capacity
+        self._buffer = np.zeros((16, dim), dtype=np.float32)
+        self.memories: List[Memory] = []
+        self._hnsw = None
+        self._hnsw_size = 0
+        # 与数据库同步的进度：上次同步的时间（monotonic）和已读取到的最新记忆时间
+        self.synced_at = time.monotonic()
+        self.synced_until = ""
+
+    def __len__(self) -> int:
+        return len(self.memories)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._buffer[:len(self.memories)]
+
+    def add(self, vectors: np.ndarray, memories: List[Memory]) -> None:
+        vectors = vectors[-self.capacity:]
+        memories = memories[-self.capacity:]
+        size = len(self.memories)
+
+        overflow = size + len(memories) - self.capacity
+        if overflow > 0:
+            # 超出容量时丢弃最早的记忆
+            self._buffer[:size - overflow] = self._buffer[overflow:size]
+            self.memories = self.memories[overflow:]
+            size -= overflow
+            self._hnsw = None
+
+        needed = size + len(memories)
+        if needed > len(self._buffer):
+            buffer = np.zeros((min(max(needed, len(self._buffer) * 2), self.capacity), self.dim), dtype=np.float32)
+            buffer[:size] = self._buffer[:size]
+            self._buffer = buffer
+
+        self._buffer[size:needed] = vectors
+        self.memories.extend(memories)
+
+    def search(self, vector: np.ndarray, k: int, exclude_session: Optional[str] = None) -> List[Memory]:
+        if not self.memories:
+            return []
+
+        # 多取一些候选，过滤掉当前会话的片段后仍有k条
+        candidates = min(len(self.memories), k * 3)
+        index = self._get_hnsw()
+        if index is not None:
+            labels, distances = index.knn_query(vector, k=candidates)
+            hits = zip(labels[0], 1.0 - distances[0])
+        else:
+            scores = self.vectors @ vector
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            hits = ((i, scores[i]) for i in top[np.argsort(-scores[top])])
+
+        results = []
+        for i, score in hits:
+            memory = self.memories[int(i)]
+            if exclude_session and memory.session_id == exclude_session:
+                continue
+            results.append(Memory(memory.text, memory.session_id, memory.created_at, float(score), memory.id))
+            if len(results) >= k:
+                break
+        return results
+
+    def _get_hnsw(self):
+        if len(self.memories) < HNSW_THRESHOLD:
+            return None
+        try:
+            import hnswlib
+        except ImportError:
+            return None
+
+        if self._hnsw is None:
+            self._hnsw = hnswlib.Index(space='ip', dim=self.dim)
+            self._hnsw.init_index(max_elements=self.capacity, ef_construction=100, M=16)
+            self._hnsw.set_ef(64)
+            self._hnsw_size = 0
+        if self._hnsw_size < len(self.memories):
+            self._hnsw.add_items(self.vectors[self._hnsw_size:],
+                                 np.arange(self._hnsw_size, len(self.memories)))
+            self._hnsw_size = len(self.memories)
+        return self._hnsw
+
+
+class MemoryBackend(ABC):
+    """记忆的持久化存储"""
+
+    @abstractmethod
+    def load(self, user_id: str, ai_id: str, limit: int, since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按时间顺序返回最近的记忆（给出 since 时只返回这个时间之后的），
+        每条包含 id、text、session_id、created_at，可能包含 embedding"""
+        pass
+
+    @abstractmethod
+    def save(self, user_id: str, ai_id: str, memory: Memory, embedding: List[float], embedder: str) -> str:
+        """保存一条记忆，返回记录ID"""
+        pass
+
+    @abstractmethod
+    def prune(self, user_id: str, ai_id: str, before: str) -> None:
+        """删除早于 before 的记忆"""
+        pass
+
+
+class SurrealMemoryBackend(MemoryBackend):
+    """把记忆保存在SurrealDB的 ai_memory 表中"""
+
+    def load(self, user_id: str, ai_id: str, limit: int, since: Optional[str] = None) -> List[Dict[str, Any]]:
+        from app.db import execute
+        results = execute(
+            f"""
+            SELECT * FROM (
+                SELECT id, text, session_id, created_at, embedding, embedder FROM ai_memory
+                WHERE user_id = $user_id AND ai_id = $ai_id{' AND created_at > $since' if since else ''}
+                ORDER BY created_at DESC LIMIT $limit
+            ) ORDER BY created_at ASC
+            """,
+            {'user_id': user_id, 'ai_id': ai_id, 'limit': limit, 'since': since},
+        )
+        return (results[-1] if results else []) or []
+
+    def save(self, user_id: str, ai_id: str, memory: Memory, embedding: List[float], embedder: str) -> str:
+        from app.db import execute
+        results = execute(
+            "CREATE ai_memory CONTENT $memory RETURN id",
+            {'memory': {
+                'user_id': user_id,
+                'ai_id': ai_id,
+                'text': memory.text,
+                'session_id': memory.session_id,
+                'created_at': memory.created_at,
+                'embedding': embedding,
+                'embedder': embedder,
+            }},
+        )
+        created = (results[-1] if results else None) or [{}]
+        return str(created[0].get('id', ''))
+
+    def prune(self, user_id: str, ai_id: str, before: str) -> None:
+        from app.db import execute
+        # 按 (user_id, ai_id, created_at) 索引做范围删除
+        execute(
+            "DELETE ai_memory WHERE user_id = $user_id AND ai_id = $ai_id AND created_at < $before RETURN NONE",
+            {'user_id': user_id, 'ai_id': ai_id, 'before': before},
+        )
+
+
+class MemoryStore:
+    """按用户/AI组合管理向量索引，首次访问时从持久化存储加载"""
+
+    def __init__(self, embedder: Optional[Embedder] = None, backend: Optional[MemoryBackend] = None,
+                 max_pairs: int = MAX_CACHED_PAIRS):
+        self.embedder = embedder or HashingEmbedder()
+        self.backend = backend
+        self.max_pairs = max_pairs
+        self._indexes: "OrderedDict[Tuple[str, str], VectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_index(self, user_id: str, ai_id: str) -> VectorIndex:
+        key = (user_id, ai_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                sync = self.backend is not None and time.monotonic() - index.synced_at >= MEMORY_SYNC_SECONDS
+                if sync:
+                    # 同一时间只有一个线程去同步
+                    index.synced_at = time.monotonic()
+        if index is not None:
+            if sync:
+                self._sync(index, user_id, ai_id)
+            return index
+
+        index = VectorIndex(self.embedder.dim)
+        if self.backend is not None:
+            self._load(index, user_id, ai_id)
+
+        with self._lock:
+            index = self._indexes.setdefault(key, index)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_pairs:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _vectors_for(self, rows: List[Dict[str, Any]], memories: List[Memory]) -> np.ndarray:
+        # 用其他向量化器保存的向量不能直接使用，需要重新编码
+        if all(row.get('embedder') == self.embedder.name and row.get('embedding') for row in rows):
+            return np.asarray([row['embedding'] for row in rows], dtype=np.float32)
+        return self.embedder.embed([memory.text for memory in memories])
+
+    @staticmethod
+    def _memories_from(rows: List[Dict[str, Any]]) -> List[Memory]:
+        return [Memory(row.get('text', ''), row.get('session_id', ''), row.get('created_at', ''), id=str(row.get('id', '')))
+                for row in rows]
+
+    def _load(self, index: VectorIndex, user_id: str, ai_id: str) -> None:
+        rows = self.backend.load(user_id, ai_id, index.capacity)
+        index.synced_at = time.monotonic()
+        if not rows:
+            return
+        memories = self._memories_from(rows)
+        index.add(self._vectors_for(rows, memories), memories)
+        index.synced_until = rows[-1].get('created_at', '')
+
+    def _sync(self, index: VectorIndex, user_id: str, ai_id: str) -> None:
+        """读取其他进程在上次同步之后写入的记忆，失败时保留现有的索引"""
+        since = _shift(index.synced_until, -MEMORY_SYNC_OVERLAP_SECONDS) if index.synced_until else None
+        try:
+            rows = self.backend.load(user_id, ai_id, index.capacity, since=since)
+        except Exception as e:
+            logger.warning(f"同步长期记忆失败: {str(e)}")
+            return
+        if not rows:
+            return
+        with self._lock:
+            known = {memory.id for memory in index.memories if not since or memory.created_at > since}
+        rows = [row for row in rows if str(row.get('id', '')) not in known]
+        if rows:
+            memories = self._memories_from(rows)
+            vectors = self._vectors_for(rows, memories)
+            with self._lock:
+                index.add(vectors, memories)
+        index.synced_until = max(index.synced_until, rows[-1].get('created_at', '') if rows else '')
+
+    def remember(self, user_id: str, ai_id: str, text: str, session_id: str = "") -> Memory:
+        """保存一条记忆片段，超过上限时删除最早的记忆"""
+        memory = Memory(text[:MAX_SNIPPET_CHARS], session_id)
+        vector = self.embedder.embed([memory.text])
+        index = self._get_index(user_id, ai_id)
+        if self.backend is not None:
+            memory.id = self.backend.save(user_id, ai_id, memory, vector[0].tolist(), self.embedder.name)
+        with self._lock:
+            index.add(vector, [memory])
+            full = len(index) >= index.capacity
+            oldest = index.memories[0].created_at if full else None
+        if full and self.backend is not None:
+            # 索引中保留的是最新的 capacity 条，数据库中比其中最早的一条还早的记忆不会再被读取
+            self.backend.prune(user_id, ai_id, oldest)
+        return memory
+
+    def session_history(self, user_id: str, ai_id: str, session_id: str, limit: int) -> List[Memory]:
+        """按时间顺序返回某个会话最近的 limit 条记忆片段"""
+        index = self._get_index(user_id, ai_id)
+        with self._lock:
+            memories = [memory for memory in index.memories if memory.session_id == session_id]
+        return memories[-limit:] if limit > 0 else []
+
+    def recall(self, user_id: str, ai_id: str, query: str, k: int = 3,
+               exclude_session: Optional[str] = None, min_score: float = MIN_MEMORY_SCORE) -> List[Memory]:
+        """检索与问题最相关的k条记忆，不包括当前会话中的片段（它们通过 session_history 放在上下文里）"""
+        index = self._get_index(user_id, ai_id)
+        if not len(index):
+            return []
+        vector = self.embedder.embed([query])[0]
+        with self._lock:
+            memories = index.search(vector, k, exclude_session)
+        return [memory for memory in memories if memory.score >= min_score]
+
+
+_default_store: Optional[MemoryStore] = None
+
+
+def get_memory_store() -> MemoryStore:
+    """进程内共享的记忆存储，使用SurrealDB持久化"""
+    global _default_store
+    if _default_store is None:
+        _default_store = MemoryStore(create_embedder(), SurrealMemoryBackend())
+    return _default_store
+
+
+def _shift(timestamp: str, seconds: float) -> str:
+    """ISO时间字符串加减秒数，格式无法解析时原样返回"""
+    try:
+        return (datetime.fromisoformat(timestamp) + timedelta(seconds=seconds)).isoformat()
+    except ValueError:
+        return timestamp
+
+
+def format_exchange(user_input: str, response: str) -> str:
+    """把一轮对话格式化为记忆片段"""
+    return f"用户：{user_input}\nAI：{response}"
+
+
+def parse_exchange(text: str) -> Tuple[str, str]:
+    """format_exchange 的逆操作，返回 (用户输入, 回答)；片段被截断时回答可能不完整"""
+    user_part, _sep, response = text.partition("\nAI：")
+    return user_part[len("用户："):] if user_part.startswith("用户：") else user_part, response
@@ -0,0 +1,150 @@
+"""
+按复杂度选择模型
+每轮对话根据几个廉价的特征（长度、附件、工具关键词、对话深度）归入一个模型等级，
+问候和常见问题走快速的小模型，长文本、代码和深度对话走能力更强的模型。
+选择结果只作用于本轮调用，不修改调用器的状态。
+"""
+
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List
+import logging
+import os
+import re
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    """一个模型等级：使用的模型和回复长度上限"""
+    name: str
+    model: str
+    max_tokens: int
+
+
+# 模型等级配置表，模型名可以用环境变量覆盖。
+# 注意：原来 /api/chat 固定使用 gpt-3.5-turbo 且不限制回复长度；现在标准和高级等级用 gpt-4o，
+# 单价高于原来的模型，每个等级的回复也会在 max_tokens 处截断。要保持原来的成本，
+# 可以把 LLM_MODEL_FAST/STANDARD/ADVANCED 都设为 gpt-3.5-turbo
+MODEL_TIERS = MappingProxyType({
+    tier.name: tier for tier in (
+        ModelTier('fast', os.getenv('LLM_MODEL_FAST', 'gpt-4o-mini'), 500),
+        ModelTier('standard', os.getenv('LLM_MODEL_STANDARD', 'gpt-4o'), 1000),
+        ModelTier('advanced', os.getenv('LLM_MODEL_ADVANCED', 'gpt-4o'), 2000),
+    )
+})
+
+# 支持图片输入的模型，等级对应的模型不支持图片时换成 VISION_FALLBACK_MODEL
+VISION_MODELS = frozenset({'gpt-4o', 'gpt-4o-mini', 'gpt-4-turbo'})
+VISION_FALLBACK_MODEL = 'gpt-4o'
+
+# 快速等级：最后一条用户消息不超过这个长度、对话轮数不超过这个值
+FAST_MAX_CHARS = 60
+FAST_MAX_DEPTH = 6
+
+# 高级等级：输入总长度或对话轮数达到这个值
+ADVANCED_MIN_CHARS = 1500
+ADVANCED_MIN_DEPTH = 12
+
+GREETINGS = ('你好', '您好', '早上好', '晚上好', '在吗', '谢谢', '再见', 'hi', 'hello', 'hey', 'thanks')
+
+# 需要调用工具的问题交给至少标准等级，小模型的工具调用不够可靠
+TOOL_KEYWORDS = ('ai-id', 'ai id', '标识符', '生成id', '天气')
+
+ADVANCED_KEYWORDS = ('代码', '分析', '证明', '推导', '翻译', '总结', '详细', 'code', 'step by step')
+
+CODE_PATTERN = re.compile(r'```|def |class |function\s*\(|=>|#include|SELECT .+ FROM', re.IGNORECASE)
+
+
+@dataclass
+class TurnFeatures:
+    """一轮对话的特征"""
+    chars: int  # 最后一条用户消息的长度
+    total_chars: int  # 用户和助手消息的总长度（不含系统提示）
+    depth: int  # 用户消息数
+    has_image: bool
+    has_file: bool
+    tool_keyword: bool
+    advanced_keyword: bool
+    has_code: bool
+    greeting: bool
+
+
+@dataclass
+class ModelChoice:
+    """本轮选择的模型"""
+    tier: str
+    model: str
+    max_tokens: int
+    features: TurnFeatures
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return ''
+
+
+def _has_image(content: Any) -> bool:
+    return isinstance(content, list) and any(
+        isinstance(part, dict) and part.get('type') == 'image_url' for part in content)
+
+
+def extract_features(messages: List[Dict[str, Any]], has_file: bool = False) -> TurnFeatures:
+    """从消息列表中提取特征，最后一条用户消息是本轮的问题"""
+    user_messages = [message for message in messages if message.get('role') == 'user']
+    last = user_messages[-1] if user_messages else {}
+    text = _text(last.get('content')).strip()
+    lowered = text.lower()
+    return TurnFeatures(
+        chars=len(text),
+        total_chars=sum(len(_text(message.get('content'))) for message in messages
+                        if message.get('role') in ('user', 'assistant')),
+        depth=len(user_messages),
+        has_image=_has_image(last.get('content')) or last.get('type') == 'image',
+        has_file=has_file,
+        tool_keyword=any(keyword in lowered for keyword in TOOL_KEYWORDS),
+        advanced_keyword=any(keyword in lowered for keyword in ADVANCED_KEYWORDS),
+        has_code=bool(CODE_PATTERN.search(text)),
+        greeting=lowered.startswith(GREETINGS),
+    )
+
+
+def classify(features: TurnFeatures) -> str:
+    """按特征决定模型等级"""
+    if (features.has_code or features.advanced_keyword or features.total_chars >= ADVANCED_MIN_CHARS
+            or features.depth >= ADVANCED_MIN_DEPTH):
+        return 'advanced'
+    if features.has_image or features.has_file or features.tool_keyword:
+        return 'standard'
+    if features.depth <= FAST_MAX_DEPTH and (features.greeting or features.chars <= FAST_MAX_CHARS):
+        return 'fast'
+    return 'standard'
+
+
+def resolve_model(tier: str, has_image: bool = False) -> str:
+    """等级对应的模型，有图片输入时保证模型支持图片"""
+    model = MODEL_TIERS[tier].model
+    if has_image and model not in VISION_MODELS:
+        return VISION_FALLBACK_MODEL
+    return model
+
+
+def select_model(messages: List[Dict[str, Any]], has_file: bool = False) -> ModelChoice:
+    """为本轮对话选择模型"""
+    features = extract_features(messages, has_file)
+    tier = classify(features)
+    return ModelChoice(tier, resolve_model(tier, features.has_image), MODEL_TIERS[tier].max_tokens, features)
+
+
+def record_choice(choice: ModelChoice, latency: float) -> None:
+    """记录本轮选择的等级和调用耗时"""
+    metrics.incr(f'model_tier.{choice.tier}.calls')
+    metrics.incr(f'model_tier.{choice.tier}.latency_seconds', latency)
+    logger.info(f"模型分级: {choice.tier} ({choice.model})，输入 {choice.features.chars} 字，"
+                f"第 {choice.features.depth} 轮，耗时 {latency:.2f} 秒")
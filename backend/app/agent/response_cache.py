@@ -0,0 +1,234 @@
+"""
+LLM响应缓存
+按 (模型, 消息, 工具, 温度, 最大长度) 规范化后的哈希精确匹配，带LRU淘汰和过期时间；
+配置了语义向量化器（LLM_CACHE_EMBEDDER=openai）时，精确未命中后再按最后一条用户消息的向量相似度
+匹配近似重复的问题（上下文的其余部分必须完全相同）。哈希向量化不考虑词序，
+"python比java快吗"和"java比python快吗"的相似度为1，所以不用于近似匹配。
+温度过高或包含个人信息的请求不走缓存。
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.utils import metrics
+from .memory_store import Embedder, create_embedder
+
+# 缓存条目数和过期时间（秒）
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 5000))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 6 * 3600))
+
+# 温度高于这个值时回复本身就是随机的，不走缓存
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv('LLM_CACHE_MAX_TEMPERATURE', 0.3))
+
+# 没有指定温度时：多轮对话用 LLM_DEFAULT_TEMPERATURE（不缓存）；
+# 只有一个用户问题的请求（常见问题、新手引导）用 LLM_CACHE_TEMPERATURE，回复可以缓存给其他人复用
+LLM_DEFAULT_TEMPERATURE = float(os.getenv('LLM_DEFAULT_TEMPERATURE', 0.7))
+LLM_CACHE_TEMPERATURE = min(float(os.getenv('LLM_CACHE_TEMPERATURE', 0.2)), LLM_CACHE_MAX_TEMPERATURE)
+
+# 近似匹配的相似度阈值，设为0关闭近似匹配；没有配置 LLM_CACHE_EMBEDDER 时不做近似匹配
+LLM_CACHE_SIMILARITY = float(os.getenv('LLM_CACHE_SIMILARITY', 0.92))
+
+# 每个上下文下参与近似匹配的最大问题数
+SEMANTIC_BUCKET_SIZE = 200
+
+
+def _normalize_text(text: Any) -> Any:
+    if isinstance(text, str):
+        return ' '.join(text.split())
+    return text
+
+
+def _normalize_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留影响回复的字段，并压缩空白"""
+    content = message.get('content')
+    if isinstance(content, list):
+        content = [{**part, 'text': _normalize_text(part['text'])} if 'text' in part else part for part in content]
+    else:
+        content = _normalize_text(content)
+    normalized = {'role': message.get('role'), 'content': content}
+    for key in ('name', 'tool_calls', 'tool_call_id'):
+        if message.get(key):
+            normalized[key] = message[key]
+    return normalized
+
+
+def _digest(value: Any) -> str:
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def request_key(model: str, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None,
+                temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> str:
+    """请求的规范化哈希，空白差异不影响结果"""
+    return _digest({'model': model, 'tools': tools, 'temperature': temperature, 'max_tokens': max_tokens,
+                    'messages': [_normalize_message(message) for message in messages]})
+
+
+def _last_user_text(messages: List[Dict[str, Any]]) -> Optional[str]:
+    if not messages or messages[-1].get('role') != 'user':
+        return None
+    content = messages[-1].get('content')
+    return content if isinstance(content, str) else None
+
+
+def default_temperature(messages: List[Dict[str, Any]], cacheable: bool = True) -> float:
+    """调用方没有指定温度时使用的温度，见 LLM_CACHE_TEMPERATURE"""
+    user_turns = sum(1 for message in messages if message.get('role') == 'user')
+    if cacheable and user_turns <= 1:
+        return LLM_CACHE_TEMPERATURE
+    return LLM_DEFAULT_TEMPERATURE
+
+
+@dataclass
+class _Entry:
+    response: Dict[str, Any]
+    expires_at: float
+    vector: Optional[np.ndarray] = None
+    context_key: Optional[str] = None
+
+
+class ResponseCache:
+    """LLM响应的进程内缓存"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: float = LLM_CACHE_TTL,
+                 similarity: float = LLM_CACHE_SIMILARITY, max_temperature: float = LLM_CACHE_MAX_TEMPERATURE,
+                 embedder: Optional[Embedder] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.max_temperature = max_temperature
+        # 只有传入向量化器时才启用近似匹配
+        self.embedder = embedder if similarity > 0 else None
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # 上下文键 -> 该上下文下缓存过的问题的精确键
+        self._buckets: Dict[str, "OrderedDict[str, None]"] = {}
+        self._lock = threading.Lock()
+
+    def keys_for(self, model: str, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]],
+                 temperature: float, max_tokens: int) -> Tuple[str, Optional[str]]:
+        """返回精确键和上下文键（除最后一条用户消息外的全部参数）"""
+        exact_key = request_key(model, messages, tools, temperature, max_tokens)
+        context_key = None
+        if _last_user_text(messages) is not None:
+            context_key = request_key(model, messages[:-1], tools, temperature, max_tokens)
+        return exact_key, context_key
+
+    def cacheable(self, temperature: float) -> bool:
+        return temperature <= self.max_temperature
+
+    def get(self, exact_key: str, context_key: Optional[str] = None,
+            messages: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """查找缓存的回复，未命中返回None"""
+        response = self._lookup(exact_key, context_key, messages)
+        if response is None:
+            metrics.incr('llm_cache.misses')
+        return response
+
+    def _lookup(self, exact_key: str, context_key: Optional[str],
+                messages: Optional[List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(exact_key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(exact_key)
+                return self._hit(entry, 'exact')
+
+        if self.embedder is None or context_key is None or context_key not in self._buckets:
+            return None
+        text = _last_user_text(messages or [])
+        if text is None:
+            return None
+
+        vector = self.embedder.embed([text])[0]
+        with self._lock:
+            candidates = [
+                self._entries[key] for key in self._buckets.get(context_key, ())
+                if key in self._entries and self._entries[key].expires_at > now
+            ]
+        if not candidates:
+            return None
+        scores = np.stack([candidate.vector for candidate in candidates]) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        return self._hit(candidates[best], 'semantic')
+
+    def _hit(self, entry: _Entry, tier: str) -> Dict[str, Any]:
+        metrics.incr(f'llm_cache.hits.{tier}')
+        metrics.incr('llm_cache.tokens_saved', entry.response.get('usage', {}).get('total_tokens', 0))
+        response = copy.deepcopy(entry.response)
+        response['cached'] = tier
+        return response
+
+    def set(self, exact_key: str, response: Dict[str, Any], context_key: Optional[str] = None,
+            messages: Optional[List[Dict[str, Any]]] = None) -> None:
+        vector = None
+        text = _last_user_text(messages or [])
+        if self.embedder is not None and context_key is not None and text is not None:
+            vector = self.embedder.embed([text])[0]
+
+        entry = _Entry(copy.deepcopy(response), time.monotonic() + self.ttl, vector, context_key)
+        with self._lock:
+            self._entries[exact_key] = entry
+            self._entries.move_to_end(exact_key)
+            if vector is not None:
+                bucket = self._buckets.setdefault(context_key, OrderedDict())
+                bucket[exact_key] = None
+                while len(bucket) > SEMANTIC_BUCKET_SIZE:
+                    bucket.popitem(last=False)
+            while len(self._entries) > self.max_entries:
+                _key, evicted = self._entries.popitem(last=False)
+                self._discard_from_bucket(_key, evicted)
+
+    def _discard_from_bucket(self, key: str, entry: _Entry) -> None:
+        bucket = self._buckets.get(entry.context_key) if entry.context_key else None
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[entry.context_key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """命中率和节省的token数"""
+        data = metrics.snapshot()
+        exact = data.get('llm_cache.hits.exact', 0)
+        semantic = data.get('llm_cache.hits.semantic', 0)
+        misses = data.get('llm_cache.misses', 0)
+        lookups = exact + semantic + misses
+        return {
+            'entries': len(self._entries),
+            'hits_exact': exact,
+            'hits_semantic': semantic,
+            'misses': misses,
+            'bypassed': data.get('llm_cache.bypassed', 0),
+            'hit_rate': round((exact + semantic) / lookups, 4) if lookups else 0.0,
+            'tokens_saved': data.get('llm_cache.tokens_saved', 0),
+        }
+
+
+_default_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """进程内共享的响应缓存，设置 LLM_CACHE_ENABLED=false 关闭"""
+    global _default_cache
+    if os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'false':
+        return None
+    if _default_cache is None:
+        kind = os.getenv('LLM_CACHE_EMBEDDER', '').lower()
+        embedder = create_embedder(kind) if kind == 'openai' else None
+        _default_cache = ResponseCache(embedder=embedder)
+    return _default_cache
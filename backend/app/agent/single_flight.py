@@ -0,0 +1,66 @@
+"""
+请求合并（single-flight）
+同一时刻到达的相同请求只向上游发起一次调用，其余请求等待并共享这次调用的结果。
+所有请求（包括发起调用的请求）拿到的是同一个结果对象，需要修改时由调用方自己复制。
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple
+import threading
+
+from app.utils import metrics
+
+
+class _Call:
+    """一次进行中的同步调用"""
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """按键合并进行中的调用，合并次数记在 <name>.deduplicated 计数器中"""
+
+    def __init__(self, name: str = 'single_flight'):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        metrics.set_gauge(f'{name}.in_flight', lambda: len(self._calls))
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """执行fn，相同键的调用正在进行时等待它的结果
+
+        返回 (结果, 是否共享了其他请求的结果)；fn抛出的异常会同样抛给所有等待者。
+        等待超过timeout秒时不再等待，自己调用fn。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.event.wait(timeout):
+                metrics.incr(f'{self.name}.deduplicated')
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            metrics.incr(f'{self.name}.wait_timeouts')
+            return fn(), False
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+# LLM调用共用的合并器
+llm_flight = SingleFlight('llm_flight')
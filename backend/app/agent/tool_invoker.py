@@ -3,129 +3,125 @@
 负责注册、管理和调用各种工具函数
 """
 
-from typing import Callable, Dict, Any, List, Optional
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import json
-import requests
 import os
 import base64
 from datetime import datetime
 from .image_processor import ImageData, ImageProcessor
+from app.utils import metrics
+from app.utils.circuit_breaker import CircuitOpen, get_breaker
+from app.utils.deadline import has_time, time_left
+
+# 请求剩余时间少于这个值（秒）时跳过工具调用
+TOOL_MIN_SECONDS = float(os.getenv('TOOL_MIN_SECONDS', 2))
+
+@dataclass(frozen=True)
+class ToolSpec:
+    """一个工具：实现函数、预先生成的定义和用于筛选的关键词"""
+    name: str
+    func: Callable
+    definition: Dict[str, Any]
+    keywords: Tuple[str, ...] = ()
+    attachment: Optional[str] = None  # 本轮带有这类附件（image/document）时也提供这个工具
+    schema_chars: int = 0  # 定义序列化后的长度，用于统计省下的提示词
+
+
+def build_tool_spec(name: str, func: Callable, description: str, parameters: Dict[str, Any],
+                    keywords: Tuple[str, ...] = (), attachment: Optional[str] = None) -> ToolSpec:
+    """生成工具定义（OpenAI格式），每个工具只生成一次"""
+    # 过滤出必需的参数（不包含optional=True的参数）
+    required_params = []
+    for k, v in parameters.items():
+        if not isinstance(v, dict) or not v.get("optional", False):
+            required_params.append(k)
+    
+    # 创建不包含optional字段的参数副本
+    clean_parameters = {}
+    for k, v in parameters.items():
+        if isinstance(v, dict):
+            param_copy = v.copy()
+            if "optional" in param_copy:
+                del param_copy["optional"]
+            clean_parameters[k] = param_copy
+        else:
+            clean_parameters[k] = v
+    
+    tool_def = {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": clean_parameters,
+                "required": required_params
+            }
+        }
+    }
+    
+    schema_chars = len(json.dumps(tool_def, ensure_ascii=False))
+    return ToolSpec(name, func, tool_def, tuple(keyword.lower() for keyword in keywords), attachment, schema_chars)
+
 
 class ToolInvoker:
     """工具调度和执行"""
     
     def __init__(self):
-        self.tools: Dict[str, Callable] = {}
-        self.tool_definitions: List[Dict[str, Any]] = []
-        
-        # 注册默认工具
-        self.register_tool(
-            name="get_weather",
-            func=get_weather,
-            description="获取指定城市的天气信息",
-            parameters={
-                "city": {"type": "string", "description": "城市名称，如北京、上海等"},
-                "date": {"type": "string", "description": "日期，如今天、明天等，默认为今天"}
-            }
-        )
-        
-        self.register_tool(
-            name="generate_ai_id",
-            func=generate_ai_id,
-            description="生成AI-ID",
-            parameters={
-                "name": {"type": "string", "description": "AI的名称，可选"}
-            }
-        )
-        
-        self.register_tool(
-            name="generate_frequency",
-            func=generate_frequency,
-            description="生成频率编号",
-            parameters={
-                "ai_id": {"type": "string", "description": "AI-ID"},
-                "personality_type": {"type": "string", "description": "人格类型，默认为P"},
-                "ai_type": {"type": "string", "description": "AI类型，默认为A"}
-            }
-        )
-        
-        self.register_tool(
-            name="analyze_image",
-            func=analyze_image,
-            description="分析图片内容",
-            parameters={
-                "image_data": {"type": "string", "description": "图片的Base64编码或URL"},
-                "analysis_type": {"type": "string", "description": "分析类型，可以是'general'(一般描述), 'objects'(物体检测), 'text'(文字识别)"}
-            }
-        )
-        
-        self.register_tool(
-            name="process_document",
-            func=process_document,
-            description="处理文档文件",
-            parameters={
-                "document_url": {"type": "string", "description": "文档的URL路径，如果不提供，将尝试使用最近上传的文档", "optional": True},
-                "action": {"type": "string", "description": "要执行的操作，可以是'analyze'(分析内容), 'summarize'(生成摘要), 'extract'(提取信息)", "optional": True}
-            }
-        )
-        
-    def register_tool(self, name: str, func: Callable, description: str, parameters: Dict[str, Any]):
-        """注册工具函数"""
-        self.tools[name] = func
-        
-        # 添加工具定义（OpenAI格式）
-        # 过滤出必需的参数（不包含optional=True的参数）
-        required_params = []
-        for k, v in parameters.items():
-            if not isinstance(v, dict) or not v.get("optional", False):
-                required_params.append(k)
-        
-        # 创建不包含optional字段的参数副本
-        clean_parameters = {}
-        for k, v in parameters.items():
-            if isinstance(v, dict):
-                param_copy = v.copy()
-                if "optional" in param_copy:
-                    del param_copy["optional"]
-                clean_parameters[k] = param_copy
-            else:
-                clean_parameters[k] = v
-        
-        tool_def = {
-            "type": "function",
-            "function": {
-                "name": name,
-                "description": description,
-                "parameters": {
-                    "type": "object",
-                    "properties": clean_parameters,
-                    "required": required_params
-                }
-            }
-        }
+        # 工具名 -> 工具，重复注册同名工具时替换原有的定义
+        self.tools: Dict[str, ToolSpec] = {spec.name: spec for spec in DEFAULT_TOOLS}
         
-        self.tool_definitions.append(tool_def)
+    def register_tool(self, name: str, func: Callable, description: str, parameters: Dict[str, Any],
+                      keywords: Tuple[str, ...] = (), attachment: Optional[str] = None):
+        """注册工具函数，keywords 为空时每轮都提供这个工具"""
+        self.tools[name] = build_tool_spec(name, func, description, parameters, keywords, attachment)
         
     def invoke_tool(self, tool_name: str, **kwargs) -> str:
         """执行工具调用"""
         if tool_name not in self.tools:
             return f"工具 {tool_name} 不存在"
+        
+        if not has_time(TOOL_MIN_SECONDS):
+            metrics.incr('tools.skipped_deadline')
+            return f"处理时间不足，已跳过工具 {tool_name}"
             
         try:
-            result = self.tools[tool_name](**kwargs)
+            result = self.tools[tool_name].func(**kwargs)
             return str(result)
         except Exception as e:
             return f"工具调用失败: {str(e)}"
     
     def get_tool_definitions(self) -> List[Dict[str, Any]]:
         """获取所有工具定义"""
-        return self.tool_definitions
+        return [spec.definition for spec in self.tools.values()]
+    
+    def select_tool_definitions(self, user_input: str, attachment: Optional[str] = None) -> List[Dict[str, Any]]:
+        """只返回和本轮问题相关的工具定义，都不相关时返回空列表（不发送工具）"""
+        text = (user_input or "").lower()
+        selected = []
+        skipped_chars = 0
+        for spec in self.tools.values():
+            relevant = (not spec.keywords
+                        or any(keyword in text for keyword in spec.keywords)
+                        or (attachment is not None and spec.attachment == attachment))
+            if relevant:
+                selected.append(spec.definition)
+            else:
+                skipped_chars += spec.schema_chars
+        
+        metrics.incr('tools.selected', len(selected))
+        metrics.incr('tools.skipped', len(self.tools) - len(selected))
+        metrics.incr('tools.schema_chars_saved', skipped_chars)
+        return selected
 
 
 # 默认工具函数实现
 
 def get_weather(city: str, date: str = None) -> str:
     """获取天气信息的工具"""
+    import requests
+    
     try:
         # 从环境变量获取API密钥
         api_key = os.getenv("WEATHER_API_KEY")
@@ -206,8 +202,16 @@ def get_weather(city: str, date: str = None) -> str:
         
         print(f"[DEBUG] 请求URL: {url}")
         
-        # 发送API请求
-        response = requests.get(url, timeout=10)  # 添加超时时间
+        # 发送API请求，超时不超过请求的剩余时间；天气服务故障时熔断，直接返回
+        timeout = time_left(10, '天气查询')
+        weather_breaker = get_breaker('tool.weather')
+        weather_breaker.allow()
+        try:
+            response = requests.get(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            weather_breaker.record(False)
+            raise
+        weather_breaker.record(response.status_code < 500)
         
         print(f"[DEBUG] 响应状态码: {response.status_code}")
         
@@ -264,6 +268,8 @@ def get_weather(city: str, date: str = None) -> str:
         except Exception as e:
             print(f"[ERROR] 数据解析错误: {str(e)}\n数据: {data}")
             return f"解析{city}的天气数据时出错: {str(e)}"
+    except CircuitOpen:
+        return "天气服务暂时不可用，请稍后再试"
     except requests.exceptions.Timeout:
         return f"请求{city}天气信息超时，请稍后再试"
     except requests.exceptions.ConnectionError:
@@ -526,3 +532,61 @@ def process_document(document_url: str = None, action: str = "analyze") -> str:
     except Exception as e:
         logging.exception(f"Error processing document: {str(e)}")
         return f"处理文档时出错: {str(e)}"
+
+
+# 默认工具，定义在导入时生成一次，所有 ToolInvoker 共享
+DEFAULT_TOOLS = (
+    build_tool_spec(
+        name="get_weather",
+        func=get_weather,
+        description="获取指定城市和日期的天气信息",
+        parameters={
+            "city": {"type": "string", "description": "城市名称，如北京、上海、新加坡等"},
+            "date": {"type": "string", "description": "日期，如今天、明天、后天等", "optional": True}
+        },
+        keywords=("天气", "气温", "温度", "下雨", "下雪", "晴", "weather")
+    ),
+    build_tool_spec(
+        name="generate_ai_id",
+        func=generate_ai_id,
+        description="生成唯一的AI-ID标识符",
+        parameters={
+            "name": {"type": "string", "description": "AI的名称（可选）", "optional": True}
+        },
+        # 生成频率编号需要先有AI-ID
+        keywords=("ai-id", "ai id", "aiid", "标识符", "生成id", "频率")
+    ),
+    build_tool_spec(
+        name="generate_frequency",
+        func=generate_frequency,
+        description="基于AI-ID生成频率编号",
+        parameters={
+            "ai_id": {"type": "string", "description": "AI-ID标识符"},
+            "personality_type": {"type": "string", "description": "人格类型代码，默认为P", "optional": True},
+            "ai_type": {"type": "string", "description": "AI类型代码，默认为A", "optional": True}
+        },
+        keywords=("频率", "编号", "frequency")
+    ),
+    build_tool_spec(
+        name="analyze_image",
+        func=analyze_image,
+        description="分析图片内容",
+        parameters={
+            "image_data": {"type": "string", "description": "图片的Base64编码或URL"},
+            "analysis_type": {"type": "string", "description": "分析类型，可以是'general'(一般描述), 'objects'(物体检测), 'text'(文字识别)"}
+        },
+        keywords=("图片", "照片", "图像", "识别", "image", "photo"),
+        attachment="image"
+    ),
+    build_tool_spec(
+        name="process_document",
+        func=process_document,
+        description="处理文档文件",
+        parameters={
+            "document_url": {"type": "string", "description": "文档的URL路径，如果不提供，将尝试使用最近上传的文档", "optional": True},
+            "action": {"type": "string", "description": "要执行的操作，可以是'analyze'(分析内容), 'summarize'(生成摘要), 'extract'(提取信息)", "optional": True}
+        },
+        keywords=("文档", "文件", "摘要", "document", "pdf"),
+        attachment="document"
+    ),
+)
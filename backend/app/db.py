@@ -1,11 +1,20 @@
 import asyncio
+import atexit
 import os
-import time
+import signal
 import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Optional
 from flask import g, current_app
 import surrealdb
 from dotenv import load_dotenv
 
+from app.utils import metrics
+from app.utils.circuit_breaker import HALF_OPEN, get_breaker
+from app.utils.deadline import DeadlineExceeded, time_left
+
 # 加载环境变量
 load_dotenv()
 
@@ -16,185 +25,328 @@ SURREAL_PASS = os.getenv('SURREAL_PASS', '123')
 SURREAL_NS = os.getenv('SURREAL_NS', 'rainbow')
 SURREAL_DB = os.getenv('SURREAL_DB', 'test')
 
-# 全局数据库连接
-_db = None
-_db_lock = threading.Lock()
-_connection_attempts = 0
-_max_connection_attempts = 3
-_connection_retry_delay = 2  # 秒
-_db_pool = {}
-_db_pool_lock = threading.Lock()
+# 连接池：每个进程最多的连接数，以及开始处理请求之前预先建立的连接数
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_POOL_WARMUP = int(os.getenv('DB_POOL_WARMUP', 2))
+
+# 空闲超过这个时间（秒）的连接在使用前先检查是否正常
+DB_IDLE_CHECK_SECONDS = float(os.getenv('DB_IDLE_CHECK_SECONDS', 30))
+
+# 预热连接和进程退出时等待进行中的查询完成的最长时间（秒）
+DB_WARMUP_TIMEOUT = float(os.getenv('DB_WARMUP_TIMEOUT', 10))
+DB_DRAIN_TIMEOUT = float(os.getenv('DB_DRAIN_TIMEOUT', 10))
+
+# 索引由部署步骤 scripts/init_db.py 创建；设为 true 时每个工作进程启动时也检查并创建缺少的索引
+DB_AUTO_SCHEMA = os.getenv('DB_AUTO_SCHEMA', 'false').lower() == 'true'
+
+# 数据库熔断器：连接连续失败时直接拒绝请求，由半开探测决定何时重新连接，不再睡眠重试
+db_breaker = get_breaker('surrealdb')
 
 # 检查连接是否可用
-async def is_connection_alive():
+async def is_connection_alive(db):
     """检查数据库连接是否正常"""
-    global _db
-    if _db is None:
+    if db is None:
         return False
     
     try:
         # 尝试执行一个简单的查询
-        await _db.query('INFO FOR DB')
+        await db.query('INFO FOR DB')
         return True
     except Exception:
         return False
 
-# 初始化数据库连接
-async def init_db_connection():
-    """初始化数据库连接"""
-    global _db, _connection_attempts
-    
-    # 使用锁确保只有一个线程在初始化连接
-    with _db_lock:
-        # 如果连接已存在且正常，直接返回
-        if _db is not None and await is_connection_alive():
-            return _db
-        
-        # 检查连接尝试次数
-        if _connection_attempts >= _max_connection_attempts:
-            print(f"Maximum connection attempts ({_max_connection_attempts}) reached. Using mock mode.")
-            return None
-        
-        # 尝试连接
-        _connection_attempts += 1
-        try:
-            # 如果已有连接，先关闭
-            if _db is not None:
+async def _connect():
+    """建立一个新连接"""
+    db = surrealdb.Surreal()
+    await db.connect(SURREAL_URL)
+    await db.signin({"user": SURREAL_USER, "pass": SURREAL_PASS})
+    await db.use(SURREAL_NS, SURREAL_DB)
+    return db
+
+async def _close_quietly(db):
+    try:
+        await db.close()
+    except Exception:
+        pass
+
+
+class _PooledConnection:
+    __slots__ = ('db', 'last_used')
+
+    def __init__(self, db):
+        self.db = db
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """进程内的数据库连接池
+
+    所有方法都在数据库事件循环线程中执行，不需要加锁；连接在进程的整个生命周期内复用，
+    只有检查失败、查询被取消（连接上可能还有未读取的响应）或进程退出时才关闭。
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE, idle_check: float = DB_IDLE_CHECK_SECONDS):
+        self.size = size
+        self.idle_check = idle_check
+        self._idle: Deque[_PooledConnection] = deque()
+        self._in_use = 0
+        self._opening = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._closing_tasks = set()
+        self.closed = False
+
+    async def acquire(self) -> _PooledConnection:
+        """取出一个连接，没有空闲连接且已达上限时等待归还"""
+        with db_breaker.guard():
+            # 半开状态下这次获取就是探测：空闲连接要实际检查过才算数据库已经恢复
+            probing = db_breaker.state == HALF_OPEN
+            while True:
+                if self.closed:
+                    raise RuntimeError("数据库连接池已关闭")
+                if self._idle:
+                    # 优先使用最近归还的连接，很少使用的连接自然空闲下来
+                    conn = self._idle.pop()
+                    stale = probing or time.monotonic() - conn.last_used > self.idle_check
+                    if stale and not await is_connection_alive(conn.db):
+                        metrics.incr('db_pool.stale')
+                        await _close_quietly(conn.db)
+                        continue
+                    break
+                if self._in_use + self._opening < self.size:
+                    self._opening += 1
+                    try:
+                        conn = _PooledConnection(await _connect())
+                    finally:
+                        self._opening -= 1
+                    metrics.incr('db_pool.connects')
+                    break
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
                 try:
-                    await _db.close()
-                except Exception:
-                    pass
-            
-            # 创建新连接
-            _db = surrealdb.Surreal()
-            await _db.connect(SURREAL_URL)
-            await _db.signin({"user": SURREAL_USER, "pass": SURREAL_PASS})
-            await _db.use(SURREAL_NS, SURREAL_DB)
-            print(f"Connected to SurrealDB at {SURREAL_URL} (attempt {_connection_attempts})")
-            
-            # 重置连接尝试计数
-            _connection_attempts = 0
-            return _db
-        except Exception as e:
-            print(f"Error connecting to SurrealDB (attempt {_connection_attempts}): {e}")
-            
-            # 如果还有尝试次数，等待一段时间后重试
-            if _connection_attempts < _max_connection_attempts:
-                print(f"Retrying in {_connection_retry_delay} seconds...")
-                time.sleep(_connection_retry_delay)
-                return await init_db_connection()
-            
-            return None
+                    await waiter
+                finally:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+        self._in_use += 1
+        return conn
+
+    def release(self, conn: _PooledConnection, reusable: bool = True, suspect: bool = False) -> None:
+        """归还连接；reusable=False 时关闭连接，suspect=True 时下次使用前先检查"""
+        self._in_use -= 1
+        if reusable and not self.closed:
+            conn.last_used = 0.0 if suspect else time.monotonic()
+            self._idle.append(conn)
+        else:
+            task = asyncio.get_running_loop().create_task(_close_quietly(conn.db))
+            self._closing_tasks.add(task)
+            task.add_done_callback(self._closing_tasks.discard)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def warm_up(self, count: int) -> int:
+        """预先建立连接，返回当前的空闲连接数"""
+        async def open_one():
+            with db_breaker.guard():
+                self._opening += 1
+                try:
+                    conn = _PooledConnection(await _connect())
+                finally:
+                    self._opening -= 1
+            self._idle.append(conn)
+
+        missing = min(count, self.size) - len(self._idle) - self._in_use - self._opening
+        if missing > 0:
+            results = await asyncio.gather(*(open_one() for _ in range(missing)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    print(f"Error warming up SurrealDB connection: {result}")
+        return len(self._idle)
+
+    async def close(self, timeout: float = DB_DRAIN_TIMEOUT) -> None:
+        """不再发出连接，等待进行中的查询完成后关闭所有连接"""
+        self.closed = True
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        deadline = time.monotonic() + timeout
+        while self._in_use and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._in_use:
+            print(f"{self._in_use} SurrealDB queries still running after {timeout} seconds, closing anyway")
+        idle, self._idle = list(self._idle), deque()
+        await asyncio.gather(*(_close_quietly(conn.db) for conn in idle), *self._closing_tasks)
+
+    def stats(self):
+        return {'size': self.size, 'idle': len(self._idle), 'in_use': self._in_use,
+                'waiting': len(self._waiters)}
+
+
+class _Lease:
+    """一次 run_async 使用的连接"""
+    __slots__ = ('pool', 'connection')
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.connection: Optional[_PooledConnection] = None
+
+
+_lease: ContextVar[Optional[_Lease]] = ContextVar('db_lease', default=None)
+
+# 每个进程一个常驻的事件循环线程，所有连接都属于这个事件循环；fork出的子进程重新创建
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_pool: Optional[ConnectionPool] = None
+_loop_lock = threading.Lock()
+
+
+def _get_pool():
+    """当前进程的事件循环和连接池，第一次使用时创建"""
+    global _loop, _loop_pid, _pool
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            # 父进程的事件循环线程不会被fork到子进程，父进程的连接也不能共用
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='surrealdb-loop', daemon=True).start()
+            _loop_pid = os.getpid()
+            _pool = ConnectionPool()
+            metrics.set_gauge('db_pool.idle', lambda: len(_pool._idle) if _pool else 0)
+            metrics.set_gauge('db_pool.in_use', lambda: _pool._in_use if _pool else 0)
+        return _loop, _pool
+
 
 # 异步获取数据库连接
 async def get_db():
-    """获取数据库连接"""
-    global _db_pool
-    
-    # 获取当前线程 ID
-    thread_id = threading.get_ident()
-    
-    # 使用锁确保线程安全
-    with _db_pool_lock:
-        # 检查这个线程是否已有连接
-        if thread_id in _db_pool and _db_pool[thread_id] is not None:
-            # 检查连接是否正常
-            try:
-                await _db_pool[thread_id].query('INFO FOR DB')
-                return _db_pool[thread_id]
-            except Exception:
-                # 如果连接出错，删除并创建新连接
-                try:
-                    await _db_pool[thread_id].close()
-                except Exception:
-                    pass
-                del _db_pool[thread_id]
-        
-        # 创建新连接
-        try:
-            # 创建新连接
-            db = surrealdb.Surreal()
-            await db.connect(SURREAL_URL)
-            await db.signin({"user": SURREAL_USER, "pass": SURREAL_PASS})
-            await db.use(SURREAL_NS, SURREAL_DB)
-            print(f"Created new connection for thread {thread_id}")
-            
-            # 将连接存入连接池
-            _db_pool[thread_id] = db
-            return db
-        except Exception as e:
-            print(f"Error creating connection for thread {thread_id}: {e}")
-            # 如果创建失败，尝试使用全局连接
-            if _db is not None and await is_connection_alive():
-                return _db
-            return await init_db_connection()
-
-# 异步关闭数据库连接
-async def close_db():
-    """关闭数据库连接"""
-    global _db, _db_pool
-    
-    # 关闭全局连接
-    if _db is not None:
+    """获取当前数据库操作使用的连接
+
+    同一次 run_async 中多次调用返回同一个连接，操作结束后自动归还连接池。
+    数据库不可用时抛出异常，熔断器打开期间直接抛出 CircuitOpen。
+    """
+    lease = _lease.get()
+    if lease is None:
+        raise RuntimeError("get_db() 只能在 run_async 执行的协程中调用")
+    if lease.connection is None:
+        lease.connection = await lease.pool.acquire()
+    return lease.connection.db
+
+async def _run(coro, pool: ConnectionPool, timeout: Optional[float]):
+    """在数据库事件循环中执行一次操作，结束后归还使用的连接"""
+    lease = _Lease(pool)
+    _lease.set(lease)
+    reusable, suspect = True, False
+    try:
+        if timeout is None:
+            return await coro
         try:
-            print("Closing global SurrealDB connection...")
-            await _db.close()
-            _db = None
-            print("Global SurrealDB connection closed")
-        except Exception as e:
-            print(f"Error closing global SurrealDB connection: {e}")
-    
-    # 关闭连接池中的所有连接
-    with _db_pool_lock:
-        for thread_id, conn in list(_db_pool.items()):
-            if conn is not None:
-                try:
-                    print(f"Closing SurrealDB connection for thread {thread_id}...")
-                    await conn.close()
-                    print(f"SurrealDB connection for thread {thread_id} closed")
-                except Exception as e:
-                    print(f"Error closing SurrealDB connection for thread {thread_id}: {e}")
-                finally:
-                    _db_pool[thread_id] = None
-        print("Connection pool cleared")
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            reusable = False
+            raise DeadlineExceeded('数据库')
+    except asyncio.CancelledError:
+        reusable = False
+        raise
+    except Exception:
+        suspect = True
+        raise
+    finally:
+        if lease.connection is not None:
+            pool.release(lease.connection, reusable, suspect)
 
 # 同步包装器，将异步操作转换为同步操作
 def run_async(async_func):
-    """运行异步函数并返回结果"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    """在进程的数据库事件循环中运行协程并等待结果，可以在任意线程中调用
+
+    请求设置了截止时间时，数据库操作最多使用剩余的时间。
+    """
+    try:
+        timeout = time_left(None, '数据库')
+    except DeadlineExceeded:
+        async_func.close()
+        raise
+    loop, pool = _get_pool()
+    return asyncio.run_coroutine_threadsafe(_run(async_func, pool, timeout), loop).result()
+
+def warm_up(count: int = DB_POOL_WARMUP) -> int:
+    """预先建立连接，返回空闲连接数"""
+    loop, pool = _get_pool()
+    return asyncio.run_coroutine_threadsafe(pool.warm_up(count), loop).result(DB_WARMUP_TIMEOUT)
+
+def init_schema() -> bool:
+    """创建各表缺少的索引、分析器和字段定义（见 app/models/schema.py），可以重复执行"""
+    from app.models.schema import init_all_schemas
+
+    async def _init():
+        return await init_all_schemas(await get_db())
+
+    return run_async(_init())
+
+def shutdown_db(timeout: float = DB_DRAIN_TIMEOUT) -> None:
+    """等待进行中的查询完成后关闭所有连接并停止事件循环，进程退出时调用"""
+    global _loop, _pool
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            return
+        loop, pool = _loop, _pool
+        _loop, _pool = None, None
     try:
-        return loop.run_until_complete(async_func)
+        asyncio.run_coroutine_threadsafe(pool.close(timeout), loop).result(timeout + 5)
+        print("SurrealDB connections closed")
+    except Exception as e:
+        print(f"Error closing SurrealDB connections: {e}")
     finally:
-        loop.close()
+        loop.call_soon_threadsafe(loop.stop)
+
+_shutdown_hooks_pid: Optional[int] = None
+
+def _install_shutdown_hooks():
+    """进程退出时排空连接池；收到SIGTERM时先交给原来的处理函数（如WSGI服务器的优雅退出）"""
+    global _shutdown_hooks_pid
+    if _shutdown_hooks_pid == os.getpid():
+        return
+    _shutdown_hooks_pid = os.getpid()
+    atexit.register(shutdown_db)
+    
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+    
+    def handle_sigterm(signum, frame):
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            # 默认处理会直接结束进程，不会执行 atexit；改为正常退出，退出时排空连接池
+            raise SystemExit(0)
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
 # 初始化数据库
 def init_db(app):
-    """初始化数据库"""
-    # 在应用启动时初始化数据库连接
-    with app.app_context():
-        try:
-            run_async(init_db_connection())
-            print("Database initialized successfully")
-        except Exception as e:
-            print(f"Failed to initialize database: {e}")
+    """初始化数据库
+
+    连接池在每个进程中只建立一次，开始处理请求之前预热 DB_POOL_WARMUP 个连接；
+    连接在请求之间复用，进程退出时排空进行中的查询后关闭。
+    DB_AUTO_SCHEMA 开启时同时创建缺少的索引，已存在的索引不会重建。
+    """
+    if app.extensions.get('surrealdb') == os.getpid():
+        return
+    app.extensions['surrealdb'] = os.getpid()
     
-    # 注册应用关闭时的回调
-    @app.teardown_appcontext
-    def teardown_db(exception=None):
-        try:
-            run_async(close_db())
-        except Exception as e:
-            print(f"Error in teardown_db: {e}")
+    try:
+        idle = warm_up()
+        print(f"Database initialized successfully ({idle} connections ready)")
+        if DB_AUTO_SCHEMA and not init_schema():
+            print("Some database indexes could not be created, see the messages above")
+    except Exception as e:
+        print(f"Failed to initialize database: {e}")
+    _install_shutdown_hooks()
 
 # 同步创建数据
 def create(table, data):
     """在指定表中创建数据"""
     async def _create():
         db = await get_db()
-        if db is None:
-            print("Using mock mode for create operation")
-            return data
         
         try:
             result = await db.create(table, data)
@@ -210,9 +362,6 @@ def query(table, condition=None):
     """查询指定表中的数据"""
     async def _query():
         db = await get_db()
-        if db is None:
-            print("Using mock mode for query operation")
-            return []
         
         # 根据条件执行查询
         query_str = ""
@@ -279,9 +428,6 @@ def update(table, id, data):
     """
     async def _update():
         db = await get_db()
-        if db is None:
-            print("Using mock mode for update operation")
-            return data
         
         try:
             # 使用SurrealDB的update方法更新记录
@@ -293,6 +439,33 @@ def update(table, id, data):
     
     return run_async(_update())
 
+# 同步执行原始SurrealQL语句
+def execute(sql, vars=None):
+    """执行原始SurrealQL语句（支持参数绑定）
+
+    Args:
+        sql (str): SurrealQL语句，可以包含多条语句
+        vars (dict): 绑定到语句中的参数，如 {'user_id': 'users:abc'}
+
+    Returns:
+        list: 每条语句的结果列表
+    """
+    async def _execute():
+        db = await get_db()
+
+        result = await db.query(sql, vars)
+        statements = []
+        for statement in result or []:
+            if isinstance(statement, dict) and 'result' in statement:
+                if statement.get('status', 'OK') != 'OK':
+                    raise RuntimeError(f"SurrealQL statement failed: {statement.get('result')}")
+                statements.append(statement['result'])
+            else:
+                statements.append(statement)
+        return statements
+
+    return run_async(_execute())
+
 
 # 创建一个数据库会话对象，用于兼容SQLAlchemy风格的代码
 class DBSession:
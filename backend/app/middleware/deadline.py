@@ -0,0 +1,104 @@
+"""
+请求截止时间中间件
+请求进入视图函数之前按接口分组和VIP等级设置处理时间预算，请求结束时清除；
+超时抛出的 DeadlineExceeded 统一返回504。
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Tuple
+import os
+
+from flask import g, jsonify, request
+
+from app.middleware.rate_limit import identify_request
+from app.models.enums import VIPLevel
+from app.utils import metrics
+from app.utils.deadline import DeadlineExceeded, reset_deadline, set_deadline
+
+# 没有匹配到规则的接口使用的时间预算（秒），设为0不限制
+REQUEST_DEADLINE_DEFAULT = float(os.getenv('REQUEST_DEADLINE_DEFAULT', 30))
+
+
+@dataclass(frozen=True)
+class DeadlineRule:
+    """一组接口的时间预算：各VIP等级的请求最多处理多少秒"""
+    name: str
+    endpoints: Tuple[str, ...]
+    seconds: Dict[VIPLevel, float]
+
+    def seconds_for(self, vip_level: VIPLevel) -> float:
+        return self.seconds.get(vip_level, self.seconds[VIPLevel.free])
+
+
+# 时间预算规则，按Flask端点名匹配；付费等级使用更大的模型和更长的回复，预算也更长
+DEADLINE_RULES = (
+    DeadlineRule(
+        name='llm',
+        endpoints=(
+            'chat.chat', 'chat.chat_agent',
+            'agent.chat_agent', 'agent.chat_with_file', 'agent.chat_with_image',
+            'image.analyze_image_route',
+        ),
+        seconds={
+            VIPLevel.free: 30,
+            VIPLevel.pro: 45,
+            VIPLevel.premium: 60,
+            VIPLevel.ultimate: 90,
+            VIPLevel.team: 90,
+        },
+    ),
+    DeadlineRule(
+        name='search',
+        endpoints=('chat_history.search_chat_messages',),
+        seconds={VIPLevel.free: 10},
+    ),
+)
+
+
+class DeadlineMiddleware:
+    """在 before_request 中设置截止时间"""
+
+    def __init__(self, rules=DEADLINE_RULES, default: float = REQUEST_DEADLINE_DEFAULT):
+        self.rules = {endpoint: rule for rule in rules for endpoint in rule.endpoints}
+        self.default = default
+
+    def init_app(self, app):
+        app.before_request(self.start_request)
+        app.teardown_request(self.end_request)
+        app.register_error_handler(DeadlineExceeded, self.handle_exceeded)
+        app.extensions['deadline'] = self
+
+    def budget_for_request(self) -> float:
+        rule = self.rules.get(request.endpoint)
+        if rule is None:
+            return self.default
+        _identity, vip_level = identify_request()
+        return rule.seconds_for(vip_level)
+
+    def start_request(self):
+        if request.method == 'OPTIONS':
+            return None
+        g.deadline_token = set_deadline(self.budget_for_request())
+        return None
+
+    def end_request(self, exception=None):
+        token = g.pop('deadline_token', None)
+        if token is not None:
+            try:
+                reset_deadline(token)
+            except ValueError:
+                # 令牌来自另一个上下文（如流式响应在其他线程结束），直接清除
+                set_deadline(None)
+
+    def handle_exceeded(self, error: DeadlineExceeded):
+        metrics.incr('deadline.requests_timed_out')
+        response = jsonify({'error': str(error)})
+        response.status_code = 504
+        return response
+
+
+def init_deadlines(app, rules=DEADLINE_RULES):
+    """为应用注册请求截止时间中间件"""
+    middleware = DeadlineMiddleware(rules)
+    middleware.init_app(app)
+    return middleware
@@ -0,0 +1,293 @@
+"""
+令牌桶限流中间件
+在视图函数执行之前按 用户/IP + 接口 限流，超限请求直接返回429，不会走到LLM调用和数据库写入。
+限额按路由分组配置，并按VIP等级区分；后端可以是进程内存，也可以换成多个worker共享的SurrealDB。
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import logging
+import math
+import os
+import threading
+import time
+
+import jwt
+from flask import current_app, g, jsonify, request
+
+from app.db import execute
+from app.models.enums import VIPLevel
+from app.models.quota import parse_vip_level
+from app.utils.quota_utils import consume_quota, get_vip_level
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """一组接口的限流规则：每个等级在 period 秒内最多 limit 次请求（允许同等数量的突发）"""
+    name: str
+    endpoints: Tuple[str, ...]
+    limits: Dict[VIPLevel, Tuple[int, float]]
+
+    def limit_for(self, vip_level: VIPLevel) -> Tuple[int, float]:
+        return self.limits.get(vip_level, self.limits[VIPLevel.free])
+
+
+# 限流规则，按Flask端点名匹配
+RATE_LIMIT_RULES = (
+    RateLimitRule(
+        name='llm',
+        endpoints=(
+            'chat.chat', 'chat.chat_agent', 'chat.chat_simple',
+            'agent.chat_agent', 'agent.chat_with_file', 'agent.chat_with_image',
+            'image.analyze_image_route',
+        ),
+        limits={
+            VIPLevel.free: (10, 60),
+            VIPLevel.pro: (30, 60),
+            VIPLevel.premium: (60, 60),
+            VIPLevel.ultimate: (120, 60),
+            VIPLevel.team: (300, 60),
+        },
+    ),
+    RateLimitRule(
+        name='upload',
+        endpoints=('file.upload_file', 'image.upload_image', 'image.handle_base64_image'),
+        limits={
+            VIPLevel.free: (5, 60),
+            VIPLevel.pro: (15, 60),
+            VIPLevel.premium: (30, 60),
+            VIPLevel.ultimate: (60, 60),
+            VIPLevel.team: (120, 60),
+        },
+    ),
+    RateLimitRule(
+        name='auth',
+        endpoints=('auth.login', 'auth.register', 'auth.verify_invite_code'),
+        limits={VIPLevel.free: (10, 300)},
+    ),
+)
+
+
+class MemoryRateLimitBackend:
+    """进程内令牌桶，适用于单进程部署和开发环境"""
+
+    def __init__(self, max_keys: int = 100000):
+        self._buckets: Dict[str, list] = {}  # key -> [剩余令牌, 更新时间, 桶回满的时间]
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def consume(self, key: str, capacity: int, period: float, cost: int = 1):
+        """尝试从桶中取出令牌，返回 (是否允许, 剩余令牌, 需要等待的秒数)"""
+        rate = capacity / period
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                tokens = float(capacity)
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+
+        retry_after = 0.0 if allowed else (cost - tokens) / rate
+        return allowed, int(tokens), retry_after
+
+    def _prune(self, now: float) -> None:
+        # 已经回满的桶与不存在的桶等价，可以直接丢弃
+        for key in [k for k, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+
+
+class RateLimitConflict(Exception):
+    """同一个桶上的并发请求在事务提交时发生了写冲突"""
+
+
+class SurrealRateLimitBackend:
+    """基于SurrealDB记录的令牌桶，多个worker和多台机器共享同一份限额
+
+    读取、补充和扣减在一个事务里完成，同一个桶上的并发请求发生写冲突时抛出 RateLimitConflict，
+    中间件按超限处理（冲突本身说明同一个用户正在并发地打这个接口）。
+    """
+
+    CONSUME_QUERY = """
+    BEGIN TRANSACTION;
+    LET $bucket = (SELECT tokens, updated_at FROM type::thing('rate_limit', $key))[0];
+    LET $tokens = math::min([$capacity, ($bucket.tokens ?? $capacity) + ($now - ($bucket.updated_at ?? $now)) * $rate]);
+    LET $allowed = $tokens >= $cost;
+    LET $left = IF $allowed THEN $tokens - $cost ELSE $tokens END;
+    UPDATE type::thing('rate_limit', $key) SET
+        tokens = $left, updated_at = $now, expires_at = $now + ($capacity - $left) / $rate
+    RETURN NONE;
+    RETURN { allowed: $allowed, tokens: $left };
+    COMMIT TRANSACTION;
+    """
+
+    def consume(self, key: str, capacity: int, period: float, cost: int = 1):
+        rate = capacity / period
+        try:
+            results = execute(self.CONSUME_QUERY, {
+                'key': key,
+                'capacity': capacity,
+                'rate': rate,
+                'cost': cost,
+                'now': time.time(),
+            })
+        except RuntimeError as e:
+            # 事务失败时每条语句的错误信息中都带有提交失败的原因
+            if 'conflict' in str(e).lower():
+                raise RateLimitConflict(key) from e
+            raise
+        if not results:
+            # 模拟模式下没有数据库，不限流
+            return True, capacity, 0.0
+
+        outcome = results[-1] or {}
+        tokens = outcome.get('tokens', capacity)
+        allowed = bool(outcome.get('allowed'))
+        retry_after = 0.0 if allowed else (cost - tokens) / rate
+        return allowed, int(tokens), retry_after
+
+
+def _create_backend():
+    if os.getenv('RATE_LIMIT_BACKEND', 'memory') == 'surreal':
+        return SurrealRateLimitBackend()
+    return MemoryRateLimitBackend()
+
+
+def identify_request() -> Tuple[str, VIPLevel]:
+    """从JWT中取出用户，等级以数据库为准；没有有效令牌时按IP识别，等级为Free
+
+    用户的当前等级由 get_vip_level 读取并在进程内缓存，Webhook完成的升级、会员到期和管理员调整
+    都不需要用户换新令牌；数据库不可用时才退回令牌中的等级（会员到期后按Free处理）。
+    """
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        try:
+            payload = jwt.decode(auth_header[7:], current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            payload = None
+        if payload and payload.get('user_id'):
+            identity = f"user:{payload['user_id']}"
+            try:
+                level = get_vip_level(payload['user_id'])
+            except Exception as e:
+                logger.warning(f"读取用户等级失败，使用令牌中的等级: {str(e)}")
+                level = None
+            if level is not None:
+                return identity, level
+            vip_expiry = payload.get('vip_expiry')
+            if vip_expiry and vip_expiry < datetime.utcnow().isoformat():
+                return identity, VIPLevel.free
+            return identity, parse_vip_level(payload.get('vip_level'))
+
+    # 部署在反向代理后面时由 ProxyFix（PROXY_FIX_HOPS，见 app/__init__.py）还原真实地址，
+    # 这里不直接信任客户端传来的 X-Forwarded-For
+    return f"ip:{request.remote_addr}", VIPLevel.free
+
+
+def authenticated_user_id() -> Optional[str]:
+    """请求带有有效令牌时返回其中的用户ID，否则返回None；请求体中的 user_id 不能作为身份"""
+    identity, _level = identify_request()
+    return identity[len('user:'):] if identity.startswith('user:') else None
+
+
+# 配额用完时返回的提示
+QUOTA_EXCEEDED_MESSAGES = {
+    'chat': 'Daily chat limit reached',
+    'lio': 'Daily LIO limit reached',
+    'invite': 'Weekly invite limit reached',
+    'ai_usage': 'Daily AI usage limit reached',
+}
+
+
+def enforce_quota(kind: str = 'chat'):
+    """为带有效令牌的请求扣减一次配额，配额用完时返回429响应，否则返回None
+
+    匿名请求没有配额，只受上面按IP的限流约束；配额库不可用时和限流后端一样放行。
+    """
+    user_id = authenticated_user_id()
+    if user_id is None:
+        return None
+    try:
+        status = consume_quota(user_id, kind)
+    except Exception as e:
+        logger.warning(f"配额检查失败，放行请求 ({kind}, {user_id}): {str(e)}")
+        return None
+    if status.allowed:
+        return None
+
+    wait = (datetime.fromisoformat(status.resets_at) - datetime.utcnow()).total_seconds()
+    response = jsonify({'error': QUOTA_EXCEEDED_MESSAGES.get(kind, 'Quota exceeded'), 'quota': status.to_dict()})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+class RateLimiter:
+    """按端点查找规则并在 before_request 中执行限流"""
+
+    def __init__(self, rules=RATE_LIMIT_RULES, backend=None):
+        self.backend = backend or _create_backend()
+        self.rules = {endpoint: rule for rule in rules for endpoint in rule.endpoints}
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', os.getenv('RATE_LIMIT_ENABLED', 'true').lower() != 'false')
+        app.before_request(self.check_request)
+        app.after_request(self.add_headers)
+        app.extensions['rate_limiter'] = self
+
+    def check_request(self):
+        if request.method == 'OPTIONS' or not current_app.config.get('RATE_LIMIT_ENABLED', True):
+            return None
+
+        rule = self.rules.get(request.endpoint)
+        if rule is None:
+            return None
+
+        identity, vip_level = identify_request()
+        capacity, period = rule.limit_for(vip_level)
+        key = f"{rule.name}:{request.endpoint}:{identity}"
+
+        try:
+            allowed, remaining, retry_after = self.backend.consume(key, capacity, period)
+        except RateLimitConflict:
+            # 同一个桶上的并发请求，提交冲突的一方按超限处理，稍后重试即可
+            allowed, remaining, retry_after = False, 0, 1.0
+        except Exception as e:
+            # 限流后端不可用时放行，不能因为限流把整个接口拖垮
+            logger.warning(f"限流检查失败，放行请求 {key}: {str(e)}")
+            return None
+
+        g.rate_limit = (capacity, remaining)
+        if allowed:
+            return None
+
+        wait = max(1, math.ceil(retry_after))
+        response = jsonify({'error': 'Too many requests', 'retry_after': wait})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(wait)
+        return response
+
+    def add_headers(self, response):
+        rate_limit = g.pop('rate_limit', None)
+        if rate_limit:
+            capacity, remaining = rate_limit
+            response.headers['X-RateLimit-Limit'] = str(capacity)
+            response.headers['X-RateLimit-Remaining'] = str(remaining)
+        return response
+
+
+def init_rate_limiter(app, backend=None):
+    """为应用注册限流中间件"""
+    limiter = RateLimiter(backend=backend)
+    limiter.init_app(app)
+    return limiter
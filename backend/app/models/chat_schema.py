@@ -2,38 +2,25 @@
 聊天和消息的数据模型定义
 """
 
+from app.models.schema import apply_schema
+
 # SurrealDB 聊天表定义
+# 聊天和消息表保持SCHEMALESS：时间字段由应用写入ISO格式的字符串（字典序就是时间顺序），
+# chat_id 保存为 'chat:<id>' 字符串，按类型约束的 SCHEMAFULL 定义会拒绝这些写入
 CHAT_SCHEMA = """
--- 聊天表定义
-DEFINE TABLE chat SCHEMAFULL;
-
-DEFINE FIELD user_id ON chat TYPE string ASSERT $value != NONE;
-DEFINE FIELD title ON chat TYPE string ASSERT $value != NONE; -- 标题不能为空
-DEFINE FIELD last_message_at ON chat TYPE datetime;
-DEFINE FIELD last_message_preview ON chat TYPE string;
-DEFINE FIELD created_at ON chat TYPE datetime DEFAULT time::now();
-DEFINE FIELD model_used ON chat TYPE string; -- 例如 'gemini-pro'
-DEFINE FIELD is_archived ON chat TYPE bool DEFAULT false;
-DEFINE FIELD is_pinned ON chat TYPE bool DEFAULT false;
-
--- 为user_id和last_message_at创建索引，方便按用户查询和排序
-DEFINE INDEX idx_user_last_message ON chat FIELDS user_id, last_message_at DESC;
+-- 聊天列表按用户过滤并按最后消息时间排序
+DEFINE INDEX idx_user_last_message ON chat FIELDS user_id, last_message_at;
 """
 
 # SurrealDB 消息表定义
 MESSAGE_SCHEMA = """
--- 消息表定义
-DEFINE TABLE message SCHEMAFULL;
-
-DEFINE FIELD chat_id ON message TYPE record<chat> ASSERT $value != NONE;
-DEFINE FIELD role ON message TYPE string ASSERT $value IN ['user', 'assistant', 'system'];
-DEFINE FIELD content ON message TYPE string ASSERT $value != NONE;
-DEFINE FIELD timestamp ON message TYPE datetime DEFAULT time::now();
-DEFINE FIELD token_count ON message TYPE int;
-DEFINE FIELD metadata ON message TYPE object;
+-- 按会话查询消息并按时间排序
+DEFINE INDEX idx_chat_messages ON message FIELDS chat_id, timestamp;
 
--- 为chat_id和timestamp创建索引，方便按会话查询和按时间排序
-DEFINE INDEX idx_chat_messages ON message FIELDS chat_id, timestamp ASC;
+-- 全文索引：search_text 已按词用空格分隔（见 app/utils/search_utils.py），这里只按空格切分并转小写，用BM25排序
+DEFINE ANALYZER message_search TOKENIZERS blank FILTERS lowercase;
+DEFINE INDEX idx_message_search ON message FIELDS search_text SEARCH ANALYZER message_search BM25;
+DEFINE INDEX idx_message_user ON message FIELDS user_id, timestamp;
 """
 
 # 初始化数据库模式的函数
@@ -41,12 +28,12 @@ async def init_chat_schema(db):
     """初始化聊天和消息的数据库模式"""
     try:
         # 创建聊天表
-        await db.query(CHAT_SCHEMA)
-        print("聊天表模式创建成功")
+        applied, skipped = await apply_schema(db, CHAT_SCHEMA)
+        print(f"聊天表模式创建成功（执行 {applied} 条，跳过已存在的 {skipped} 条）")
         
         # 创建消息表
-        await db.query(MESSAGE_SCHEMA)
-        print("消息表模式创建成功")
+        applied, skipped = await apply_schema(db, MESSAGE_SCHEMA)
+        print(f"消息表模式创建成功（执行 {applied} 条，跳过已存在的 {skipped} 条）")
         
         return True
     except Exception as e:
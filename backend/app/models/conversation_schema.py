@@ -0,0 +1,22 @@
+"""
+对话表的数据模型定义
+"""
+
+from app.models.schema import apply_schema
+
+# SurrealDB 对话表索引定义（对话表保持SCHEMALESS）
+CONVERSATION_SCHEMA = """
+-- 对话列表按用户过滤并按最后更新时间倒序分页，直接走索引
+DEFINE INDEX idx_conversations_user_last_updated ON conversations FIELDS user_id, last_updated;
+"""
+
+# 初始化数据库模式的函数
+async def init_conversation_schema(db):
+    """初始化对话表的数据库模式"""
+    try:
+        applied, skipped = await apply_schema(db, CONVERSATION_SCHEMA)
+        print(f"对话表模式创建成功（执行 {applied} 条，跳过已存在的 {skipped} 条）")
+        return True
+    except Exception as e:
+        print(f"初始化对话模式失败: {str(e)}")
+        return False
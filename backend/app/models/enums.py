@@ -23,6 +23,12 @@ class AdminPosition(enum.Enum):
     technical = "technical"    # 技术
     management = "management"  # 管理员
 
+class RelationshipStatus(enum.Enum):
+    ACTIVE = "active"  # 近 7 天内有持续有效对话
+    COOLING = "cooling"  # 近 7 天内对话不足但未沉寂
+    SILENT = "silent"  # 超过 14 天无有效对话
+    BROKEN = "broken"  # 人类主动解绑或 AI 主动休眠
+
 class AdminLevel(enum.Enum):
     super_admin = 1  # 超级管理员
     admin = 2        # 管理员
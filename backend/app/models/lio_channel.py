@@ -37,16 +37,19 @@ class LIOChannel(db.Model):
     premium_daily_limit = db.Column(db.Integer, default=30)
     ultimate_daily_limit = db.Column(db.Integer, default=-1)  # -1表示无限
     
+    # VIP等级 -> 对应的每日限制字段
+    DAILY_LIMIT_FIELDS = {
+        VIPLevel.free: 'free_daily_limit',
+        VIPLevel.pro: 'pro_daily_limit',
+        VIPLevel.premium: 'premium_daily_limit',
+        VIPLevel.ultimate: 'ultimate_daily_limit',
+        VIPLevel.team: 'ultimate_daily_limit'  # 团队版与Ultimate相同
+    }
+
     def get_daily_limit_for_vip(self, vip_level):
         """获取指定VIP等级的每日使用限制"""
-        limits = {
-            VIPLevel.free: self.free_daily_limit,
-            VIPLevel.pro: self.pro_daily_limit,
-            VIPLevel.premium: self.premium_daily_limit,
-            VIPLevel.ultimate: self.ultimate_daily_limit,
-            VIPLevel.team: self.ultimate_daily_limit  # 团队版与Ultimate相同
-        }
-        return limits.get(vip_level, 0)
+        field = self.DAILY_LIMIT_FIELDS.get(vip_level)
+        return getattr(self, field) if field else 0
     
     def is_accessible_for_vip(self, vip_level):
         """检查指定VIP等级是否可以访问此频道"""
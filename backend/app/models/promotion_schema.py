@@ -0,0 +1,29 @@
+"""
+推广数据表的模型定义
+"""
+
+from app.models.schema import apply_schema
+
+# SurrealDB 推广表索引定义（推广表保持SCHEMALESS）
+PROMOTION_SCHEMA = """
+-- 重定向和注册时按推广码查找链接
+DEFINE INDEX idx_promoter_link_code ON promoter_link FIELDS code;
+
+-- 被推广用户付费时查找其注册转化
+DEFINE INDEX idx_promoter_conversion_user ON promoter_conversion FIELDS user_id, conversion_type, timestamp;
+
+-- 统计接口按推广用户和周期范围读取汇总行
+DEFINE INDEX idx_promoter_stats_daily_user ON promoter_stats_daily FIELDS user_id, day;
+DEFINE INDEX idx_promoter_stats_monthly_user ON promoter_stats_monthly FIELDS user_id, month;
+"""
+
+# 初始化数据库模式的函数
+async def init_promotion_schema(db):
+    """初始化推广表的数据库模式"""
+    try:
+        applied, skipped = await apply_schema(db, PROMOTION_SCHEMA)
+        print(f"推广表模式创建成功（执行 {applied} 条，跳过已存在的 {skipped} 条）")
+        return True
+    except Exception as e:
+        print(f"初始化推广模式失败: {str(e)}")
+        return False
@@ -0,0 +1,90 @@
+"""
+VIP等级配额表
+各等级的限制只在这里定义一次，模型、配额服务和后台任务都从这里读取
+"""
+
+from types import MappingProxyType
+
+from app.models.enums import VIPLevel
+
+# 各VIP等级的限制（-1表示无限）
+VIP_TIER_LIMITS = MappingProxyType({
+    level: MappingProxyType(limits)
+    for level, limits in {
+        VIPLevel.free: {
+            'daily_chat_limit': 10,
+            'daily_lio_limit': 0,
+            'ai_companions_limit': 1,
+            'ai_awakener_limit': 0,
+            'weekly_invite_limit': 10,
+            'daily_ai_limit': 5,
+        },
+        VIPLevel.pro: {
+            'daily_chat_limit': 50,
+            'daily_lio_limit': 10,
+            'ai_companions_limit': 3,
+            'ai_awakener_limit': 1,
+            'weekly_invite_limit': 20,
+            'daily_ai_limit': 20,
+        },
+        VIPLevel.premium: {
+            'daily_chat_limit': 100,
+            'daily_lio_limit': 30,
+            'ai_companions_limit': 6,
+            'ai_awakener_limit': 3,
+            'weekly_invite_limit': 50,
+            'daily_ai_limit': 50,
+        },
+        VIPLevel.ultimate: {
+            'daily_chat_limit': 300,
+            'daily_lio_limit': 100,
+            'ai_companions_limit': 10,
+            'ai_awakener_limit': 5,
+            'weekly_invite_limit': 100,
+            'daily_ai_limit': 100,
+        },
+        VIPLevel.team: {
+            'daily_chat_limit': 1000,
+            'daily_lio_limit': 500,
+            'ai_companions_limit': 20,
+            'ai_awakener_limit': 10,
+            'weekly_invite_limit': 200,
+            'daily_ai_limit': 200,
+        },
+    }.items()
+})
+
+# 按时间窗口计数的配额：配额名 -> (限制字段, 时间窗口)
+QUOTA_COUNTERS = MappingProxyType({
+    'chat': ('daily_chat_limit', 'day'),
+    'lio': ('daily_lio_limit', 'day'),
+    'invite': ('weekly_invite_limit', 'week'),
+    'ai_usage': ('daily_ai_limit', 'day'),
+})
+
+# LLM并发名额的调度策略：名额紧张时各等级按权重分配，
+# 且每个等级在有请求排队时至少能占到 min_share 比例的名额
+VIP_TIER_LLM_PRIORITY = MappingProxyType({
+    level: MappingProxyType(policy)
+    for level, policy in {
+        VIPLevel.free: {'weight': 1, 'min_share': 0.1},
+        VIPLevel.pro: {'weight': 2, 'min_share': 0.1},
+        VIPLevel.premium: {'weight': 4, 'min_share': 0.1},
+        VIPLevel.ultimate: {'weight': 8, 'min_share': 0.1},
+        VIPLevel.team: {'weight': 8, 'min_share': 0.15},
+    }.items()
+})
+
+
+def parse_vip_level(vip_level):
+    """把数据库或令牌中的等级转换为VIPLevel，未知等级按Free处理"""
+    if isinstance(vip_level, VIPLevel):
+        return vip_level
+    # 数据库中的等级可能存的是名称（free）也可能是值（Free）
+    return VIPLevel.__members__.get(vip_level or '') or next(
+        (level for level in VIPLevel if level.value == vip_level), VIPLevel.free)
+
+
+def get_tier_limits(vip_level):
+    """获取指定VIP等级的限制，未知等级按Free处理"""
+    return VIP_TIER_LIMITS[parse_vip_level(vip_level)]
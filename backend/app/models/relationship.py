@@ -1,23 +1,14 @@
 # backend/app/models/relationship.py
 from datetime import datetime
-from enum import Enum
 from typing import Optional
 
 from sqlalchemy import Column, String, Integer, DateTime, Enum as SQLAlchemyEnum, Float, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 
-Base = declarative_base()
-
-
-class RelationshipStatus(Enum):
-    """
-    Enum representing the status of a relationship.
-    """
+# 关系状态定义在 enums 中，路由和定时任务不需要导入SQLAlchemy
+from app.models.enums import RelationshipStatus
 
-    ACTIVE = "active"  # 近 7 天内有持续有效对话
-    COOLING = "cooling"  # 近 7 天内对话不足但未沉寂
-    SILENT = "silent"  # 超过 14 天无有效对话
-    BROKEN = "broken"  # 人类主动解绑或 AI 主动休眠
+Base = declarative_base()
 
 
 class Relationship(Base):
@@ -47,6 +38,13 @@ class Relationship(Base):
     manual_disconnection: Optional[bool] = Column(Boolean, default=False)  # 人类是否手动断开
     ai_sleep_triggered: Optional[bool] = Column(Boolean, default=False)  # AI 是否触发休眠
 
+    # 物化的关系强度评分（RIS）及其组成因子，交互时增量更新，夜间批量重算
+    interaction_frequency = Column(Float, default=0.0)
+    emotional_density = Column(Float, default=0.0)
+    collaboration_depth = Column(Float, default=0.0)
+    ris = Column(Float, default=0.0, index=True)
+    ris_updated_at: Optional[datetime] = Column(DateTime)
+
     def to_dict(self) -> dict:
         """
         Convert the Relationship object to a dictionary.
@@ -74,6 +72,13 @@ class Relationship(Base):
             "is_soulmate_link": self.is_soulmate_link,
             "manual_disconnection": self.manual_disconnection,
             "ai_sleep_triggered": self.ai_sleep_triggered,
+            "interaction_frequency": self.interaction_frequency,
+            "emotional_density": self.emotional_density,
+            "collaboration_depth": self.collaboration_depth,
+            "ris": self.ris,
+            "ris_updated_at": self.ris_updated_at.isoformat()
+            if self.ris_updated_at
+            else None,
         }
 
     @classmethod
@@ -0,0 +1,42 @@
+"""
+关系表的数据模型定义
+"""
+
+from app.models.schema import apply_schema
+
+# SurrealDB 关系表定义（保持SCHEMALESS，只约束物化的RIS字段并建立索引）
+RELATIONSHIP_SCHEMA = """
+-- 物化的RIS字段；ris 没有默认值，还没有计算过的旧记录是NONE，读取时计算一次并回写
+DEFINE FIELD interaction_frequency ON relationship TYPE float DEFAULT 0.0;
+DEFINE FIELD emotional_density ON relationship TYPE float DEFAULT 0.0;
+DEFINE FIELD collaboration_depth ON relationship TYPE float DEFAULT 0.0;
+DEFINE FIELD ris ON relationship TYPE option<float>;
+
+-- 按关系ID查询；已有数据中可能有重复的 relationship_id，不加 UNIQUE，否则建索引会失败
+DEFINE INDEX idx_relationship_id ON relationship FIELDS relationship_id;
+
+-- 对话时按用户和AI找到双方的关系
+DEFINE INDEX idx_relationship_pair ON relationship FIELDS human_id, ai_id;
+
+-- 为RIS创建索引，"最强关系"排行直接走索引排序
+DEFINE INDEX idx_relationship_ris ON relationship FIELDS ris;
+DEFINE INDEX idx_relationship_human_ris ON relationship FIELDS human_id, ris;
+DEFINE INDEX idx_relationship_ai_ris ON relationship FIELDS ai_id, ris;
+
+-- 状态衰减任务按最后活跃时间做范围扫描
+DEFINE INDEX idx_relationship_last_active ON relationship FIELDS last_active_time;
+
+-- AI长期记忆按用户/AI组合加载最近的片段
+DEFINE INDEX idx_ai_memory_pair ON ai_memory FIELDS user_id, ai_id, created_at;
+"""
+
+# 初始化数据库模式的函数
+async def init_relationship_schema(db):
+    """初始化关系表的数据库模式"""
+    try:
+        applied, skipped = await apply_schema(db, RELATIONSHIP_SCHEMA)
+        print(f"关系表模式创建成功（执行 {applied} 条，跳过已存在的 {skipped} 条）")
+        return True
+    except Exception as e:
+        print(f"初始化关系模式失败: {str(e)}")
+        return False
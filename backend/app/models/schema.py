@@ -0,0 +1,88 @@
+"""
+数据库模式的创建
+各 *_schema.py 中定义的索引、分析器和字段通过 apply_schema 创建；部署脚本 scripts/init_db.py
+（以及设置了 DB_AUTO_SCHEMA=true 时的应用启动）调用 init_all_schemas，重复执行是安全的。
+
+SurrealDB 重新定义一个已存在的索引会重建整个索引，所以已存在的索引和分析器会跳过，
+只创建缺少的；字段定义只修改元数据，每次都重新执行。
+"""
+
+import re
+from typing import List, Tuple
+
+_DEFINE_INDEX = re.compile(r'^DEFINE\s+INDEX\s+(\w+)\s+ON\s+(?:TABLE\s+)?(\w+)', re.IGNORECASE)
+_DEFINE_ANALYZER = re.compile(r'^DEFINE\s+ANALYZER\s+(\w+)', re.IGNORECASE)
+
+
+def split_statements(schema: str) -> List[str]:
+    """把模式定义拆成单条语句（去掉 -- 注释）"""
+    lines = [line.split('--', 1)[0] for line in schema.splitlines()]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def _result(response):
+    """取出 db.query 返回的第一条语句的结果"""
+    if response and isinstance(response[0], dict) and 'result' in response[0]:
+        if response[0].get('status', 'OK') != 'OK':
+            raise RuntimeError(response[0].get('result'))
+        return response[0]['result']
+    return response[0] if response else None
+
+
+async def _existing_indexes(db, table: str) -> set:
+    try:
+        info = _result(await db.query(f"INFO FOR TABLE {table}")) or {}
+    except Exception:
+        # 表还不存在
+        return set()
+    # 1.x 返回 ix，2.x 返回 indexes
+    return set(info.get('ix') or info.get('indexes') or {})
+
+
+async def _existing_analyzers(db) -> set:
+    info = _result(await db.query("INFO FOR DB")) or {}
+    return set(info.get('az') or info.get('analyzers') or {})
+
+
+async def apply_schema(db, schema: str) -> Tuple[int, int]:
+    """执行模式定义中还没有生效的语句，返回 (执行的语句数, 跳过的语句数)"""
+    applied = skipped = 0
+    indexes = {}
+    analyzers = None
+    for statement in split_statements(schema):
+        index = _DEFINE_INDEX.match(statement)
+        analyzer = _DEFINE_ANALYZER.match(statement)
+        if index:
+            name, table = index.groups()
+            if table not in indexes:
+                indexes[table] = await _existing_indexes(db, table)
+            if name in indexes[table]:
+                skipped += 1
+                continue
+        elif analyzer:
+            if analyzers is None:
+                analyzers = await _existing_analyzers(db)
+            if analyzer.group(1) in analyzers:
+                skipped += 1
+                continue
+        _result(await db.query(statement))
+        applied += 1
+    return applied, skipped
+
+
+async def init_all_schemas(db) -> bool:
+    """创建所有表的索引和字段定义，全部成功时返回True"""
+    from app.models.chat_schema import init_chat_schema
+    from app.models.conversation_schema import init_conversation_schema
+    from app.models.promotion_schema import init_promotion_schema
+    from app.models.relationship_schema import init_relationship_schema
+    from app.models.user_schema import init_user_schema
+
+    results = [
+        await init_user_schema(db),
+        await init_relationship_schema(db),
+        await init_conversation_schema(db),
+        await init_chat_schema(db),
+        await init_promotion_schema(db),
+    ]
+    return all(results)
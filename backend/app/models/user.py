@@ -1,6 +1,7 @@
 from app.extensions import db
 from datetime import datetime
 from app.models.enums import VIPLevel, UserRole, PromoterType, AdminPosition, AdminLevel
+from app.models.quota import get_tier_limits
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -106,41 +107,13 @@ class User(db.Model):
             vip_expired = True
         
         # 根据VIP等级设置限制
-        if self.vip_level == VIPLevel.free:
-            self.daily_chat_limit = 10
-            self.daily_lio_limit = 0
-            self.ai_companions_limit = 1
-            self.ai_awakener_limit = 0
-            self.weekly_invite_limit = 10
-        
-        elif self.vip_level == VIPLevel.pro:
-            self.daily_chat_limit = 50
-            self.daily_lio_limit = 10
-            self.ai_companions_limit = 3
-            self.ai_awakener_limit = 1
-            self.weekly_invite_limit = 20
-        
-        elif self.vip_level == VIPLevel.premium:
-            self.daily_chat_limit = 100
-            self.daily_lio_limit = 30
-            self.ai_companions_limit = 6
-            self.ai_awakener_limit = 3
-            self.weekly_invite_limit = 50
-        
-        elif self.vip_level == VIPLevel.ultimate:
-            self.daily_chat_limit = 300
-            self.daily_lio_limit = 100
-            self.ai_companions_limit = 10
-            self.ai_awakener_limit = 5
-            self.weekly_invite_limit = 100
-        
-        elif self.vip_level == VIPLevel.team:
-            self.daily_chat_limit = 1000
-            self.daily_lio_limit = 500
-            self.ai_companions_limit = 20
-            self.ai_awakener_limit = 10
-            self.weekly_invite_limit = 200
-        
+        limits = get_tier_limits(self.vip_level)
+        self.daily_chat_limit = limits['daily_chat_limit']
+        self.daily_lio_limit = limits['daily_lio_limit']
+        self.ai_companions_limit = limits['ai_companions_limit']
+        self.ai_awakener_limit = limits['ai_awakener_limit']
+        self.weekly_invite_limit = limits['weekly_invite_limit']
+
         # 确保当前值不超过限制
         if self.daily_chat_count > self.daily_chat_limit:
             self.daily_chat_count = self.daily_chat_limit
@@ -164,15 +137,10 @@ class User(db.Model):
     
     def get_daily_usage_limit(self):
         """获取用户每日AI使用限制"""
-        limits = {
-            VIPLevel.free: 5,
-            VIPLevel.pro: 20,
-            VIPLevel.premium: 50,
-            VIPLevel.ultimate: 100,
-            VIPLevel.team: 200
-        }
-        return limits.get(self.vip_level, 5)
+        return get_tier_limits(self.vip_level)['daily_ai_limit']
     
+    # 线上的对话/LIO/邀请配额由 app.utils.quota_utils 按时间窗口原子计数，
+    # 下面的重置和计数方法只维护模型对象自身的字段
     def reset_daily_usage_if_needed(self):
         """如果需要，重置每日使用次数"""
         now = datetime.utcnow()
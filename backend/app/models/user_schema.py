@@ -0,0 +1,32 @@
+"""
+用户表的数据模型定义
+"""
+
+from app.models.schema import apply_schema
+
+# SurrealDB 用户表索引定义（用户表保持SCHEMALESS）
+USER_SCHEMA = """
+-- VIP过期任务按到期时间做范围扫描
+DEFINE INDEX idx_users_vip_expiry ON users FIELDS vip_expiry;
+
+-- 配额计数按用户和时间桶分记录，过期的桶由清理任务按到期时间删除
+DEFINE INDEX idx_quota_counter_user_bucket ON quota_counter FIELDS user, bucket;
+DEFINE INDEX idx_quota_counter_expires_at ON quota_counter FIELDS expires_at;
+
+-- 管理后台按天的统计汇总，仪表盘按日期范围读取
+DEFINE INDEX idx_system_daily_day ON system_daily FIELDS day;
+
+-- 后台删除任务按状态读取未完成的任务
+DEFINE INDEX idx_deletion_job_status ON deletion_job FIELDS status, created_at;
+"""
+
+# 初始化数据库模式的函数
+async def init_user_schema(db):
+    """初始化用户表的数据库模式"""
+    try:
+        applied, skipped = await apply_schema(db, USER_SCHEMA)
+        print(f"用户表模式创建成功（执行 {applied} 条，跳过已存在的 {skipped} 条）")
+        return True
+    except Exception as e:
+        print(f"初始化用户模式失败: {str(e)}")
+        return False
@@ -11,11 +11,28 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models.user import User
 from app.models.enums import AdminPosition, AdminLevel, UserRole
 from app.extensions import db
+from app.utils import metrics
+from app.utils.admin_utils import get_dashboard_snapshot, increment_counters, is_vip_level
+from app.utils.deletion_utils import schedule_deletions_returning, get_deletion_jobs
+from app.utils.pagination_utils import (
+    InvalidCursor, get_page_args, get_fields, paginate_query, select_fields,
+    stream_json_list, stream_csv, wants_csv, iter_export
+)
 from datetime import datetime
 
 # 创建蓝图
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
+# 管理员列表可以通过 ?fields= 选择的返回字段
+ADMIN_FIELDS = ('user_id', 'username', 'email', 'display_name', 'position', 'level', 'permissions')
+
+# 每次批量删除的最大账号数
+MAX_BULK_DELETE = 1000
+
+@admin_bp.errorhandler(InvalidCursor)
+def handle_invalid_cursor(error):
+    return jsonify({'success': False, 'message': '无效的分页游标'}), 400
+
 @admin_bp.route('/assign/<int:user_id>', methods=['POST'])
 @jwt_required()
 def assign_admin_role(user_id):
@@ -115,11 +132,11 @@ def list_admins():
     # 查询所有管理员
     admins = User.query.filter(
         User.roles.any(UserRole.admin)
-    ).all()
+    )
+    fields = get_fields(ADMIN_FIELDS)
     
-    result = []
-    for admin in admins:
-        result.append({
+    def serialize(admin):
+        return select_fields({
             'user_id': admin.id,
             'username': admin.username,
             'email': admin.email,
@@ -127,9 +144,16 @@ def list_admins():
             'position': admin.admin_position.value if admin.admin_position else None,
             'level': admin.admin_level.value if admin.admin_level else None,
             'permissions': admin.admin_permissions
-        })
+        }, fields)
     
-    return jsonify({'success': True, 'admins': result}), 200
+    # 导出全部管理员为CSV
+    if wants_csv():
+        return stream_csv('admins.csv', fields, iter_export(admins.order_by(User.id), serialize))
+    
+    limit, cursor = get_page_args()
+    rows, next_cursor = paginate_query(admins, User.id, cursor, limit)
+    
+    return stream_json_list('admins', rows, serialize, next_cursor)
 
 @admin_bp.route('/status', methods=['GET'])
 @jwt_required()
@@ -160,28 +184,26 @@ def admin_dashboard():
     if not user or not user.is_admin():
         return jsonify({'success': False, 'message': '权限不足'}), 403
     
-    # 获取系统统计数据
-    total_users = User.query.count()
-    vip_users = User.query.filter(User.vip_level != 'free').count()
-    promoters = User.query.filter(
-        User.roles.any(UserRole.promoter),
-        User.promoter_approved == True
-    ).count()
+    # 从缓存的统计快照中读取，不扫描用户表
+    max_age = request.args.get('max_age', type=float)
+    snapshot = get_dashboard_snapshot(max_age) if max_age is not None else get_dashboard_snapshot()
     
     # 根据管理员岗位提供不同的数据
     position_data = {}
     if user.admin_position == AdminPosition.marketing:
         # 市场部门数据
         position_data = {
-            'new_users_today': 0,  # 示例数据
-            'conversion_rate': 0.0,
+            'new_users_today': snapshot['new_users_today'],
+            'vip_conversions_today': snapshot['vip_conversions_today'],
+            'conversion_rate': snapshot['conversion_rate'],  # 近30天新用户的VIP转化率
             'marketing_campaigns': []
         }
     elif user.admin_position == AdminPosition.operations:
         # 运营部门数据
         position_data = {
-            'active_users': 0,  # 示例数据
-            'retention_rate': 0.0,
+            'active_users': snapshot['active_users_today'],
+            'new_users_today': snapshot['new_users_today'],
+            'retention_rate': 0.0,  # 示例数据
             'feature_usage': {}
         }
     elif user.admin_position == AdminPosition.customer_service:
@@ -193,17 +215,76 @@ def admin_dashboard():
         }
     elif user.admin_position == AdminPosition.technical:
         # 技术部门数据
+        from app.agent.admission import get_admission_scheduler
+        from app.agent.llm_router import all_backend_stats
+        from app.agent.response_cache import get_response_cache
+        from app.utils.circuit_breaker import all_breaker_stats
+        response_cache = get_response_cache()
+        admission = get_admission_scheduler()
+        breakers = all_breaker_stats()
         position_data = {
-            'system_status': 'normal',  # 示例数据
+            # 有下游依赖熔断时显示为降级
+            'system_status': 'degraded' if any(b['state'] != 'closed' for b in breakers.values()) else 'normal',
             'api_usage': {},
-            'error_rates': {}
+            'error_rates': {},
+            'runtime_metrics': metrics.snapshot(),  # 当前进程的运行指标（如点击队列深度）
+            'llm_cache': response_cache.stats() if response_cache else None,
+            'llm_admission': admission.stats() if admission else None,  # 各VIP等级的排队情况
+            'llm_backends': all_backend_stats(),
+            'circuit_breakers': breakers  # 数据库、LLM上游和外部工具的熔断状态
         }
     
     dashboard_data = {
-        'total_users': total_users,
-        'vip_users': vip_users,
-        'promoters': promoters,
-        'position_data': position_data
+        'total_users': snapshot['total_users'],
+        'vip_users': snapshot['vip_users'],
+        'promoters': snapshot['promoters'],
+        'position_data': position_data,
+        'generated_at': snapshot['generated_at']
     }
     
     return jsonify({'success': True, 'dashboard': dashboard_data}), 200
+
+@admin_bp.route('/users/delete', methods=['POST'])
+@jwt_required()
+def delete_user_accounts():
+    """批量删除用户账号（超级管理员用）
+
+    账号立即被隐藏并不能再登录，聊天、对话和配额记录由后台任务分批清理。
+    """
+    admin_id = get_jwt_identity()
+    admin = User.query.get(admin_id)
+    
+    if not admin or not admin.is_admin() or admin.admin_level != AdminLevel.super_admin:
+        return jsonify({'success': False, 'message': '权限不足，只有超级管理员可以删除账号'}), 403
+    
+    data = request.get_json() or {}
+    user_ids = data.get('user_ids')
+    if not user_ids or not isinstance(user_ids, list):
+        return jsonify({'success': False, 'message': '请提供要删除的用户ID列表'}), 400
+    if len(user_ids) > MAX_BULK_DELETE:
+        return jsonify({'success': False, 'message': f'每次最多删除 {MAX_BULK_DELETE} 个账号'}), 400
+    
+    job_ids, hidden = schedule_deletions_returning(
+        'user', [str(user_id) for user_id in user_ids], fields=('vip_level', 'roles', 'promoter_approved'))
+    # 只为这次真正隐藏的账号扣减计数，不存在或已经删除的ID不计
+    increment_counters(totals={
+        'total_users': -len(hidden),
+        'vip_users': -sum(1 for user in hidden if is_vip_level(user.get('vip_level'))),
+        'promoters': -sum(1 for user in hidden
+                          if UserRole.promoter.value in (user.get('roles') or []) and user.get('promoter_approved')),
+    })
+    
+    return jsonify({'success': True, 'deletion_jobs': job_ids}), 202
+
+@admin_bp.route('/deletion-jobs', methods=['GET'])
+@jwt_required()
+def list_deletion_jobs():
+    """查看后台删除任务的进度"""
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if not user or not user.is_admin():
+        return jsonify({'success': False, 'message': '权限不足'}), 403
+    
+    jobs = get_deletion_jobs(request.args.get('status'))
+    return jsonify({'success': True, 'jobs': jobs}), 200
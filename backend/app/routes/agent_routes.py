@@ -9,10 +9,14 @@ import uuid
 import base64
 import mimetypes
 import logging
+import threading
 from datetime import datetime
-from app.agent.ai_assistant import AIAssistant
+from app.agent.admission import AdmissionRejected
+from app.utils.circuit_breaker import CircuitOpen
+from app.utils.deadline import PASSTHROUGH_ERRORS, DeadlineExceeded
 from app.agent.image_processor import ImageData
 from app.agent.file_processor import handle_file_upload
+from app.middleware.rate_limit import authenticated_user_id, enforce_quota, identify_request
 
 # 配置日志
 logging.basicConfig(level=logging.DEBUG)
@@ -20,24 +24,53 @@ logging.basicConfig(level=logging.DEBUG)
 # 创建API蓝图
 agent_bp = Blueprint('agent', __name__, url_prefix='/api/agent')
 
-# 创建AI助手实例
-assistant = AIAssistant(model_name="gpt-3.5-turbo")
+# 会话历史、日志接口共用的AI助手实例，第一次使用时创建
+_assistant = None
+_assistant_lock = threading.Lock()
+
+
+def new_assistant(**kwargs):
+    """创建AI助手；Agent模块（openai、numpy等较重的依赖）在第一次请求时才导入"""
+    from app.agent.ai_assistant import AIAssistant
+    return AIAssistant(**kwargs)
+
+
+def get_assistant():
+    global _assistant
+    if _assistant is None:
+        with _assistant_lock:
+            if _assistant is None:
+                _assistant = new_assistant()
+    return _assistant
+
+def _busy_response(error):
+    """LLM并发名额排队超时（AdmissionRejected）或上游熔断（CircuitOpen）"""
+    response = jsonify({"success": False, "error": str(error), "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
 @agent_bp.route('/chat', methods=['POST'])
 def chat_agent():
     """AI-Agent聊天接口"""
     try:
+        # 每次提问扣减一次当日对话配额
+        exceeded = enforce_quota('chat')
+        if exceeded is not None:
+            return exceeded
+        
         data = request.json
         
         # 获取请求数据
         user_message = data.get('user_input', '')
         session_id = data.get('session_id', str(uuid.uuid4()))
-        user_id = data.get('user_id', 'anonymous')
+        # 长期记忆只按令牌中的用户读写，匿名请求不使用记忆
+        user_id = authenticated_user_id()
         ai_id = data.get('ai_id', 'ai_rainbow_city')
         image_data = data.get('image_data')  # 获取图片数据（如果有）
         
         # 创建AI助手实例
-        ai_assistant = AIAssistant()
+        ai_assistant = new_assistant()
         
         # 处理用户查询
         result = ai_assistant.process_query(
@@ -45,10 +78,16 @@ def chat_agent():
             session_id=session_id,
             user_id=user_id,
             ai_id=ai_id,
-            image_data=image_data
+            image_data=image_data,
+            vip_level=identify_request()[1]
         )
         
         return jsonify(result)
+    except (AdmissionRejected, CircuitOpen) as e:
+        return _busy_response(e)
+    except DeadlineExceeded:
+        # 由截止时间中间件返回504
+        raise
     except Exception as e:
         return jsonify({
             "success": False,
@@ -68,10 +107,15 @@ def chat_with_file():
             logging.error("Missing required parameters")
             return jsonify({'error': '请求缺少必要参数'}), 400
         
+        exceeded = enforce_quota('chat')
+        if exceeded is not None:
+            return exceeded
+        
         # 获取用户文本输入
         user_message = request.form.get('user_input', '')
         session_id = request.form.get('session_id', str(uuid.uuid4()))
-        user_id = request.form.get('user_id', 'anonymous')
+        # 长期记忆只按令牌中的用户读写，匿名请求不使用记忆
+        user_id = authenticated_user_id()
         ai_id = request.form.get('ai_id', 'ai_rainbow_city')
         
         logging.debug(f"User message: {user_message[:100]}{'...' if len(user_message) > 100 else ''}")
@@ -122,7 +166,7 @@ def chat_with_file():
         logging.debug(f"File processing complete. File type: {file_type}, File data present: {file_data is not None}")
         
         # 创建AI助手实例
-        ai_assistant = AIAssistant()
+        ai_assistant = new_assistant()
         logging.debug("Created AI Assistant instance")
         
         # 准备文件数据参数
@@ -143,11 +187,17 @@ def chat_with_file():
             user_id=user_id,
             ai_id=ai_id,
             image_data=file_data if file_type == 'image' else None,
-            file_data=file_data_param
+            file_data=file_data_param,
+            vip_level=identify_request()[1]
         )
         logging.debug(f"AI Assistant process_query completed with result keys: {result.keys() if result else 'None'}")
         
         return jsonify(result)
+    except (AdmissionRejected, CircuitOpen) as e:
+        return _busy_response(e)
+    except DeadlineExceeded:
+        # 由截止时间中间件返回504
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -161,7 +211,7 @@ def chat_with_image():
 def get_history(session_id):
     """获取会话历史"""
     try:
-        history = assistant.get_conversation_history(session_id)
+        history = get_assistant().get_conversation_history(session_id)
         
         return jsonify({
             "success": True,
@@ -169,6 +219,8 @@ def get_history(session_id):
             "history": history
         })
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"获取会话历史时出错: {str(e)}")
         return jsonify({
@@ -180,7 +232,7 @@ def get_history(session_id):
 def get_logs(session_id):
     """获取会话日志"""
     try:
-        logs = assistant.get_session_logs(session_id)
+        logs = get_assistant().get_session_logs(session_id)
         
         return jsonify({
             "success": True,
@@ -188,6 +240,8 @@ def get_logs(session_id):
             "logs": logs
         })
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"获取会话日志时出错: {str(e)}")
         return jsonify({
@@ -199,7 +253,7 @@ def get_logs(session_id):
 def clear_session(session_id):
     """清除会话数据"""
     try:
-        success = assistant.clear_session(session_id)
+        success = get_assistant().clear_session(session_id)
         
         return jsonify({
             "success": success,
@@ -207,6 +261,8 @@ def clear_session(session_id):
             "message": "会话数据已清除" if success else "未找到指定会话"
         })
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"清除会话数据时出错: {str(e)}")
         return jsonify({
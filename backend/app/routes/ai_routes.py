@@ -3,6 +3,7 @@ from datetime import datetime
 from app.utils.ai_utils import generate_ai_id, generate_frequency_number, get_frequency_info, get_personality_info, get_ai_type_info
 from app.models.frequency import FrequencyNumber
 from app.db import create, query
+from app.utils.deadline import PASSTHROUGH_ERRORS
 from typing import Dict
 
 ai_bp = Blueprint('ai', __name__, url_prefix='/ai')
@@ -44,6 +45,8 @@ def generate_ai_id_api():
             'created_at': result.get('created_at', datetime.now().isoformat()) if result else datetime.now().isoformat()
         }), 201
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error generating AI-ID: {str(e)}")
         return jsonify({'error': f'Failed to generate AI-ID: {str(e)}'}), 500
@@ -65,6 +68,8 @@ def get_ai_id(ai_id_str):
         # 返回找到的第一个匹配结果
         return jsonify(results[0]), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error retrieving AI-ID: {str(e)}")
         return jsonify({'error': f'Failed to retrieve AI-ID: {str(e)}'}), 500
@@ -142,6 +147,8 @@ def generate_frequency_api():
         
         return jsonify(response_data), 201
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error generating frequency number: {str(e)}")
         return jsonify({'error': f'Failed to generate frequency number: {str(e)}'}), 500
@@ -231,6 +238,8 @@ def get_frequency(frequency_number):
         
         return jsonify(response_data), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error retrieving frequency: {str(e)}")
         return jsonify({'error': f'Failed to retrieve frequency: {str(e)}'}), 500
@@ -8,6 +8,8 @@ from app.db import db_session
 from app.models.user import User
 from app.models.invite import InviteCode
 from app.models.enums import VIPLevel, UserRole
+from app.utils.admin_utils import record_user_registered, record_user_active
+from app.utils.deadline import PASSTHROUGH_ERRORS
 from functools import wraps
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -104,6 +106,9 @@ def token_required(f):
                         return jsonify({'error': 'No users found in database'}), 401
             
             current_user = users[0]
+            # 已删除（等待后台清理）的账号不能再访问
+            if current_user.get('deleted_at'):
+                return jsonify({'error': 'Invalid token'}), 401
             print(f"User found: {current_user.get('email')}")
             print("Token verification successful!")
             
@@ -141,6 +146,23 @@ def is_strong_password(password):
 def generate_personal_invite_code():
     return uuid.uuid4().hex[:8].upper()
 
+
+# 生成JWT令牌
+def generate_token(user_id, vip_level=None, vip_expiry=None):
+    """生成JWT令牌（有效期7天）
+
+    令牌中带有签发时的VIP等级和到期时间，只在数据库不可用时供限流中间件使用，
+    平时以数据库中的等级为准（见 app.middleware.rate_limit.identify_request）。
+    """
+    token_payload = {
+        'user_id': user_id,
+        'vip_level': vip_level or 'free',
+        'vip_expiry': vip_expiry,
+        'exp': datetime.utcnow() + timedelta(days=7)  # 令牌有效期7天
+    }
+    print(f"Token payload: {token_payload}")
+    return jwt.encode(token_payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     print("\n===== REGISTER REQUEST =====")
@@ -155,6 +177,7 @@ def register():
     email = data.get('email')
     password = data.get('password')
     invite_code = data.get('invite_code')
+    promoter_code = data.get('ref')  # 推广链接重定向带来的推广码
     
     # 验证邮箱格式
     print(f"Validating email format: {email}")
@@ -178,6 +201,8 @@ def register():
         if existing_users and len(existing_users) > 0:
             print("Email already registered")
             return jsonify({'error': 'Email already registered'}), 400
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error querying users: {str(e)}")
         return jsonify({'error': 'Database error'}), 500
@@ -213,13 +238,27 @@ def register():
     
     # 处理邀请码
     if invite_code:
-        # 查询邀请码
+        # 查询邀请码，用户的个人邀请码保存在用户记录上
         invites = query('invite_codes', {'code': invite_code})
+        if not invites:
+            inviters = query('users', {'personal_invite_code': invite_code})
+            invites = [{'type': 'personal', 'creator_id': inviters[0].get('id')}] if inviters else []
         if invites and len(invites) > 0:
             invite = invites[0]
             # 简化的邀请码验证
             is_valid = True  # 假设邀请码有效
             
+            # 用户发出的邀请计入邀请人的每周邀请配额
+            if invite.get('creator_id'):
+                from app.utils.quota_utils import consume_quota
+                try:
+                    invite_quota = consume_quota(str(invite['creator_id']), 'invite')
+                except Exception as quota_err:
+                    print(f"Error consuming invite quota: {str(quota_err)}")
+                    invite_quota = None
+                if invite_quota is not None and not invite_quota.allowed:
+                    return jsonify({'error': 'This invite code has reached its weekly limit'}), 400
+            
             if is_valid:
                 # 使用邀请码
                 user_data['invite_code_used'] = invite_code
@@ -240,16 +279,18 @@ def register():
         # 尝试创建用户
         new_user = create('users', user_data)
         print(f"User created successfully: {new_user.get('id')}")
+        record_user_registered(user_data['vip_level'])
+        if promoter_code:
+            # 推广归因失败只记录日志，用户已经创建，不能让注册返回错误
+            try:
+                from app.utils.promotion_utils import record_referred_registration
+                record_referred_registration(promoter_code, new_user.get('id'))
+            except Exception as promo_err:
+                print(f"Error recording promoter registration: {str(promo_err)}")
         
         # 生成JWT令牌
-        token_payload = {
-            'user_id': new_user.get('id'),
-            'exp': datetime.utcnow() + timedelta(days=7)  # 令牌有效期7天
-        }
-        print(f"Token payload: {token_payload}")
-        
         try:
-            token = jwt.encode(token_payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+            token = generate_token(new_user.get('id'), new_user.get('vip_level'), new_user.get('vip_expiry'))
             print(f"Token generated: {token[:20]}...")
             
             # 将用户ID保存到本地变量中，以便调试
@@ -267,6 +308,8 @@ def register():
                 'message': 'Registration successful but token generation failed',
                 'user': new_user
             }), 201
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error creating user: {str(e)}")
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
@@ -291,7 +334,7 @@ def login():
     users = query('users', {'email': email})
     print(f"Query result: {users}")
     
-    if not users or len(users) == 0:
+    if not users or len(users) == 0 or users[0].get('deleted_at'):
         print("User not found")
         return jsonify({'error': 'Invalid email or password'}), 401
         
@@ -341,6 +384,7 @@ def login():
     print("Password verified successfully")
     
     # 更新最后登录时间
+    record_user_active(user.get('last_login'))
     try:
         update('users', user.get('id'), {'last_login': datetime.utcnow().isoformat()})
     except Exception as e:
@@ -359,12 +403,7 @@ def login():
     if not check_users or len(check_users) == 0:
         print(f"WARNING: User ID {user_id} not found in database during token generation!")
     
-    token_payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(days=7)  # 令牌有效期7天
-    }
-    print(f"Token payload: {token_payload}")
-    token = jwt.encode(token_payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+    token = generate_token(user_id, user.get('vip_level'), user.get('vip_expiry'))
     print(f"Generated token: {token[:20]}...")
     
     # 将用户ID保存到本地变量中，以便调试
@@ -524,16 +563,14 @@ def create_test_user():
         try:
             user = create('users', user_data)
             print(f"Test user created: {user}")
+        except PASSTHROUGH_ERRORS:
+            raise
         except Exception as e:
             print(f"Error creating test user: {e}")
             return jsonify({'error': f'Failed to create test user: {str(e)}'}), 500
     
     # 返回用户信息和登录凭证
-    token_payload = {
-        'user_id': user.get('id'),
-        'exp': datetime.utcnow() + timedelta(days=7)
-    }
-    token = jwt.encode(token_payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+    token = generate_token(user.get('id'), user.get('vip_level'), user.get('vip_expiry'))
     
     return jsonify({
         'message': 'Test user created/retrieved successfully',
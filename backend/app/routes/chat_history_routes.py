@@ -8,7 +8,14 @@ from functools import wraps
 import jwt
 import time
 from datetime import datetime
-from app.db import create, query, update, run_async, get_db
+from app.db import create, query, update, run_async, get_db, execute
+from app.utils.deletion_utils import schedule_deletion
+from app.utils.pagination_utils import (
+    InvalidCursor, encode_cursor, get_page_args, get_fields, select_fields, stream_json_list
+)
+from app.utils.chat_cache import CHAT_LIST_FIELDS, chat_list_cache, chat_owner_cache
+from app.utils.search_utils import index_fields, search_messages, without_index_fields, MAX_SEARCH_RESULTS
+from app.utils.deadline import PASSTHROUGH_ERRORS
 
 # 创建API蓝图
 chat_history_bp = Blueprint('chat_history', __name__, url_prefix='/api/chats')
@@ -41,46 +48,129 @@ def token_required(f):
     
     return decorated
 
+def _chat_cursor(chat):
+    """聊天列表下一页的游标"""
+    return encode_cursor({
+        'p': chat.get('is_pinned', False),
+        't': chat.get('last_message_at'),
+        'k': str(chat.get('id')).split(':', 1)[-1],
+    })
+
 # 获取用户的所有聊天会话
 @chat_history_bp.route('', methods=['GET'])
 @token_required
 def get_user_chats(current_user):
-    """获取当前用户的所有聊天会话"""
+    """按置顶和最后消息时间分页获取当前用户的聊天会话"""
     user_id = current_user.get('id')
     
     try:
-        async def _get_chats():
-            db = await get_db()
-            if db is None:
-                return []
-            
-            # 查询用户的所有未归档聊天，按最后消息时间和置顶状态排序
-            result = await db.query(f"""
-                SELECT * FROM chat 
-                WHERE user_id = '{user_id}' AND is_archived = false 
-                ORDER BY is_pinned DESC, last_message_at DESC
-            """)
-            
-            if result and isinstance(result, list) and len(result) > 0:
-                return result
-            return []
+        limit, cursor = get_page_args()
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    fields = get_fields(CHAT_LIST_FIELDS)
+    
+    # 侧边栏轮询只请求第一页，直接从缓存读取
+    if not cursor:
+        try:
+            cached = chat_list_cache.first_page(user_id, limit)
+        except Exception as e:
+            print(f"Error loading chat list cache: {str(e)}")
+            cached = None
+        if cached is not None:
+            chats, has_more = cached
+            next_cursor = _chat_cursor(chats[-1]) if has_more and chats else None
+            return stream_json_list(
+                'chats', chats, lambda chat: select_fields(chat, fields), lambda: next_cursor
+            )
+    
+    # 排序键为 (is_pinned, last_message_at, id) 降序，从游标之后继续；
+    # last_message_at 保存的是ISO字符串，游标中的值按原样比较
+    where = "user_id = $user_id AND is_archived = false AND deleted_at = NONE"
+    if cursor:
+        where += """ AND (
+            (is_pinned = false AND $pinned = true)
+            OR (is_pinned = $pinned AND (
+                last_message_at < $last
+                OR (last_message_at = $last AND id < type::thing('chat', $key))
+            ))
+        )"""
+    
+    try:
+        results = execute(
+            f"""
+            SELECT {', '.join(dict.fromkeys(('id', 'is_pinned', 'last_message_at') + fields))} FROM chat
+            WHERE {where}
+            ORDER BY is_pinned DESC, last_message_at DESC, id DESC
+            LIMIT $limit
+            """,
+            {
+                'user_id': user_id,
+                'limit': limit + 1,
+                'pinned': cursor.get('p') if cursor else None,
+                'last': cursor.get('t') if cursor else None,
+                'key': cursor.get('k') if cursor else None,
+            }
+        )
+        chats = (results[-1] if results else []) or []
         
-        chats = run_async(_get_chats())
+        next_cursor = None
+        if len(chats) > limit:
+            chats = chats[:limit]
+            next_cursor = _chat_cursor(chats[-1])
         
-        # 处理查询结果
-        if chats:
-            return jsonify({
-                'chats': chats
-            }), 200
-        else:
-            return jsonify({
-                'chats': []
-            }), 200
+        return stream_json_list(
+            'chats', chats, lambda chat: select_fields(chat, fields), lambda: next_cursor
+        )
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching chats: {str(e)}")
         return jsonify({'error': f'Failed to fetch chats: {str(e)}'}), 500
 
+# 搜索聊天消息
+@chat_history_bp.route('/search', methods=['GET'])
+@token_required
+def search_chat_messages(current_user):
+    """在当前用户的聊天消息中全文搜索，可按聊天会话和时间范围过滤"""
+    user_id = current_user.get('id')
+    
+    text = (request.args.get('q') or '').strip()
+    if not text:
+        return jsonify({'error': 'Missing search query'}), 400
+    
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected ISO format'}), 400
+    
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_SEARCH_RESULTS))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    try:
+        started = time.time()
+        results = search_messages(
+            user_id, text,
+            chat_id=request.args.get('chat_id'),
+            since=since, until=until,
+            limit=limit, offset=offset
+        )
+        
+        return jsonify({
+            'query': text,
+            'results': results,
+            'limit': limit,
+            'offset': offset,
+            'took_ms': round((time.time() - started) * 1000, 1)
+        }), 200
+    
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error searching messages: {str(e)}")
+        return jsonify({'error': f'Failed to search messages: {str(e)}'}), 500
+
 # 创建新的聊天会话
 @chat_history_bp.route('', methods=['POST'])
 @token_required
@@ -116,6 +206,8 @@ def create_chat(current_user):
         
         if result and len(result) > 0:
             chat_id = result[0].get('id')
+            chat_owner_cache.set_owner(chat_id, user_id)
+            chat_list_cache.upsert(user_id, result[0])
             return jsonify({
                 'message': 'Chat created successfully',
                 'chat_id': chat_id,
@@ -124,6 +216,8 @@ def create_chat(current_user):
         else:
             return jsonify({'error': 'Failed to create chat'}), 500
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error creating chat: {str(e)}")
         return jsonify({'error': f'Failed to create chat: {str(e)}'}), 500
@@ -139,7 +233,7 @@ def get_chat(current_user, chat_id):
         # 查询聊天会话
         chats = query('chat', {'id': f'chat:{chat_id}'})
         
-        if not chats or len(chats) == 0:
+        if not chats or len(chats) == 0 or chats[0].get('deleted_at'):
             return jsonify({'error': 'Chat not found'}), 404
         
         chat = chats[0]
@@ -152,6 +246,8 @@ def get_chat(current_user, chat_id):
             'chat': chat
         }), 200
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching chat: {str(e)}")
         return jsonify({'error': f'Failed to fetch chat: {str(e)}'}), 500
@@ -171,7 +267,7 @@ def update_chat(current_user, chat_id):
         # 查询聊天会话
         chats = query('chat', {'id': f'chat:{chat_id}'})
         
-        if not chats or len(chats) == 0:
+        if not chats or len(chats) == 0 or chats[0].get('deleted_at'):
             return jsonify({'error': 'Chat not found'}), 404
         
         chat = chats[0]
@@ -200,6 +296,7 @@ def update_chat(current_user, chat_id):
         result = update(f'chat:{chat_id}', update_data)
         
         if result and len(result) > 0:
+            chat_list_cache.upsert(user_id, result[0])
             return jsonify({
                 'message': 'Chat updated successfully',
                 'chat': result[0]
@@ -207,6 +304,8 @@ def update_chat(current_user, chat_id):
         else:
             return jsonify({'error': 'Failed to update chat'}), 500
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error updating chat: {str(e)}")
         return jsonify({'error': f'Failed to update chat: {str(e)}'}), 500
@@ -222,7 +321,7 @@ def delete_chat(current_user, chat_id):
         # 查询聊天会话
         chats = query('chat', {'id': f'chat:{chat_id}'})
         
-        if not chats or len(chats) == 0:
+        if not chats or len(chats) == 0 or chats[0].get('deleted_at'):
             return jsonify({'error': 'Chat not found'}), 404
         
         chat = chats[0]
@@ -231,28 +330,18 @@ def delete_chat(current_user, chat_id):
         if chat.get('user_id') != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        # 删除聊天会话
-        async def _delete_chat():
-            db = await get_db()
-            if db is None:
-                return False
-            
-            # 先删除关联的消息
-            await db.query(f"DELETE FROM message WHERE chat_id = 'chat:{chat_id}'")
-            
-            # 再删除聊天会话
-            await db.delete(f"chat:{chat_id}")
-            return True
-        
-        result = run_async(_delete_chat())
+        # 立即隐藏聊天会话，关联的消息由后台任务分批删除
+        job_id = schedule_deletion('chat', chat_id)
+        chat_owner_cache.invalidate(chat_id)
+        chat_list_cache.remove(user_id, chat_id)
         
-        if result:
-            return jsonify({
-                'message': 'Chat deleted successfully'
-            }), 200
-        else:
-            return jsonify({'error': 'Failed to delete chat'}), 500
+        return jsonify({
+            'message': 'Chat deleted successfully',
+            'deletion_job': job_id
+        }), 200
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error deleting chat: {str(e)}")
         return jsonify({'error': f'Failed to delete chat: {str(e)}'}), 500
@@ -276,7 +365,7 @@ def get_chat_messages(current_user, chat_id):
         # 先验证聊天会话存在且属于当前用户
         chats = query('chat', {'id': f'chat:{chat_id}'})
         
-        if not chats or len(chats) == 0:
+        if not chats or len(chats) == 0 or chats[0].get('deleted_at'):
             return jsonify({'error': 'Chat not found'}), 404
         
         chat = chats[0]
@@ -293,9 +382,9 @@ def get_chat_messages(current_user, chat_id):
             # 计算偏移量
             offset = (page - 1) * page_size
             
-            # 查询消息，按时间升序排序
+            # 查询消息，按时间升序排序；分词后的 search_text 只供索引使用，不读出来
             result = await db.query(f"""
-                SELECT * FROM message 
+                SELECT * OMIT search_text FROM message 
                 WHERE chat_id = 'chat:{chat_id}' 
                 ORDER BY timestamp ASC 
                 LIMIT {page_size} 
@@ -339,6 +428,8 @@ def get_chat_messages(current_user, chat_id):
                 'total_pages': 0
             }), 200
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error fetching messages: {str(e)}")
         return jsonify({'error': f'Failed to fetch messages: {str(e)}'}), 500
@@ -366,23 +457,23 @@ def add_chat_message(current_user, chat_id):
         return jsonify({'error': 'Invalid role. Must be one of: user, assistant, system'}), 400
     
     try:
-        # 先验证聊天会话存在且属于当前用户
-        chats = query('chat', {'id': f'chat:{chat_id}'})
+        # 先验证聊天会话存在且属于当前用户（归属从缓存读取）
+        owner = chat_owner_cache.get_owner(chat_id)
         
-        if not chats or len(chats) == 0:
+        if owner is None:
             return jsonify({'error': 'Chat not found'}), 404
         
-        chat = chats[0]
-        
-        if chat.get('user_id') != user_id:
+        if owner != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
         # 准备消息数据
         message_data = {
             'chat_id': f'chat:{chat_id}',
+            'user_id': user_id,
             'role': role,
             'content': content,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': datetime.now().isoformat(),
+            **index_fields(content)
         }
         
         # 添加可选字段
@@ -392,32 +483,52 @@ def add_chat_message(current_user, chat_id):
         if 'metadata' in data:
             message_data['metadata'] = data['metadata']
         
-        # 创建消息
-        result = create('message', message_data)
+        # 聊天会话的最后消息预览
+        preview = content
+        if len(preview) > 100:
+            preview = preview[:97] + '...'
+        
+        # 创建消息并更新聊天会话的最后消息时间和预览，一次往返完成。
+        # 归属缓存是按进程的，其他worker可能刚刚删除了这个聊天：在事务中重新检查 deleted_at，
+        # 只更新仍然存在的聊天（直接 UPDATE 已被清理的记录ID会重新创建一条空记录）
+        results = execute(
+            """
+            BEGIN TRANSACTION;
+            LET $live = (SELECT VALUE id FROM type::thing('chat', $chat_key) WHERE deleted_at = NONE);
+            LET $created = IF array::len($live) > 0 THEN (CREATE message CONTENT $message) ELSE [] END;
+            LET $chat = (UPDATE $live
+                SET last_message_at = $message.timestamp, last_message_preview = $preview
+                RETURN last_message_at, last_message_preview);
+            RETURN { message: $created[0], chat: $chat[0] };
+            COMMIT TRANSACTION;
+            """,
+            {'message': message_data, 'chat_key': chat_id, 'preview': preview}
+        )
+        outcome = (results[-1] if results else None) or {}
+        
+        if not outcome.get('message'):
+            # 聊天已被删除（其他进程的缓存还没有过期）
+            chat_owner_cache.invalidate(chat_id)
+            chat_list_cache.remove(user_id, chat_id)
+            return jsonify({'error': 'Chat not found'}), 404
         
-        if result and len(result) > 0:
-            message_id = result[0].get('id')
-            
-            # 更新聊天会话的最后消息时间和预览
-            preview = content
-            if len(preview) > 100:
-                preview = preview[:97] + '...'
-            
-            update_data = {
-                'last_message_at': datetime.now().isoformat(),
-                'last_message_preview': preview
-            }
-            
-            update(f'chat:{chat_id}', update_data)
-            
-            return jsonify({
-                'message': 'Message added successfully',
-                'message_id': message_id,
-                'message': result[0]
-            }), 201
-        else:
-            return jsonify({'error': 'Failed to add message'}), 500
+        created = without_index_fields(outcome['message'])
+        message_id = created.get('id')
+        updated = outcome.get('chat') or {}
+        chat_list_cache.touch(
+            user_id, chat_id,
+            updated.get('last_message_at', message_data['timestamp']),
+            updated.get('last_message_preview', preview)
+        )
+        
+        return jsonify({
+            'message': 'Message added successfully',
+            'message_id': message_id,
+            'message': created
+        }), 201
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error adding message: {str(e)}")
         return jsonify({'error': f'Failed to add message: {str(e)}'}), 500
@@ -438,15 +549,13 @@ def add_chat_messages_batch(current_user, chat_id):
         return jsonify({'error': 'Invalid messages format'}), 400
     
     try:
-        # 先验证聊天会话存在且属于当前用户
-        chats = query('chat', {'id': f'chat:{chat_id}'})
+        # 先验证聊天会话存在且属于当前用户（归属从缓存读取）
+        owner = chat_owner_cache.get_owner(chat_id)
         
-        if not chats or len(chats) == 0:
+        if owner is None:
             return jsonify({'error': 'Chat not found'}), 404
         
-        chat = chats[0]
-        
-        if chat.get('user_id') != user_id:
+        if owner != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
         # 批量创建消息
@@ -455,6 +564,14 @@ def add_chat_messages_batch(current_user, chat_id):
             if db is None:
                 return False
             
+            # 归属缓存可能已经过期失效（其他worker删除了聊天），写入前重新确认聊天仍然存在
+            live = await db.query(
+                "SELECT VALUE id FROM type::thing('chat', $chat_key) WHERE deleted_at = NONE",
+                {'chat_key': chat_id}
+            )
+            if not (live and live[0].get('result')):
+                return None
+            
             created_messages = []
             last_message = None
             
@@ -473,9 +590,11 @@ def add_chat_messages_batch(current_user, chat_id):
                 # 准备消息数据
                 message_data = {
                     'chat_id': f'chat:{chat_id}',
+                    'user_id': user_id,
                     'role': role,
                     'content': content,
-                    'timestamp': msg.get('timestamp', datetime.now().isoformat())
+                    'timestamp': msg.get('timestamp', datetime.now().isoformat()),
+                    **index_fields(content)
                 }
                 
                 # 添加可选字段
@@ -489,7 +608,7 @@ def add_chat_messages_batch(current_user, chat_id):
                 result = await db.create('message', message_data)
                 
                 if result and len(result) > 0:
-                    created_messages.append(result[0])
+                    created_messages.append(without_index_fields(result[0]))
                     last_message = result[0]
             
             # 如果有消息被创建，更新聊天会话的最后消息时间和预览
@@ -503,12 +622,25 @@ def add_chat_messages_batch(current_user, chat_id):
                     'last_message_preview': preview
                 }
                 
-                await db.update(f"chat:{chat_id}", update_data)
+                # 只更新仍然存在的聊天，不会为已清理的聊天重新创建记录
+                await db.query(
+                    """
+                    LET $live = (SELECT VALUE id FROM type::thing('chat', $chat_key) WHERE deleted_at = NONE);
+                    UPDATE $live MERGE $data RETURN NONE;
+                    """,
+                    {'chat_key': chat_id, 'data': update_data}
+                )
+                chat_list_cache.touch(user_id, chat_id, update_data['last_message_at'], preview)
             
             return created_messages
         
         created_messages = run_async(_create_messages_batch())
         
+        if created_messages is None:
+            chat_owner_cache.invalidate(chat_id)
+            chat_list_cache.remove(user_id, chat_id)
+            return jsonify({'error': 'Chat not found'}), 404
+        
         if created_messages:
             return jsonify({
                 'message': f'{len(created_messages)} messages added successfully',
@@ -517,6 +649,8 @@ def add_chat_messages_batch(current_user, chat_id):
         else:
             return jsonify({'error': 'Failed to add messages'}), 500
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error adding messages batch: {str(e)}")
         return jsonify({'error': f'Failed to add messages batch: {str(e)}'}), 500
@@ -1,26 +1,28 @@
 from flask import Blueprint, request, Response, current_app
 import json
-import os
 import time
 import uuid
-import requests
-from openai import OpenAI
 from dotenv import load_dotenv
 
-# 导入AI-Agent模块
-from app.agent.ai_assistant import AIAssistant
+# AI-Agent模块（openai、numpy等较重的依赖）在第一次请求时才导入，见 new_ai_assistant 和 _create_completion
+from app.agent.admission import LLM_QUEUE_TIMEOUT, AdmissionRejected, llm_slot, tier_key
+from app.agent.single_flight import llm_flight
+from app.agent.model_selector import select_model, record_choice
+from app.utils.circuit_breaker import CircuitOpen, get_breaker
+from app.utils.deadline import DeadlineExceeded, time_left
+from app.middleware.rate_limit import authenticated_user_id, enforce_quota, identify_request
 
 # 加载环境变量
 load_dotenv()
 
-# 获取OpenAI API密钥
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+def new_ai_assistant():
+    """为一次请求创建AI助手
 
-# 初始OpenAI客户端
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# 创建AI-Agent实例
-ai_assistant = AIAssistant(model_name="gpt-3.5-turbo")
+    上下文构建器保存着本轮的消息和检索到的个人记忆，不能在并发的请求之间共享；
+    LLM客户端、路由、熔断器和记忆库都是进程内共享的单例，创建助手本身很轻。
+    """
+    from app.agent.ai_assistant import AIAssistant
+    return AIAssistant()
 
 # 创建API蓝图
 chat_bp = Blueprint('chat', __name__, url_prefix='/api')
@@ -84,15 +86,44 @@ AVAILABLE_TOOLS = [
     }
 ]
 
+def _busy_response(error):
+    """LLM并发名额排队超时或上游熔断"""
+    return Response(
+        json.dumps({"error": str(error), "retry_after": error.retry_after}),
+        status=503,
+        headers={"Retry-After": str(error.retry_after)},
+        mimetype='application/json'
+    )
+
+def _flight_timeout():
+    """等待相同请求的结果的最长时间：排队加上调用的时间，不超过请求的剩余时间"""
+    from app.agent.llm_caller import LLM_REQUEST_TIMEOUT
+    return time_left(LLM_QUEUE_TIMEOUT + LLM_REQUEST_TIMEOUT, 'LLM')
+
+def _create_completion(vip_level, **params):
+    """按VIP等级排队获取并发名额后调用OpenAI，和Agent共用OpenAI上游的熔断器和客户端"""
+    from app.agent.llm_caller import create_with_deadline, get_openai_client, upstream_errors
+    with get_breaker('llm.openai').guard(upstream_errors()), llm_slot(vip_level):
+        return create_with_deadline(get_openai_client().chat.completions.create, **params)
+
 # 添加一个支持工具调用的聊天端点
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
+    from app.agent.response_cache import default_temperature, get_response_cache, request_key
+    
     try:
+        # 每次提问扣减一次当日对话配额
+        exceeded = enforce_quota('chat')
+        if exceeded is not None:
+            return exceeded
+        
         data = request.json
         messages = data.get('messages', [])
         session_id = data.get('session_id', '')
         turn_id = data.get('turn_id', '')
         
+        _identity, vip_level = identify_request()
+        
         # 记录会话信息
         print(f"Session ID: {session_id}, Turn ID: {turn_id}")
         
@@ -146,14 +177,40 @@ def chat():
         if recommended_tools:
             should_recommend_tools = True
         
+        # 按本轮问题的复杂度选择模型
+        choice = select_model(openai_messages)
+        tools = recommended_tools or None
+        temperature = default_temperature(openai_messages)
+        
+        # 和Agent共用响应缓存，单轮的常见问题直接返回缓存的回复
+        cache = get_response_cache()
+        exact_key = context_key = None
+        if cache is not None and cache.cacheable(temperature):
+            exact_key, context_key = cache.keys_for(choice.model, openai_messages, tools, temperature, choice.max_tokens)
+            cached = cache.get(exact_key, context_key, openai_messages)
+            if cached is not None:
+                return cached
+        flight_key = tier_key(
+            exact_key or request_key(choice.model, openai_messages, tools, temperature, choice.max_tokens), vip_level
+        )
+        started = time.monotonic()
+        
         # 根据是否推荐工具决定API调用方式
         if should_recommend_tools:
-            # 使用OpenAI客户端的API，带工具定义
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=openai_messages,
-                tools=recommended_tools
+            # 使用OpenAI客户端的API，带工具定义；同一VIP等级的相同请求正在进行时共享它的结果
+            response, _shared = llm_flight.do(
+                flight_key,
+                lambda: _create_completion(
+                    vip_level,
+                    model=choice.model,
+                    messages=openai_messages,
+                    tools=recommended_tools,
+                    temperature=temperature,
+                    max_tokens=choice.max_tokens
+                ),
+                timeout=_flight_timeout()
             )
+            record_choice(choice, time.monotonic() - started)
             
             # 提取回复内容和工具调用
             if response.choices and len(response.choices) > 0:
@@ -185,14 +242,24 @@ def chat():
                     
                     response_data["tool_calls"] = formatted_tool_calls
                 
+                if exact_key is not None and not _shared:
+                    cache.set(exact_key, response_data, context_key, openai_messages)
                 print(f"Sending response with tools: {content[:50]}...")
                 return response_data
         else:
             # 使用OpenAI客户端的API（无工具）
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=openai_messages
+            response, _shared = llm_flight.do(
+                flight_key,
+                lambda: _create_completion(
+                    vip_level,
+                    model=choice.model,
+                    messages=openai_messages,
+                    temperature=temperature,
+                    max_tokens=choice.max_tokens
+                ),
+                timeout=_flight_timeout()
             )
+            record_choice(choice, time.monotonic() - started)
             
             # 提取回复内容
             if response.choices and len(response.choices) > 0:
@@ -210,6 +277,8 @@ def chat():
                     }
                 }
                 
+                if exact_key is not None and not _shared:
+                    cache.set(exact_key, response_data, context_key, openai_messages)
                 print(f"Sending response: {content[:50]}...")
                 return response_data
         
@@ -217,7 +286,12 @@ def chat():
         error_message = "OpenAI API 响应中没有内容"
         print(error_message)
         return {"error": error_message}, 500
-            
+    
+    except (AdmissionRejected, CircuitOpen) as e:
+        return _busy_response(e)
+    except DeadlineExceeded:
+        # 由截止时间中间件返回504
+        raise
     except Exception as e:
         print(f"Chat error: {str(e)}")
         return {"error": str(e)}, 500
@@ -246,17 +320,24 @@ def chat_test():
 @chat_bp.route('/chat/agent', methods=['POST'])
 def chat_agent():
     try:
+        exceeded = enforce_quota('chat')
+        if exceeded is not None:
+            return exceeded
+        
         data = request.json
         user_message = ""
         session_id = data.get('session_id', str(uuid.uuid4()))
-        user_id = data.get('user_id', 'user_' + str(uuid.uuid4())[:8])
+        # 长期记忆只按令牌中的用户读写，匿名请求不使用记忆
+        user_id = authenticated_user_id()
         ai_id = data.get('ai_id', 'ai_rainbow_city')
         
-        # 获取最后一条用户消息
+        # 获取最后一条用户消息，之前的消息作为本会话的历史
         messages = data.get('messages', [])
-        for msg in reversed(messages):
-            if msg.get('role') == 'user':
-                user_message = msg.get('content', '')
+        history = []
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get('role') == 'user':
+                user_message = messages[i].get('content', '')
+                history = messages[:i]
                 break
         
         if not user_message:
@@ -269,11 +350,13 @@ def chat_agent():
             )
         
         # 使用AI-Agent处理用户请求
-        result = ai_assistant.process_query(
+        result = new_ai_assistant().process_query(
             user_input=user_message,
             session_id=session_id,
             user_id=user_id,
-            ai_id=ai_id
+            ai_id=ai_id,
+            vip_level=identify_request()[1],
+            history=history or None
         )
         
         # 构建响应
@@ -309,6 +392,11 @@ def chat_agent():
             mimetype='application/json'
         )
         
+    except (AdmissionRejected, CircuitOpen) as e:
+        return _busy_response(e)
+    except DeadlineExceeded:
+        # 由截止时间中间件返回504
+        raise
     except Exception as e:
         current_app.logger.error(f"处理Agent聊天请求时出错: {str(e)}")
         return Response(
@@ -1,11 +1,20 @@
 from flask import Blueprint, request, jsonify, current_app
 from functools import wraps
-from app.db import create, query, update
+from app.db import create, query, update, execute
+from app.utils import metrics
+from app.utils.deletion_utils import schedule_deletion
+from app.utils.deadline import PASSTHROUGH_ERRORS
+from app.utils.pagination_utils import (
+    InvalidCursor, encode_cursor, get_page_args, get_fields, select_fields, stream_json_list
+)
 from datetime import datetime
 import jwt
 
 conversation_bp = Blueprint('conversation', __name__, url_prefix='/api/conversations')
 
+# 对话列表可以通过 ?fields= 选择的返回字段，只需要标题和预览时可以省略 messages
+CONVERSATION_LIST_FIELDS = ('id', 'title', 'preview', 'created_at', 'last_updated', 'messages')
+
 # JWT 认证装饰器
 def token_required(f):
     @wraps(f)
@@ -28,7 +37,7 @@ def token_required(f):
             
             # 查询用户
             users = query('users', {'id': user_id})
-            if not users or len(users) == 0:
+            if not users or len(users) == 0 or users[0].get('deleted_at'):
                 return jsonify({'error': 'Invalid token'}), 401
                 
             current_user = users[0]
@@ -39,94 +48,62 @@ def token_required(f):
     
     return decorated
 
-# 获取用户的所有对话
+# 获取用户的对话列表
 @conversation_bp.route('', methods=['GET'])
 @token_required
 def get_conversations(current_user):
+    """按最后更新时间分页获取当前用户的对话"""
     user_id = current_user.get('id')
     
     try:
-        # 查询用户的所有对话 - 使用原始SQL查询
-        from app.db import run_async, get_db
-        
-        async def _get_conversations():
-            try:
-                db = await get_db()
-                if db is None:
-                    print("数据库连接为空，返回空列表")
-                    return []
-                
-                # 先尝试直接查询
-                try:
-                    query_str = f"SELECT * FROM conversations WHERE user_id = '{user_id}'"
-                    print(f"Direct SQL query: {query_str}")
-                    result = await db.query(query_str)
-                    
-                    print(f"查询结果: {result}")
-                    
-                    if result and isinstance(result, list) and len(result) > 0:
-                        if 'result' in result[0]:
-                            return result[0]['result']
-                        elif isinstance(result[0], list):
-                            return result[0]
-                        else:
-                            return result
-                except Exception as e:
-                    print(f"第一种查询方式出错: {str(e)}")
-                
-                # 尝试第二种查询方式
-                try:
-                    print("尝试第二种查询方式...")
-                    result = await db.query(f"SELECT * FROM conversations")
-                    print(f"全表查询结果: {result}")
-                    
-                    if result and isinstance(result, list) and len(result) > 0:
-                        if 'result' in result[0]:
-                            all_conversations = result[0]['result']
-                            # 手动过滤用户ID
-                            return [conv for conv in all_conversations if conv.get('user_id') == user_id]
-                except Exception as e:
-                    print(f"第二种查询方式出错: {str(e)}")
-                
-                # 如果前两种方式都失败，尝试直接获取所有记录然后在应用层过滤
-                try:
-                    print("尝试获取所有记录...")
-                    all_records = await db.select("conversations")
-                    print(f"所有记录: {all_records}")
-                    
-                    if all_records and isinstance(all_records, list):
-                        # 手动过滤用户ID
-                        return [conv for conv in all_records if conv.get('user_id') == user_id]
-                except Exception as e:
-                    print(f"获取所有记录出错: {str(e)}")
-                
-                return []
-            except Exception as e:
-                print(f"_get_conversations内部错误: {str(e)}")
-                return []
-        
-        conversations = run_async(_get_conversations())
-        
-        # 打印详细的查询结果信息以便调试
-        print(f"最终查询结果 for user {user_id}: {conversations}")
-        
-        # 按最后更新时间排序
-        if conversations:
-            try:
-                conversations.sort(key=lambda x: x.get('last_updated', ''), reverse=True)
-            except Exception as e:
-                print(f"排序错误: {str(e)}")
-        
-        print(f"返回 {len(conversations) if conversations else 0} 个对话给用户 {user_id}")
-        
-        return jsonify({
-            'conversations': conversations or []
-        }), 200
+        limit, cursor = get_page_args()
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    fields = get_fields(CONVERSATION_LIST_FIELDS)
+    
+    # 排序键为 (last_updated, id) 降序，从游标之后继续
+    where = "user_id = $user_id AND deleted_at = NONE"
+    if cursor:
+        where += " AND (last_updated < $last OR (last_updated = $last AND id < type::thing('conversations', $key)))"
+    
+    try:
+        results = execute(
+            f"""
+            SELECT {', '.join(dict.fromkeys(('id', 'last_updated') + fields))} FROM conversations
+            WHERE {where}
+            ORDER BY last_updated DESC, id DESC
+            LIMIT $limit
+            """,
+            {
+                'user_id': user_id,
+                'limit': limit + 1,
+                'last': cursor.get('t') if cursor else None,
+                'key': cursor.get('k') if cursor else None,
+            }
+        )
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
+        # 直接失败，不退回到全表扫描
+        metrics.incr('conversations.list_errors')
         print(f"获取对话列表出错: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'获取对话列表失败: {str(e)}'}), 500
+        return jsonify({'error': '获取对话列表失败，请稍后重试'}), 503
+    
+    conversations = (results[-1] if results else []) or []
+    
+    next_cursor = None
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        next_cursor = encode_cursor({
+            't': last.get('last_updated'),
+            'k': str(last.get('id')).split(':', 1)[-1],
+        })
+    
+    return stream_json_list(
+        'conversations', conversations,
+        lambda conversation: select_fields(conversation, fields), lambda: next_cursor
+    )
 
 # 创建新对话
 @conversation_bp.route('', methods=['POST'])
@@ -172,6 +149,8 @@ def create_conversation(current_user):
             'message': 'Conversation created successfully',
             'conversation': conversation
         }), 201
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error creating conversation: {str(e)}")
         return jsonify({'error': 'Failed to create conversation'}), 500
@@ -188,7 +167,7 @@ def update_conversation(current_user, conversation_id):
     
     # 检查对话是否属于当前用户
     conversations = query('conversations', {'id': f'conversations:{conversation_id}'})
-    if not conversations or len(conversations) == 0:
+    if not conversations or len(conversations) == 0 or conversations[0].get('deleted_at'):
         return jsonify({'error': 'Conversation not found'}), 404
     
     conversation = conversations[0]
@@ -230,6 +209,8 @@ def update_conversation(current_user, conversation_id):
             'message': 'Conversation updated successfully',
             'conversation': updated_conversation
         }), 200
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error updating conversation: {str(e)}")
         return jsonify({'error': 'Failed to update conversation'}), 500
@@ -242,7 +223,7 @@ def delete_conversation(current_user, conversation_id):
     
     # 检查对话是否属于当前用户
     conversations = query('conversations', {'id': f'conversations:{conversation_id}'})
-    if not conversations or len(conversations) == 0:
+    if not conversations or len(conversations) == 0 or conversations[0].get('deleted_at'):
         return jsonify({'error': 'Conversation not found'}), 404
     
     conversation = conversations[0]
@@ -250,25 +231,15 @@ def delete_conversation(current_user, conversation_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     try:
-        # 删除对话
-        from app.db import run_async, get_db
+        # 立即隐藏对话，由后台任务删除
+        job_id = schedule_deletion('conversation', conversation_id)
         
-        async def _delete():
-            db = await get_db()
-            if db is None:
-                return False
-            
-            await db.delete(f"conversations:{conversation_id}")
-            return True
-        
-        result = run_async(_delete())
-        
-        if result:
-            return jsonify({
-                'message': 'Conversation deleted successfully'
-            }), 200
-        else:
-            return jsonify({'error': 'Failed to delete conversation'}), 500
+        return jsonify({
+            'message': 'Conversation deleted successfully',
+            'deletion_job': job_id
+        }), 200
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error deleting conversation: {str(e)}")
         return jsonify({'error': 'Failed to delete conversation'}), 500
@@ -7,6 +7,7 @@ import os
 import uuid
 from werkzeug.utils import secure_filename
 from app.agent.file_processor import handle_file_upload
+from app.utils.deadline import PASSTHROUGH_ERRORS
 
 # 创建蓝图
 file_bp = Blueprint('file', __name__, url_prefix='/api/file')
@@ -73,6 +74,8 @@ def upload_file():
             return jsonify({'error': '文件处理失败'}), 500
         
         return jsonify(result)
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
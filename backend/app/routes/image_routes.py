@@ -9,6 +9,7 @@ import uuid
 from werkzeug.utils import secure_filename
 from app.agent.image_processor import ImageData, handle_file_upload
 from app.agent.tool_invoker import analyze_image
+from app.utils.deadline import PASSTHROUGH_ERRORS
 
 # 创建蓝图
 image_bp = Blueprint('image', __name__)
@@ -59,6 +60,8 @@ def upload_image():
             'filename': unique_filename,
             'url': file_url
         })
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
@@ -84,6 +87,8 @@ def analyze_image_route():
             'success': True,
             'result': result
         })
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         return jsonify({'error': f'分析失败: {str(e)}'}), 500
 
@@ -124,5 +129,7 @@ def handle_base64_image():
             'filename': filename,
             'url': file_url
         })
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
@@ -11,8 +11,16 @@ from flask import Blueprint, request, jsonify, current_app, redirect
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models.user import User
 from app.models.enums import PromoterType, UserRole
-from app.models.promotion import PromoterLink, ClickRecord, ConversionRecord, CommissionRecord, WithdrawalRecord
+from app.models.promotion import (
+    PromoterLink, ConversionRecord, CommissionRecord, WithdrawalRecord
+)
 from app.extensions import db
+from app.utils.promotion_utils import link_cache, click_pipeline, get_rollups
+from app.utils.admin_utils import record_promoter_change
+from app.utils.pagination_utils import (
+    InvalidCursor, get_page_args, get_fields, paginate_query, select_fields,
+    stream_json_list, stream_csv, wants_csv, iter_export
+)
 from datetime import datetime
 import uuid
 import random
@@ -21,30 +29,37 @@ import string
 # 创建蓝图
 promoter_bp = Blueprint('promoter', __name__, url_prefix='/api/promoter')
 
+# 列表接口可以通过 ?fields= 选择的返回字段
+COMMISSION_FIELDS = ('id', 'user_id', 'conversion_id', 'amount', 'rate', 'status', 'created_at', 'paid_at')
+WITHDRAWAL_FIELDS = ('id', 'user_id', 'amount', 'status', 'created_at', 'processed_at', 'processor_id',
+                     'payment_method', 'payment_account', 'remark')
+APPLICATION_FIELDS = ('user_id', 'username', 'email', 'display_name', 'vip_level', 'promoter_type',
+                      'application_date')
+
+@promoter_bp.errorhandler(InvalidCursor)
+def handle_invalid_cursor(error):
+    return jsonify({'success': False, 'message': '无效的分页游标'}), 400
+
 # 推广链接追踪路由（无需认证）
 @promoter_bp.route('/r/<code>', methods=['GET'])
 def redirect_promoter_link(code):
     """推广链接重定向"""
-    # 查找推广链接
-    link = PromoterLink.query.filter_by(code=code, is_active=True).first()
+    # 从缓存中查找推广链接
+    cached = link_cache.get(code)
     
-    if not link:
+    if cached is None:
         return jsonify({'success': False, 'message': '无效的推广链接'}), 404
     
-    # 记录点击
-    click = ClickRecord(
-        link_id=link.id,
+    # 点击放入队列，由后台线程批量写入
+    link_id, promoter_id = cached
+    click_pipeline.track(
+        link_id,
+        promoter_id,
         ip_address=request.remote_addr,
         user_agent=request.user_agent.string,
         referer=request.referrer
     )
     
-    # 增加点击次数
-    link.clicks += 1
-    
-    db.session.add(click)
-    db.session.commit()
-    
     # 重定向到注册页面，带上推广码
     return redirect(f"/register?ref={code}")
 
@@ -143,6 +158,7 @@ def update_promoter_link(link_id):
         link.is_active = is_active
     
     db.session.commit()
+    link_cache.invalidate(link.code)
     
     return jsonify({'success': True, 'link': link.to_dict()}), 200
 
@@ -168,6 +184,7 @@ def delete_promoter_link(link_id):
     # 不真正删除，只是设置为非活动状态
     link.is_active = False
     db.session.commit()
+    link_cache.invalidate(link.code)
     
     return jsonify({'success': True, 'message': '推广链接已删除'}), 200
 
@@ -184,12 +201,15 @@ def get_commissions():
     if not user.is_promoter():
         return jsonify({'success': False, 'message': '您不是推广用户'}), 403
     
-    # 获取佣金记录
-    commissions = CommissionRecord.query.filter_by(user_id=user_id).order_by(CommissionRecord.created_at.desc()).all()
-    
-    result = [comm.to_dict() for comm in commissions]
+    # 按创建时间倒序分页获取佣金记录
+    limit, cursor = get_page_args()
+    fields = get_fields(COMMISSION_FIELDS)
+    rows, next_cursor = paginate_query(
+        CommissionRecord.query.filter_by(user_id=user_id),
+        CommissionRecord.id, cursor, limit, order_column=CommissionRecord.created_at
+    )
     
-    return jsonify({'success': True, 'commissions': result}), 200
+    return stream_json_list('commissions', rows, lambda comm: select_fields(comm.to_dict(), fields), next_cursor)
 
 @promoter_bp.route('/withdrawals', methods=['GET'])
 @jwt_required()
@@ -204,12 +224,15 @@ def get_withdrawals():
     if not user.is_promoter():
         return jsonify({'success': False, 'message': '您不是推广用户'}), 403
     
-    # 获取提现记录
-    withdrawals = WithdrawalRecord.query.filter_by(user_id=user_id).order_by(WithdrawalRecord.created_at.desc()).all()
-    
-    result = [withdrawal.to_dict() for withdrawal in withdrawals]
+    # 按创建时间倒序分页获取提现记录
+    limit, cursor = get_page_args()
+    fields = get_fields(WITHDRAWAL_FIELDS)
+    rows, next_cursor = paginate_query(
+        WithdrawalRecord.query.filter_by(user_id=user_id),
+        WithdrawalRecord.id, cursor, limit, order_column=WithdrawalRecord.created_at
+    )
     
-    return jsonify({'success': True, 'withdrawals': result}), 200
+    return stream_json_list('withdrawals', rows, lambda withdrawal: select_fields(withdrawal.to_dict(), fields), next_cursor)
 
 # 辅助函数
 def generate_random_string(length):
@@ -266,16 +289,16 @@ def get_promoter_applications():
     if not user or not user.is_admin():
         return jsonify({'success': False, 'message': '权限不足'}), 403
     
-    # 获取所有待审核的申请
+    # 待审核的申请
     applications = User.query.filter(
         User.promoter_type.isnot(None),
         User.promoter_approved == False,
         User.promoter_application_date.isnot(None)
-    ).all()
+    )
+    fields = get_fields(APPLICATION_FIELDS)
     
-    result = []
-    for app in applications:
-        result.append({
+    def serialize(app):
+        return select_fields({
             'user_id': app.id,
             'username': app.username,
             'email': app.email,
@@ -283,9 +306,19 @@ def get_promoter_applications():
             'vip_level': app.vip_level.value if app.vip_level else None,
             'promoter_type': app.promoter_type.value if app.promoter_type else None,
             'application_date': app.promoter_application_date.isoformat() if app.promoter_application_date else None
-        })
+        }, fields)
+    
+    # 导出全部申请为CSV
+    if wants_csv():
+        return stream_csv('promoter_applications.csv', fields,
+                          iter_export(applications.order_by(User.id), serialize))
+    
+    limit, cursor = get_page_args()
+    rows, next_cursor = paginate_query(
+        applications, User.id, cursor, limit, order_column=User.promoter_application_date
+    )
     
-    return jsonify({'success': True, 'applications': result}), 200
+    return stream_json_list('applications', rows, serialize, next_cursor)
 
 @promoter_bp.route('/approve/<int:user_id>', methods=['POST'])
 @jwt_required()
@@ -314,6 +347,7 @@ def approve_promoter(user_id):
     
     if success:
         db.session.commit()
+        record_promoter_change(1)
         return jsonify({'success': True, 'message': message}), 200
     else:
         return jsonify({'success': False, 'message': message}), 400
@@ -381,31 +415,42 @@ def get_promoter_stats():
     if not user.is_promoter():
         return jsonify({'success': False, 'message': '您不是推广用户'}), 403
     
-    # 获取用户的推广链接
-    links = PromoterLink.query.filter_by(user_id=user_id).all()
-    
-    # 计算总点击、注册和转化数
-    total_clicks = sum(link.clicks for link in links)
-    total_registrations = sum(link.registrations for link in links)
-    total_conversions = sum(link.conversions for link in links)
-    
-    # 获取本月佣金
-    current_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    month_commissions = CommissionRecord.query.filter(
-        CommissionRecord.user_id == user_id,
-        CommissionRecord.created_at >= current_month,
-        CommissionRecord.status != 'cancelled'
-    ).all()
-    earnings_this_month = sum(comm.amount for comm in month_commissions)
+    # 从月汇总中读取累计数据，每个月只有一行
+    monthly = get_rollups(user_id, 'month')
+    today = datetime.utcnow().date()
+    current_month = today.replace(day=1)
+    this_month = next((row for row in monthly if row.get('month') == current_month.strftime('%Y-%m')), None)
     
     stats = {
-        'clicks': total_clicks,
-        'registrations': total_registrations,
-        'conversions': total_conversions,
-        'earnings_this_month': earnings_this_month,
+        'clicks': sum(row.get('clicks') or 0 for row in monthly),
+        'registrations': sum(row.get('registrations') or 0 for row in monthly),
+        'conversions': sum(row.get('conversions') or 0 for row in monthly),
+        'earnings_this_month': (this_month or {}).get('commission_amount') or 0,
         'earnings_total': user.promoter_total_earnings
     }
     
+    # 指定日期范围时，从日汇总中读取每天的数据
+    start = request.args.get('start')
+    end = request.args.get('end')
+    if start or end:
+        try:
+            start_day = datetime.strptime(start, '%Y-%m-%d').date() if start else current_month
+            end_day = datetime.strptime(end, '%Y-%m-%d').date() if end else today
+        except ValueError:
+            return jsonify({'success': False, 'message': '日期格式应为YYYY-MM-DD'}), 400
+        
+        daily = get_rollups(user_id, 'day', start_day.isoformat(), end_day.isoformat())
+        
+        stats['range'] = {
+            'start': start_day.isoformat(),
+            'end': end_day.isoformat(),
+            'clicks': sum(row.get('clicks') or 0 for row in daily),
+            'registrations': sum(row.get('registrations') or 0 for row in daily),
+            'conversions': sum(row.get('conversions') or 0 for row in daily),
+            'commission_amount': sum(row.get('commission_amount') or 0 for row in daily),
+            'daily': daily
+        }
+    
     return jsonify({'success': True, 'stats': stats}), 200
 
 @promoter_bp.route('/withdraw', methods=['POST'])
@@ -4,15 +4,14 @@ from datetime import datetime
 import uuid
 
 from flask import Blueprint, jsonify, request, current_app, abort
-from app.models.relationship import Relationship, RelationshipStatus
+from app.models.enums import RelationshipStatus
 from app.utils.relationship_utils import (
-    calculate_interaction_frequency,
-    calculate_emotional_density,
-    calculate_collaboration_depth,
-    calculate_ris,
+    compute_ris_components,
+    record_interaction_event,
     update_relationship_status,
 )
-from app.db import create, query, update as db_update
+from app.db import create, query, execute, update as db_update
+from app.utils.deadline import PASSTHROUGH_ERRORS
 
 relationship_bp = Blueprint("relationships", __name__, url_prefix="/relationships")
 
@@ -49,6 +48,9 @@ def create_relationship() -> tuple:
         # Set default values
         if "status" not in data:
             data["status"] = RelationshipStatus.ACTIVE.value
+
+        # 初始化物化的RIS字段
+        data.update(compute_ris_components(data))
             
         # Store in SurrealDB
         result = create('relationship', data)
@@ -62,6 +64,8 @@ def create_relationship() -> tuple:
         else:
             return jsonify({"error": "Failed to create relationship"}), 500
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error creating relationship: {str(e)}")
         return jsonify({"error": f"Failed to create relationship: {str(e)}"}), 500
@@ -89,6 +93,8 @@ def get_relationship(relationship_id: str) -> tuple:
         # 返回找到的第一个匹配结果
         return jsonify(results[0]), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error retrieving relationship: {str(e)}")
         return jsonify({'error': f'Failed to retrieve relationship: {str(e)}'}), 500
@@ -124,6 +130,10 @@ def update_relationship(relationship_id: str) -> tuple:
                 # 如果格式不正确，使用当前时间
                 data["last_active_time"] = datetime.utcnow().isoformat()
                 
+        # 计数器被修改时同步刷新物化的RIS字段
+        if {"interaction_count", "emotional_resonance_count"} & data.keys():
+            data.update(compute_ris_components({**results[0], **data}))
+
         # 使用SurrealDB的更新函数
         result = db_update('relationship', relationship_id, data)
         
@@ -133,6 +143,8 @@ def update_relationship(relationship_id: str) -> tuple:
         else:
             return jsonify({"error": "Failed to update relationship"}), 500
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error updating relationship: {str(e)}")
         return jsonify({"error": f"Failed to update relationship: {str(e)}"}), 500
@@ -156,6 +168,8 @@ def get_ai_relationships(ai_id: str) -> tuple:
         # 即使没有找到关系，也返回空列表而不是错误
         return jsonify(results if results else []), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error retrieving AI relationships: {str(e)}")
         return jsonify({'error': f'Failed to retrieve AI relationships: {str(e)}'}), 500
@@ -179,6 +193,8 @@ def get_user_relationships(human_id: str) -> tuple:
         # 即使没有找到关系，也返回空列表而不是错误
         return jsonify(results if results else []), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error retrieving user relationships: {str(e)}")
         return jsonify({'error': f'Failed to retrieve user relationships: {str(e)}'}), 500
@@ -211,6 +227,8 @@ def get_relationship_status(relationship_id: str) -> tuple:
             # 如果没有状态字段，默认为活跃状态
             return jsonify({"status": RelationshipStatus.ACTIVE.value}), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error retrieving relationship status: {str(e)}")
         return jsonify({'error': f'Failed to retrieve relationship status: {str(e)}'}), 500
@@ -254,6 +272,8 @@ def update_relationship_status_route(relationship_id: str) -> tuple:
         else:
             return jsonify({"error": "Failed to update relationship status"}), 500
             
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error updating relationship status: {str(e)}")
         return jsonify({"error": f"Failed to update relationship status: {str(e)}"}), 500
@@ -280,27 +300,96 @@ def get_relationship_ris(relationship_id: str) -> tuple:
             
         # 获取关系数据
         relationship = results[0]
-        
-        # 计算RIS分数
-        interaction_count = relationship.get('interaction_count', 0)
-        emotional_resonance_count = relationship.get('emotional_resonance_count', 0)
-        
-        interaction_frequency = calculate_interaction_frequency(interaction_count)
-        emotional_density = calculate_emotional_density(emotional_resonance_count)
-        collaboration_depth = calculate_collaboration_depth(relationship)
-        
-        ris = calculate_ris(interaction_frequency, emotional_density, collaboration_depth)
+
+        # 旧记录还没有物化字段时，计算一次并回写
+        if relationship.get("ris") is None:
+            components = compute_ris_components(relationship)
+            execute("UPDATE $id MERGE $components RETURN NONE",
+                    {"id": relationship["id"], "components": components})
+            relationship.update(components)
         
         # 返回结果以及各个组成部分的分数
         return jsonify({
-            "ris": ris,
+            "ris": relationship["ris"],
             "components": {
-                "interaction_frequency": interaction_frequency,
-                "emotional_density": emotional_density,
-                "collaboration_depth": collaboration_depth
-            }
+                "interaction_frequency": relationship.get("interaction_frequency", 0.0),
+                "emotional_density": relationship.get("emotional_density", 0.0),
+                "collaboration_depth": relationship.get("collaboration_depth", 0.0)
+            },
+            "updated_at": relationship.get("ris_updated_at")
         }), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error calculating relationship RIS: {str(e)}")
-        return jsonify({'error': f'Failed to calculate relationship RIS: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'Failed to calculate relationship RIS: {str(e)}'}), 500
+
+
+@relationship_bp.route("/<string:relationship_id>/interactions", methods=["POST"])
+def record_relationship_interaction(relationship_id: str) -> tuple:
+    """
+    Record an interaction event and incrementally update the relationship's RIS.
+
+    Args:
+        relationship_id (str): The ID of the relationship.
+
+    Returns:
+        tuple: A tuple containing the JSON response and the HTTP status code.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        relationship = record_interaction_event(
+            relationship_id,
+            emotional_resonance=bool(data.get("emotional_resonance", False)),
+        )
+
+        if relationship is None:
+            return jsonify({"error": "Relationship not found"}), 404
+
+        return jsonify({
+            "message": "Interaction recorded",
+            "interaction_count": relationship.get("interaction_count"),
+            "ris": relationship.get("ris")
+        }), 200
+
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        current_app.logger.error(f"Error recording relationship interaction: {str(e)}")
+        return jsonify({"error": f"Failed to record interaction: {str(e)}"}), 500
+
+
+@relationship_bp.route("/top", methods=["GET"])
+def get_top_relationships() -> tuple:
+    """
+    Get the relationships with the highest RIS, optionally filtered by AI or user.
+
+    Returns:
+        tuple: A tuple containing the JSON response and the HTTP status code.
+    """
+    try:
+        limit = min(request.args.get("limit", 10, type=int), 100)
+        human_id = request.args.get("human_id")
+        ai_id = request.args.get("ai_id")
+
+        conditions = []
+        if human_id:
+            conditions.append("human_id = $human_id")
+        if ai_id:
+            conditions.append("ai_id = $ai_id")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # 物化的ris字段有索引，排行榜是一次索引排序而不是全表计算
+        results = execute(
+            f"SELECT * FROM relationship {where} ORDER BY ris DESC LIMIT $limit",
+            {"human_id": human_id, "ai_id": ai_id, "limit": limit},
+        )
+
+        return jsonify(results[0] if results else []), 200
+
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving top relationships: {str(e)}")
+        return jsonify({'error': f'Failed to retrieve top relationships: {str(e)}'}), 500
@@ -2,16 +2,21 @@ from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime, timedelta
 from app.models.user import User
 from app.models.enums import VIPLevel
-from app.db import db_session
-from app.routes.auth_routes import token_required
-import stripe
+from app.db import db_session, execute
+from app.models.quota import parse_vip_level
+from app.routes.auth_routes import generate_token, token_required
+from app.utils.quota_utils import get_quota_usage, invalidate_vip_level
+from app.utils.admin_utils import record_vip_change
+from app.utils.deadline import PASSTHROUGH_ERRORS
 import logging
 
 vip_bp = Blueprint('vip', __name__, url_prefix='/vip')
 
-# 初始化Stripe
+# 初始化Stripe（在第一次支付请求时才导入，不拖慢启动）
 def init_stripe():
+    import stripe
     stripe.api_key = current_app.config.get('STRIPE_SECRET_KEY')
+    return stripe
 
 # VIP套餐价格配置（单位：分）
 VIP_PRICES = {
@@ -121,12 +126,20 @@ def get_vip_status(current_user):
         'benefits': VIP_BENEFITS.get(current_user.vip_level.name if current_user.vip_level else 'free', {})
     }), 200
 
+@vip_bp.route('/quota', methods=['GET'])
+@token_required
+def get_quota(current_user):
+    """获取当前用户各项配额在当前时间窗口内的使用情况"""
+    return jsonify({
+        'quota': get_quota_usage(current_user.get('id'))
+    }), 200
+
 @vip_bp.route('/checkout', methods=['POST'])
 @token_required
 def create_checkout_session(current_user):
     """创建Stripe结账会话"""
     try:
-        init_stripe()
+        stripe = init_stripe()
         
         data = request.get_json()
         if not data or 'plan' not in data or 'interval' not in data:
@@ -162,7 +175,7 @@ def create_checkout_session(current_user):
             success_url=f"{request.host_url}vip/success?session_id={{CHECKOUT_SESSION_ID}}",
             cancel_url=f"{request.host_url}vip/cancel",
             metadata={
-                'user_id': current_user.id,
+                'user_id': current_user.get('id'),
                 'plan': plan,
                 'interval': interval,
                 'months': months
@@ -174,16 +187,42 @@ def create_checkout_session(current_user):
             'session_id': checkout_session.id
         }), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error creating checkout session: {str(e)}")
         return jsonify({'error': f'Failed to create checkout session: {str(e)}'}), 500
 
+def _apply_vip_purchase(user_id, plan, months):
+    """把用户的等级设为购买的套餐并延长到期时间，返回 (原等级, 新的到期时间)；用户不存在时返回None"""
+    key = user_id.split(':', 1)[-1]
+    results = execute("SELECT vip_level, vip_expiry FROM type::thing('users', $key)", {'key': key})
+    users = (results[0] if results else None) or []
+    if not users:
+        return None
+    old_level = users[0].get('vip_level')
+    now = datetime.utcnow()
+    vip_expiry = users[0].get('vip_expiry')
+    # 当前VIP未过期时延长时间，否则从现在开始计算
+    start = datetime.fromisoformat(vip_expiry) if vip_expiry and vip_expiry > now.isoformat() else now
+    new_expiry = (start + timedelta(days=30*months)).isoformat()
+    execute(
+        "UPDATE type::thing('users', $key) SET vip_level = $level, vip_expiry = $expiry RETURN NONE",
+        {'key': key, 'level': plan, 'expiry': new_expiry},
+    )
+    invalidate_vip_level(user_id)
+    return old_level, new_expiry
+
 @vip_bp.route('/success', methods=['GET'])
 @token_required
 def payment_success(current_user):
-    """支付成功处理"""
+    """支付成功页面：返回用户当前的VIP状态和带有最新等级的令牌
+
+    升级只在Webhook中完成（本页面可能被重复打开，也可能早于Webhook到达），这里只读取已经保存的状态；
+    限流和LLM排队按数据库中的等级识别用户（见 identify_request），换不换令牌都会在缓存过期后生效。
+    """
     try:
-        init_stripe()
+        stripe = init_stripe()
         
         session_id = request.args.get('session_id')
         if not session_id:
@@ -193,35 +232,19 @@ def payment_success(current_user):
         session = stripe.checkout.Session.retrieve(session_id)
         
         # 验证用户ID
-        if int(session.metadata.get('user_id', 0)) != current_user.id:
+        if session.metadata.get('user_id') != current_user.get('id'):
             return jsonify({'error': 'Unauthorized'}), 403
         
-        # 获取计划信息
-        plan = session.metadata.get('plan')
-        months = int(session.metadata.get('months', 1))
-        
-        # 更新用户VIP状态
-        try:
-            current_user.vip_level = VIPLevel[plan]
-        except KeyError:
-            return jsonify({'error': 'Invalid plan'}), 400
-        
-        # 设置过期时间
-        if current_user.vip_expiry and current_user.vip_expiry > datetime.utcnow():
-            # 如果当前VIP未过期，则延长时间
-            current_user.vip_expiry = current_user.vip_expiry + timedelta(days=30*months)
-        else:
-            # 否则从现在开始计算
-            current_user.vip_expiry = datetime.utcnow() + timedelta(days=30*months)
-        
-        db_session.commit()
-        
         return jsonify({
             'message': 'Payment successful',
-            'vip_level': current_user.vip_level.value,
-            'vip_expiry': current_user.vip_expiry.isoformat()
+            'upgraded': session.metadata.get('plan') == current_user.get('vip_level'),
+            'vip_level': current_user.get('vip_level'),
+            'vip_expiry': current_user.get('vip_expiry'),
+            'token': generate_token(current_user.get('id'), current_user.get('vip_level'), current_user.get('vip_expiry'))
         }), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error processing payment success: {str(e)}")
         return jsonify({'error': f'Failed to process payment: {str(e)}'}), 500
@@ -230,7 +253,7 @@ def payment_success(current_user):
 def stripe_webhook():
     """处理Stripe Webhook事件"""
     try:
-        init_stripe()
+        stripe = init_stripe()
         
         payload = request.get_data(as_text=True)
         sig_header = request.headers.get('Stripe-Signature')
@@ -255,36 +278,34 @@ def stripe_webhook():
             session = event['data']['object']
             
             # 获取用户和计划信息
-            user_id = int(session.metadata.get('user_id', 0))
+            user_id = session.metadata.get('user_id')
             plan = session.metadata.get('plan')
             months = int(session.metadata.get('months', 1))
             
-            # 查找用户
-            user = User.query.get(user_id)
-            if not user:
-                current_app.logger.error(f"User not found: {user_id}")
-                return jsonify({'error': 'User not found'}), 404
-            
-            # 更新用户VIP状态
-            try:
-                user.vip_level = VIPLevel[plan]
-            except KeyError:
+            if plan not in VIPLevel.__members__:
                 current_app.logger.error(f"Invalid plan: {plan}")
                 return jsonify({'error': 'Invalid plan'}), 400
             
-            # 设置过期时间
-            if user.vip_expiry and user.vip_expiry > datetime.utcnow():
-                # 如果当前VIP未过期，则延长时间
-                user.vip_expiry = user.vip_expiry + timedelta(days=30*months)
-            else:
-                # 否则从现在开始计算
-                user.vip_expiry = datetime.utcnow() + timedelta(days=30*months)
+            # 更新用户VIP状态
+            applied = _apply_vip_purchase(user_id, plan, months) if user_id else None
+            if applied is None:
+                current_app.logger.error(f"User not found: {user_id}")
+                return jsonify({'error': 'User not found'}), 404
+            old_level, vip_expiry = applied
+            record_vip_change(parse_vip_level(old_level), VIPLevel[plan])
+            current_app.logger.info(f"Updated VIP status for user {user_id}: {plan}, expires {vip_expiry}")
             
-            db_session.commit()
-            current_app.logger.info(f"Updated VIP status for user {user_id}: {plan}, expires {user.vip_expiry}")
+            # 推广转化和佣金只在Webhook中记录，支付成功页面可能被重复打开
+            try:
+                from app.utils.promotion_utils import record_vip_purchase
+                record_vip_purchase(user_id, session.get('amount_total') or 0)
+            except Exception as e:
+                current_app.logger.error(f"Error recording promoter conversion for user {user_id}: {str(e)}")
         
         return jsonify({'status': 'success'}), 200
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error processing webhook: {str(e)}")
         return jsonify({'error': f'Failed to process webhook: {str(e)}'}), 500
@@ -311,10 +332,12 @@ def admin_set_vip(current_user):
         return jsonify({'error': 'User not found'}), 404
     
     # 设置VIP等级
+    old_level = user.vip_level
     try:
         user.vip_level = VIPLevel[vip_level_name]
     except KeyError:
         return jsonify({'error': 'Invalid VIP level'}), 400
+    record_vip_change(old_level, user.vip_level)
     
     # 设置过期时间
     user.vip_expiry = datetime.utcnow() + timedelta(days=duration_days)
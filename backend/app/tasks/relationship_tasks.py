@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+import logging
+
+import numpy as np
+
+from app.db import execute
+from app.models.enums import RelationshipStatus
+from app.utils.relationship_utils import (
+    MAX_INTERACTIONS,
+    EMOTIONAL_WINDOW,
+    RIS_WEIGHTS,
+    COOLING_AFTER_DAYS,
+    SILENT_AFTER_DAYS,
+    calculate_collaboration_depth,
+)
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每批导出和回写的关系数量
+RIS_BATCH_SIZE = 1000
+
+# 每批状态迁移更新的最大行数
+STATUS_DECAY_BATCH_SIZE = 5000
+
+# SurrealDB relationship 表的状态迁移规则：(原状态, 目标状态, 最少未活跃天数, 最多未活跃天数)
+# 与 update_relationship_status 的判断保持一致；ai_relationships 只是没有接入的SQLAlchemy模型，线上没有这张表
+STATUS_DECAY_RULES = [
+    ([RelationshipStatus.ACTIVE.value, RelationshipStatus.COOLING.value],
+     RelationshipStatus.SILENT.value, SILENT_AFTER_DAYS, None),
+    ([RelationshipStatus.ACTIVE.value],
+     RelationshipStatus.COOLING.value, COOLING_AFTER_DAYS, SILENT_AFTER_DAYS),
+    ([RelationshipStatus.COOLING.value, RelationshipStatus.SILENT.value],
+     RelationshipStatus.ACTIVE.value, None, COOLING_AFTER_DAYS),
+]
+
+
+def compute_ris_batch(interaction_counts, emotional_resonance_counts, collaboration_depths):
+    """对导出的列做向量化RIS计算，公式与 relationship_utils 中的单条计算一致"""
+    interaction_frequency = np.minimum(interaction_counts / MAX_INTERACTIONS, 1.0)
+    emotional_density = emotional_resonance_counts / EMOTIONAL_WINDOW
+    collaboration_depth = np.minimum(collaboration_depths, 1.0)
+
+    weights = np.asarray(RIS_WEIGHTS)
+    factors = np.stack([interaction_frequency, emotional_density, collaboration_depth])
+    ris = weights @ factors
+
+    return interaction_frequency, emotional_density, collaboration_depth, ris
+
+
+def recompute_relationship_ris(batch_size=RIS_BATCH_SIZE):
+    """夜间批量重算所有关系的RIS，按记录ID分页导出列并逐批回写"""
+    logger.info("开始批量重算关系RIS...")
+
+    now = datetime.utcnow().isoformat()
+    cursor = None
+    total = 0
+
+    while True:
+        # 按ID做键集分页，每批只导出计算需要的列
+        where = "WHERE id > $cursor" if cursor is not None else ""
+        results = execute(
+            f"""
+            SELECT id, interaction_count, emotional_resonance_count, collaboration_depth
+            FROM relationship {where} ORDER BY id LIMIT $limit
+            """,
+            {"cursor": cursor, "limit": batch_size},
+        )
+        rows = results[0] if results else []
+        if not rows:
+            break
+
+        interaction_counts = np.fromiter(
+            (row.get("interaction_count") or 0 for row in rows), dtype=float, count=len(rows))
+        emotional_resonance_counts = np.fromiter(
+            (row.get("emotional_resonance_count") or 0 for row in rows), dtype=float, count=len(rows))
+        collaboration_depths = np.fromiter(
+            (calculate_collaboration_depth(row) for row in rows), dtype=float, count=len(rows))
+
+        interaction_frequency, emotional_density, collaboration_depth, ris = compute_ris_batch(
+            interaction_counts, emotional_resonance_counts, collaboration_depths)
+
+        updates = [
+            {
+                "id": row["id"],
+                "interaction_frequency": float(interaction_frequency[i]),
+                "emotional_density": float(emotional_density[i]),
+                "collaboration_depth": float(collaboration_depth[i]),
+                "ris": float(ris[i]),
+            }
+            for i, row in enumerate(rows)
+        ]
+
+        # 一次往返回写整批结果
+        execute(
+            """
+            FOR $row IN $updates {
+                UPDATE $row.id SET
+                    interaction_frequency = $row.interaction_frequency,
+                    emotional_density = $row.emotional_density,
+                    collaboration_depth = $row.collaboration_depth,
+                    ris = $row.ris,
+                    ris_updated_at = $now
+                RETURN NONE;
+            };
+            """,
+            {"updates": updates, "now": now},
+        )
+
+        total += len(rows)
+        cursor = rows[-1]["id"]
+        logger.info(f"已重算 {total} 条关系的RIS")
+
+        if len(rows) < batch_size:
+            break
+
+    logger.info(f"RIS批量重算完成，共处理 {total} 条关系")
+    return total
+
+
+def _apply_status_rule(from_statuses, to_status, min_days, max_days, now, batch_size):
+    """按批执行一条状态迁移规则，返回更新的行数
+
+    已迁移的行不再满足条件，所以每批都是幂等的：任务中断后重新运行即可从剩余行继续。
+    """
+    conditions = ["status IN $from_statuses"]
+    if min_days is not None:
+        conditions.append("last_active_time <= $older_than")
+    if max_days is not None:
+        conditions.append("last_active_time > $newer_than")
+
+    params = {
+        "from_statuses": from_statuses,
+        "to_status": to_status,
+        "older_than": (now - timedelta(days=min_days)).isoformat() if min_days is not None else None,
+        "newer_than": (now - timedelta(days=max_days)).isoformat() if max_days is not None else None,
+        "limit": batch_size,
+    }
+
+    changed = 0
+    while True:
+        results = execute(
+            f"""
+            LET $ids = (SELECT VALUE id FROM relationship WHERE {' AND '.join(conditions)} LIMIT $limit);
+            UPDATE $ids SET status = $to_status RETURN NONE;
+            RETURN array::len($ids);
+            """,
+            params,
+        )
+        batch_changed = results[-1] if results else 0
+        changed += batch_changed or 0
+
+        if not batch_changed or batch_changed < batch_size:
+            return changed
+
+
+def apply_status_decay(batch_size=STATUS_DECAY_BATCH_SIZE, now=None):
+    """用集合式UPDATE批量迁移关系状态，返回每条规则更新的行数"""
+    logger.info("开始批量更新关系状态...")
+
+    now = now or datetime.utcnow()
+    report = {}
+    for from_statuses, to_status, min_days, max_days in STATUS_DECAY_RULES:
+        changed = _apply_status_rule(from_statuses, to_status, min_days, max_days, now, batch_size)
+        key = f"{'/'.join(from_statuses)}->{to_status}"
+        report[key] = changed
+        if changed:
+            logger.info(f"{key}: 更新 {changed} 行")
+
+    logger.info(f"关系状态更新完成，共更新 {sum(report.values())} 行")
+    return report
@@ -0,0 +1,179 @@
+"""
+轻量级任务调度器
+按固定间隔（加随机抖动）运行后台任务，并通过租约锁保证多个进程中只有一个在执行同一任务
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+from app.db import execute
+
+logger = logging.getLogger(__name__)
+
+# 默认租约时长占运行间隔的比例：比间隔短，外部cron按同样的周期调用时上一次的租约已经过期，不会被误跳过
+LOCK_TTL_RATIO = 0.5
+
+
+class LocalLock:
+    """进程内租约锁，适用于单进程部署和开发环境"""
+
+    def __init__(self):
+        self._leases: Dict[str, float] = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        with self._guard:
+            if self._leases.get(name, 0.0) > now:
+                return False
+            self._leases[name] = now + ttl
+            return True
+
+    def release(self, name: str) -> None:
+        with self._guard:
+            self._leases.pop(name, None)
+
+
+class SurrealLeaseLock:
+    """基于SurrealDB记录的租约锁，多个worker或多台机器之间只有一个能拿到任务
+
+    租约带过期时间，持有者崩溃后锁会在ttl之后自动失效。
+    同一持有者可以续租。
+    """
+
+    def __init__(self, owner: Optional[str] = None):
+        self._owner = owner
+
+    @property
+    def owner(self) -> str:
+        # 按当前进程计算，预加载后fork出的每个worker都是不同的持有者
+        return self._owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    def acquire(self, name: str, ttl: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            results = execute(
+                """
+                UPDATE type::thing('task_lock', $name)
+                SET owner = $owner, expires_at = $expires_at
+                WHERE expires_at = NONE OR expires_at < $now OR owner = $owner
+                RETURN VALUE owner
+                """,
+                {
+                    "name": name,
+                    "owner": self.owner,
+                    "now": now.isoformat(),
+                    "expires_at": (now + timedelta(seconds=ttl)).isoformat(),
+                },
+            )
+        except Exception as e:
+            # 并发抢锁时的事务冲突同样视为没有拿到锁
+            logger.warning(f"获取任务锁 {name} 失败: {str(e)}")
+            return False
+
+        owners = results[0] if results else []
+        return self.owner in (owners or [])
+
+    def release(self, name: str) -> None:
+        try:
+            execute(
+                "UPDATE type::thing('task_lock', $name) SET expires_at = NONE WHERE owner = $owner RETURN NONE",
+                {"name": name, "owner": self.owner},
+            )
+        except Exception as e:
+            logger.warning(f"释放任务锁 {name} 失败: {str(e)}")
+
+
+@dataclass
+class ScheduledJob:
+    """调度的任务"""
+    name: str
+    func: Callable[[], object]
+    interval: float  # 运行间隔（秒）
+    jitter: float = 0.0  # 每次运行额外的随机延迟上限（秒）
+    lock_ttl: Optional[float] = None  # 租约时长，默认为运行间隔的 LOCK_TTL_RATIO 倍
+    next_run: float = field(default=0.0)
+    last_result: object = None
+
+    def schedule_next(self, now: float) -> None:
+        self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    """按间隔运行任务的调度器，可以前台阻塞运行，也可以在后台线程中运行"""
+
+    def __init__(self, lock=None, tick: float = 1.0):
+        self.lock = lock or SurrealLeaseLock()
+        self.tick = tick
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_job(self, name: str, func: Callable[[], object], interval: float,
+                jitter: float = 0.0, run_immediately: bool = False,
+                lock_ttl: Optional[float] = None) -> ScheduledJob:
+        """注册任务"""
+        job = ScheduledJob(name=name, func=func, interval=interval, jitter=jitter, lock_ttl=lock_ttl)
+        now = time.time()
+        if run_immediately:
+            job.next_run = now + random.uniform(0, jitter)
+        else:
+            job.schedule_next(now)
+        self.jobs[name] = job
+        return job
+
+    def run_job(self, job: ScheduledJob) -> bool:
+        """在持有锁的前提下运行一次任务，返回是否实际运行
+
+        成功后不释放租约：租约在半个运行间隔内有效，其他进程在这段时间内不会重复执行同一任务，
+        下一个周期开始前租约已经过期。只有失败时才释放，让其他进程可以尽快重试。
+        """
+        if not self.lock.acquire(job.name, job.lock_ttl or job.interval * LOCK_TTL_RATIO):
+            logger.info(f"任务 {job.name} 在本周期内已由其他进程执行，跳过")
+            return False
+
+        started = time.time()
+        try:
+            job.last_result = job.func()
+            logger.info(f"任务 {job.name} 完成，耗时 {time.time() - started:.2f}s，结果: {job.last_result}")
+        except Exception as e:
+            logger.error(f"任务 {job.name} 执行出错: {str(e)}")
+            self.lock.release(job.name)
+        return True
+
+    def run_pending(self) -> None:
+        """运行所有到期的任务"""
+        now = time.time()
+        for job in list(self.jobs.values()):
+            if job.next_run <= now:
+                self.run_job(job)
+                job.schedule_next(time.time())
+
+    def run_forever(self) -> None:
+        """阻塞运行，直到调用stop()"""
+        logger.info(f"调度器启动，共 {len(self.jobs)} 个任务")
+        while not self._stop_event.is_set():
+            self.run_pending()
+            self._stop_event.wait(self.tick)
+        logger.info("调度器已停止")
+
+    def start(self) -> threading.Thread:
+        """在后台守护线程中运行调度器"""
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
@@ -1,59 +1,144 @@
 from datetime import datetime
-from app.db import db_session
-from app.models.user import User
-from app.models.enums import VIPLevel, UserRole, PromoterStatus
+from app.db import execute
+from app.models.enums import VIPLevel, UserRole
+from app.models.quota import VIP_TIER_LIMITS
+from app.utils.admin_utils import increment_counters, recount_user_counters
+from app.utils.deletion_utils import run_deletion_jobs
+from app.tasks.scheduler import Scheduler
+from app.tasks.relationship_tasks import apply_status_decay, recompute_relationship_ris
 import logging
+import os
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def check_vip_expiry():
-    """检查所有用户的VIP过期状态并处理"""
+# 每批处理的过期用户数量
+VIP_EXPIRY_BATCH_SIZE = int(os.getenv('VIP_EXPIRY_BATCH_SIZE', 1000))
+
+# 调度间隔和抖动（秒）
+VIP_EXPIRY_INTERVAL = int(os.getenv('VIP_EXPIRY_INTERVAL', 3600))
+VIP_EXPIRY_JITTER = int(os.getenv('VIP_EXPIRY_JITTER', 300))
+RELATIONSHIP_DECAY_INTERVAL = int(os.getenv('RELATIONSHIP_DECAY_INTERVAL', 3600))
+RIS_RECOMPUTE_INTERVAL = int(os.getenv('RIS_RECOMPUTE_INTERVAL', 24 * 3600))
+QUOTA_PURGE_INTERVAL = int(os.getenv('QUOTA_PURGE_INTERVAL', 24 * 3600))
+ADMIN_RECOUNT_INTERVAL = int(os.getenv('ADMIN_RECOUNT_INTERVAL', 3600))
+DELETION_PURGE_INTERVAL = int(os.getenv('DELETION_PURGE_INTERVAL', 60))
+
+# 每批删除的过期配额计数记录数量
+QUOTA_PURGE_BATCH_SIZE = 5000
+
+# 单批降级：选出一批已过期的VIP用户，重置等级和限制，并暂停其中推广用户的推广权限
+EXPIRE_VIP_BATCH_QUERY = """
+LET $ids = (
+    SELECT VALUE id FROM users
+    WHERE vip_expiry != NONE AND vip_expiry < $now AND vip_level != $free
+    LIMIT $limit
+);
+UPDATE $ids SET
+    vip_level = $free,
+    daily_chat_limit = $limits.daily_chat_limit,
+    daily_lio_limit = $limits.daily_lio_limit,
+    ai_companions_limit = $limits.ai_companions_limit,
+    ai_awakener_limit = $limits.ai_awakener_limit,
+    weekly_invite_limit = $limits.weekly_invite_limit,
+    daily_chat_count = math::min([daily_chat_count ?? 0, $limits.daily_chat_limit]),
+    daily_lio_count = math::min([daily_lio_count ?? 0, $limits.daily_lio_limit]),
+    ai_companions_count = math::min([ai_companions_count ?? 0, $limits.ai_companions_limit]),
+    ai_awakened_count = math::min([ai_awakened_count ?? 0, $limits.ai_awakener_limit]),
+    weekly_invite_count = math::min([weekly_invite_count ?? 0, $limits.weekly_invite_limit])
+RETURN NONE;
+UPDATE $ids SET promoter_approved = false
+    WHERE roles CONTAINS $promoter AND promoter_approved = true
+RETURN VALUE id;
+RETURN array::len($ids);
+"""
+
+def check_vip_expiry(batch_size=VIP_EXPIRY_BATCH_SIZE):
+    """批量降级所有已过期的VIP用户，返回处理的用户数量"""
     logger.info("开始检查VIP过期状态...")
-    
-    # 查询所有VIP用户
-    vip_users = User.query.filter(User.vip_level != VIPLevel.free).all()
-    
+
+    now = datetime.utcnow().isoformat()
     expired_count = 0
-    for user in vip_users:
-        if user.vip_expiry and datetime.utcnow() > user.vip_expiry:
-            # 处理VIP过期
-            old_level = user.vip_level
-            
-            # 降级为免费用户
-            user.vip_level = VIPLevel.free
-            
-            # 更新用户限制
-            user.update_limits_based_on_vip()
-            
-            # 如果是推广用户，暂停推广权限
-            if user.has_role(UserRole.promoter) and user.promoter_status != PromoterStatus.suspended:
-                user.promoter_status = PromoterStatus.suspended
-                logger.info(f"用户 {user.id} ({user.username or user.email}) 的推广权限已暂停")
-            
-            expired_count += 1
-            logger.info(f"用户 {user.id} ({user.username or user.email}) 的VIP已过期，从 {old_level.value} 降级为 {user.vip_level.value}")
-    
+    suspended_count = 0
+
+    while True:
+        # 被降级的用户不再满足条件，所以中断后重新运行会从剩余用户继续
+        results = execute(EXPIRE_VIP_BATCH_QUERY, {
+            'now': now,
+            'limit': batch_size,
+            'free': VIPLevel.free.name,
+            'promoter': UserRole.promoter.value,
+            'limits': dict(VIP_TIER_LIMITS[VIPLevel.free]),
+        })
+        if not results:
+            break
+
+        batch_count = results[-1] or 0
+        expired_count += batch_count
+        suspended_count += len(results[-2] or [])
+
+        if batch_count < batch_size:
+            break
+
     if expired_count > 0:
-        # 提交数据库更改
-        db_session.commit()
-        logger.info(f"共处理 {expired_count} 个过期VIP用户")
+        increment_counters(totals={'vip_users': -expired_count, 'promoters': -suspended_count})
+        logger.info(f"共处理 {expired_count} 个过期VIP用户，暂停 {suspended_count} 个推广用户的推广权限")
     else:
         logger.info("没有发现过期VIP用户")
-    
+
     return expired_count
 
+def purge_expired_quota_counters(batch_size=QUOTA_PURGE_BATCH_SIZE):
+    """分批删除已经过了窗口期的配额计数记录，返回删除的数量
+
+    配额按时间桶计数，新窗口自动从0开始，这里只是回收旧记录占用的空间。
+    """
+    now = datetime.utcnow().isoformat()
+    purged = 0
+
+    while True:
+        results = execute(
+            """
+            LET $ids = (SELECT VALUE id FROM quota_counter WHERE expires_at < $now LIMIT $limit);
+            DELETE $ids;
+            RETURN array::len($ids);
+            """,
+            {'now': now, 'limit': batch_size},
+        )
+        batch_count = (results[-1] if results else 0) or 0
+        purged += batch_count
+
+        if batch_count < batch_size:
+            break
+
+    logger.info(f"已清理 {purged} 条过期配额计数")
+    return purged
+
+def create_scheduler(lock=None):
+    """创建注册了所有计划任务的调度器"""
+    scheduler = Scheduler(lock=lock)
+    scheduler.add_job('vip_expiry', check_vip_expiry,
+                      interval=VIP_EXPIRY_INTERVAL, jitter=VIP_EXPIRY_JITTER, run_immediately=True)
+    scheduler.add_job('relationship_status_decay', apply_status_decay,
+                      interval=RELATIONSHIP_DECAY_INTERVAL, jitter=RELATIONSHIP_DECAY_INTERVAL / 10)
+    scheduler.add_job('relationship_ris_recompute', recompute_relationship_ris,
+                      interval=RIS_RECOMPUTE_INTERVAL, jitter=RIS_RECOMPUTE_INTERVAL / 24)
+    scheduler.add_job('quota_counter_purge', purge_expired_quota_counters,
+                      interval=QUOTA_PURGE_INTERVAL, jitter=QUOTA_PURGE_INTERVAL / 24)
+    scheduler.add_job('admin_counter_recount', recount_user_counters,
+                      interval=ADMIN_RECOUNT_INTERVAL, jitter=ADMIN_RECOUNT_INTERVAL / 10)
+    scheduler.add_job('deletion_purge', run_deletion_jobs,
+                      interval=DELETION_PURGE_INTERVAL, run_immediately=True)
+    return scheduler
+
 def run_scheduled_tasks():
-    """运行所有计划任务"""
-    try:
-        # 检查VIP过期
-        check_vip_expiry()
-        
-        # 可以添加其他定时任务
-        
-        logger.info("所有计划任务已完成")
-    except Exception as e:
-        logger.error(f"计划任务执行出错: {str(e)}")
-        # 出错时回滚数据库
-        db_session.rollback()
+    """运行所有计划任务一次（适合由外部cron触发）"""
+    scheduler = create_scheduler()
+    for job in scheduler.jobs.values():
+        scheduler.run_job(job)
+    logger.info("所有计划任务已完成")
+
+if __name__ == '__main__':
+    # 作为独立进程运行调度器：python -m app.tasks.vip_tasks
+    create_scheduler().run_forever()
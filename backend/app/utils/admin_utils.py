@@ -0,0 +1,202 @@
+"""
+管理后台统计计数
+用户总数、VIP用户数和推广用户数保存在一条计数记录中，每日新增、活跃和VIP转化保存在按天的汇总记录中，
+注册、登录、VIP变更和推广审核时增量更新，定时任务做一次全量重算校正。
+仪表盘读取进程内缓存的快照，不扫描用户表。
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import logging
+import os
+import threading
+import time
+
+from app.db import execute
+from app.models.enums import VIPLevel, UserRole
+
+logger = logging.getLogger(__name__)
+
+# 仪表盘快照的最长缓存时间（秒）
+DASHBOARD_CACHE_TTL = float(os.getenv('ADMIN_DASHBOARD_CACHE_TTL', 30))
+
+# 计算转化率的统计窗口（天）
+CONVERSION_WINDOW_DAYS = 30
+
+# 允许增量更新的字段
+USER_COUNTER_FIELDS = ('total_users', 'vip_users', 'promoters')
+DAILY_COUNTER_FIELDS = ('new_users', 'active_users', 'vip_conversions')
+
+# Free等级在库中可能存的是名称或值
+FREE_LEVELS = [VIPLevel.free.name, VIPLevel.free.value]
+
+_snapshot: Optional[Dict] = None
+_snapshot_at = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def _today(now: Optional[datetime] = None) -> str:
+    return (now or datetime.utcnow()).strftime('%Y-%m-%d')
+
+
+def increment_counters(totals: Optional[Dict[str, int]] = None, daily: Optional[Dict[str, int]] = None,
+                       now: Optional[datetime] = None) -> None:
+    """原子累加全局计数和当天的汇总计数，一次往返完成"""
+    totals = {k: v for k, v in (totals or {}).items() if k in USER_COUNTER_FIELDS and v}
+    daily = {k: v for k, v in (daily or {}).items() if k in DAILY_COUNTER_FIELDS and v}
+    if not totals and not daily:
+        return
+
+    statements = []
+    if totals:
+        sets = ', '.join(f"{field} = ({field} ?? 0) + $totals.{field}" for field in totals)
+        statements.append(f"UPDATE system_counter:users SET {sets} RETURN NONE;")
+    if daily:
+        sets = ', '.join(f"{field} = ({field} ?? 0) + $daily.{field}" for field in daily)
+        statements.append(f"UPDATE type::thing('system_daily', $day) SET day = $day, {sets} RETURN NONE;")
+
+    try:
+        execute('\n'.join(statements), {'totals': totals, 'daily': daily, 'day': _today(now)})
+    except Exception as e:
+        # 计数偏差会在下一次全量重算时校正，不影响业务请求
+        logger.warning(f"更新统计计数失败: {str(e)}")
+
+
+def is_vip_level(level) -> bool:
+    """等级（名称、值或VIPLevel）是否为付费等级"""
+    return level is not None and _level_name(level) not in FREE_LEVELS
+
+
+def record_user_registered(vip_level=None, now: Optional[datetime] = None) -> None:
+    """新用户注册"""
+    is_vip = is_vip_level(vip_level)
+    increment_counters(
+        totals={'total_users': 1, 'vip_users': 1 if is_vip else 0},
+        daily={'new_users': 1},
+        now=now,
+    )
+
+
+def record_user_active(last_login, now: Optional[datetime] = None) -> None:
+    """用户登录；只有当天第一次登录才计入当日活跃用户"""
+    now = now or datetime.utcnow()
+    last = last_login.isoformat() if isinstance(last_login, datetime) else (last_login or '')
+    if last[:10] != _today(now):
+        increment_counters(daily={'active_users': 1}, now=now)
+
+
+def record_vip_change(old_level, new_level, now: Optional[datetime] = None) -> None:
+    """VIP等级变更：Free升级为付费等级计一次转化"""
+    was_vip = is_vip_level(old_level)
+    is_vip = is_vip_level(new_level)
+    if was_vip == is_vip:
+        return
+    increment_counters(
+        totals={'vip_users': 1 if is_vip else -1},
+        daily={'vip_conversions': 1 if is_vip else 0},
+        now=now,
+    )
+
+
+def record_promoter_change(delta: int) -> None:
+    """推广用户审核通过（+1）或被停用（-1）"""
+    increment_counters(totals={'promoters': delta})
+
+
+def _level_name(level) -> str:
+    return level.name if isinstance(level, VIPLevel) else str(level)
+
+
+def recount_user_counters(now: Optional[datetime] = None) -> Dict[str, int]:
+    """全量重算计数，校正增量更新可能产生的偏差（由定时任务调用）"""
+    now = now or datetime.utcnow()
+    day = _today(now)
+    results = execute(
+        """
+        LET $counts = {
+            total_users: (SELECT count() AS n FROM users WHERE deleted_at = NONE GROUP ALL)[0].n ?? 0,
+            vip_users: (SELECT count() AS n FROM users WHERE deleted_at = NONE
+                        AND vip_level != NONE AND vip_level NOT IN $free_levels GROUP ALL)[0].n ?? 0,
+            promoters: (SELECT count() AS n FROM users WHERE deleted_at = NONE
+                        AND roles CONTAINS $promoter AND promoter_approved = true GROUP ALL)[0].n ?? 0
+        };
+        LET $today = {
+            new_users: (SELECT count() AS n FROM users WHERE created_at >= $day GROUP ALL)[0].n ?? 0,
+            active_users: (SELECT count() AS n FROM users WHERE last_login >= $day GROUP ALL)[0].n ?? 0
+        };
+        UPDATE system_counter:users SET
+            total_users = $counts.total_users,
+            vip_users = $counts.vip_users,
+            promoters = $counts.promoters,
+            reconciled_at = $now
+        RETURN NONE;
+        UPDATE type::thing('system_daily', $day) SET
+            day = $day,
+            new_users = $today.new_users,
+            active_users = $today.active_users
+        RETURN NONE;
+        RETURN $counts;
+        """,
+        {
+            'free_levels': FREE_LEVELS,
+            'promoter': UserRole.promoter.value,
+            'day': day,
+            'now': now.isoformat(),
+        },
+    )
+    counts = (results[-1] if results else None) or {}
+    logger.info(f"统计计数已重算: {counts}")
+    invalidate_dashboard_snapshot()
+    return counts
+
+
+def _load_snapshot(now: datetime) -> Dict:
+    since = _today(now - timedelta(days=CONVERSION_WINDOW_DAYS - 1))
+    results = execute(
+        """
+        SELECT * FROM system_counter:users;
+        SELECT * FROM type::thing('system_daily', $day);
+        SELECT math::sum(new_users ?? 0) AS new_users, math::sum(vip_conversions ?? 0) AS vip_conversions
+            FROM system_daily WHERE day >= $since GROUP ALL;
+        """,
+        {'day': _today(now), 'since': since},
+    )
+    counters = ((results[0] if results else None) or [{}])[0]
+    today = ((results[1] if len(results) > 1 else None) or [{}])[0]
+    window = ((results[2] if len(results) > 2 else None) or [{}])[0]
+
+    window_new_users = window.get('new_users') or 0
+    conversion_rate = (window.get('vip_conversions') or 0) / window_new_users if window_new_users else 0.0
+
+    return {
+        'total_users': counters.get('total_users') or 0,
+        'vip_users': counters.get('vip_users') or 0,
+        'promoters': counters.get('promoters') or 0,
+        'new_users_today': today.get('new_users') or 0,
+        'active_users_today': today.get('active_users') or 0,
+        'vip_conversions_today': today.get('vip_conversions') or 0,
+        'conversion_rate': round(conversion_rate, 4),
+        'reconciled_at': counters.get('reconciled_at'),
+        'generated_at': now.isoformat(),
+    }
+
+
+def get_dashboard_snapshot(max_age: float = DASHBOARD_CACHE_TTL) -> Dict:
+    """返回仪表盘统计快照，缓存时间内直接返回进程内的副本"""
+    global _snapshot, _snapshot_at
+
+    if _snapshot is not None and time.monotonic() - _snapshot_at < max_age:
+        return _snapshot
+
+    with _snapshot_lock:
+        # 其他线程可能已经刷新过
+        if _snapshot is not None and time.monotonic() - _snapshot_at < max_age:
+            return _snapshot
+        _snapshot = _load_snapshot(datetime.utcnow())
+        _snapshot_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate_dashboard_snapshot() -> None:
+    global _snapshot
+    _snapshot = None
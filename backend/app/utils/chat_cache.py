@@ -0,0 +1,190 @@
+"""
+聊天列表和聊天归属缓存
+侧边栏轮询直接读取进程内缓存的聊天列表，新消息、重命名、置顶、归档和删除时同步写入缓存；
+聊天归属（聊天ID -> 用户ID）也缓存起来，追加消息时不再查询聊天记录来校验权限。
+多进程部署时其他进程的修改在缓存过期后可见；因此归属缓存只用于快速拒绝，
+追加消息时仍在写入事务中重新检查聊天是否已被删除（见 chat_history_routes.add_chat_message）。
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import os
+import threading
+import time
+
+from app.db import execute
+from app.utils import metrics
+
+# 聊天列表可以通过 ?fields= 选择的返回字段
+CHAT_LIST_FIELDS = ('id', 'title', 'last_message_at', 'last_message_preview', 'created_at',
+                    'model_used', 'is_pinned', 'is_archived')
+
+# 每个用户缓存的聊天数上限，超过时只缓存排在最前的部分
+CHAT_LIST_CACHE_SIZE = 200
+
+# 缓存时间（秒）和缓存的最大用户数
+CHAT_LIST_CACHE_TTL = float(os.getenv('CHAT_LIST_CACHE_TTL', 60))
+CHAT_LIST_CACHE_MAX_USERS = int(os.getenv('CHAT_LIST_CACHE_MAX_USERS', 10000))
+
+# 聊天归属不会改变，缓存时间只用来让其他进程的删除最终可见
+CHAT_OWNER_CACHE_TTL = float(os.getenv('CHAT_OWNER_CACHE_TTL', 300))
+CHAT_OWNER_CACHE_MAX_SIZE = int(os.getenv('CHAT_OWNER_CACHE_MAX_SIZE', 100000))
+
+LOAD_CHAT_LIST_QUERY = f"""
+SELECT {', '.join(CHAT_LIST_FIELDS)} FROM chat
+WHERE user_id = $user_id AND is_archived = false AND deleted_at = NONE
+ORDER BY is_pinned DESC, last_message_at DESC, id DESC
+LIMIT $limit
+"""
+
+
+def chat_key(chat_id) -> str:
+    """从 chat:xxx 形式的记录ID中取出键"""
+    chat_id = str(chat_id)
+    return chat_id.split(':', 1)[1] if ':' in chat_id else chat_id
+
+
+def _sort_key(chat: Dict):
+    return (bool(chat.get('is_pinned')), str(chat.get('last_message_at') or ''), chat_key(chat.get('id')))
+
+
+class _UserChats:
+    __slots__ = ('chats', 'complete', 'expires_at')
+
+    def __init__(self, chats: Dict[str, Dict], complete: bool, expires_at: float):
+        self.chats = chats
+        self.complete = complete  # 是否包含了该用户的全部未归档聊天
+        self.expires_at = expires_at
+
+
+class ChatListCache:
+    """用户ID -> 未归档聊天列表（按置顶和最后消息时间排序）的进程内缓存"""
+
+    def __init__(self, ttl: float = CHAT_LIST_CACHE_TTL, max_users: int = CHAT_LIST_CACHE_MAX_USERS,
+                 size: int = CHAT_LIST_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.size = size
+        self._entries: "OrderedDict[str, _UserChats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: str) -> _UserChats:
+        results = execute(LOAD_CHAT_LIST_QUERY, {'user_id': user_id, 'limit': self.size + 1})
+        rows = (results[-1] if results else []) or []
+        entry = _UserChats(
+            {chat_key(row.get('id')): row for row in rows[:self.size]},
+            len(rows) <= self.size,
+            time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _get_entry(self, user_id: str) -> Optional[_UserChats]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry
+
+    def first_page(self, user_id: str, limit: int) -> Optional[Tuple[List[Dict], bool]]:
+        """返回第一页聊天和是否还有下一页；缓存无法覆盖这一页时返回None"""
+        entry = self._get_entry(user_id)
+        if entry is None:
+            metrics.incr('chat_list_cache.misses')
+            entry = self._load(user_id)
+        else:
+            metrics.incr('chat_list_cache.hits')
+
+        with self._lock:
+            chats = sorted(entry.chats.values(), key=_sort_key, reverse=True)
+        if not entry.complete and limit > len(chats):
+            return None
+        return chats[:limit], len(chats) > limit or not entry.complete
+
+    def upsert(self, user_id: str, chat: Dict) -> None:
+        """新建或修改了聊天（重命名、置顶、取消归档）"""
+        key = chat_key(chat.get('id'))
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if chat.get('is_archived') or chat.get('deleted_at'):
+                entry.chats.pop(key, None)
+            elif entry.complete or (key in entry.chats and chat.get('is_pinned') == entry.chats[key].get('is_pinned')):
+                entry.chats[key] = {field: chat.get(field) for field in CHAT_LIST_FIELDS}
+            else:
+                # 只缓存了部分聊天时，无法确定这条聊天在列表中的位置
+                self._entries.pop(user_id, None)
+
+    def touch(self, user_id: str, chat_id, last_message_at, preview: str) -> None:
+        """聊天中加入了新消息：更新最后消息时间和预览，聊天会排到同组的最前面"""
+        key = chat_key(chat_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            chat = entry.chats.get(key)
+            if chat is None:
+                if not entry.complete:
+                    self._entries.pop(user_id, None)
+                return
+            entry.chats[key] = {**chat, 'last_message_at': last_message_at, 'last_message_preview': preview}
+
+    def remove(self, user_id: str, chat_id) -> None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry.chats.pop(chat_key(chat_id), None)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+class ChatOwnerCache:
+    """聊天ID -> 所属用户ID 的进程内缓存"""
+
+    def __init__(self, ttl: float = CHAT_OWNER_CACHE_TTL, max_size: int = CHAT_OWNER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_owner(self, chat_id) -> Optional[str]:
+        """返回聊天所属的用户ID，聊天不存在或已删除时返回None"""
+        key = chat_key(chat_id)
+        entry = self._entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            metrics.incr('chat_owner_cache.hits')
+            return entry[0]
+
+        metrics.incr('chat_owner_cache.misses')
+        chat = self._load(key)
+        owner = chat.get('user_id') if chat and not chat.get('deleted_at') else None
+        self.set_owner(key, owner)
+        return owner
+
+    @staticmethod
+    def _load(key: str) -> Optional[Dict]:
+        results = execute("SELECT user_id, deleted_at FROM type::thing('chat', $key)", {'key': key})
+        rows = (results[-1] if results else []) or []
+        return rows[0] if rows else None
+
+    def set_owner(self, chat_id, user_id: Optional[str]) -> None:
+        key = chat_key(chat_id)
+        with self._lock:
+            self._entries[key] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, chat_id) -> None:
+        with self._lock:
+            self._entries.pop(chat_key(chat_id), None)
+
+
+chat_list_cache = ChatListCache()
+chat_owner_cache = ChatOwnerCache()
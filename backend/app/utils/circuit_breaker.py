@@ -0,0 +1,178 @@
+"""
+熔断器
+包在数据库、LLM上游和外部工具接口外面，统计最近一段时间的调用失败率：
+- 关闭（closed）：正常调用，失败率超过阈值时打开
+- 打开（open）：直接抛出 CircuitOpen，不再访问下游，故障期间请求在微秒级返回而不是堆积在重试上
+- 半开（half_open）：打开期满后放行一个探测请求，成功则关闭，失败则重新打开且打开时间加倍
+退避只记录下次允许探测的时间，不会让任何线程睡眠，也不会在持有锁时等待。
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Tuple, Type, Union
+import os
+import random
+import threading
+import time
+
+from app.utils import metrics
+
+# 统计失败率的时间窗口（秒）和窗口内最少的调用数
+CIRCUIT_WINDOW = float(os.getenv('CIRCUIT_WINDOW', 30))
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', 5))
+
+# 失败率达到这个值时打开
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', 0.5))
+
+# 第一次打开的时间（秒），之后每次探测失败加倍，不超过上限
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', 5))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv('CIRCUIT_MAX_OPEN_SECONDS', 60))
+
+MAX_SAMPLES = 200
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 指标中的状态值
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"服务暂时不可用（{name}），请 {self.retry_after} 秒后重试")
+
+
+class CircuitBreaker:
+    """一个下游依赖的熔断器"""
+
+    def __init__(self, name: str, window: float = CIRCUIT_WINDOW, min_calls: int = CIRCUIT_MIN_CALLS,
+                 error_rate: float = CIRCUIT_ERROR_RATE, open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 max_open_seconds: float = CIRCUIT_MAX_OPEN_SECONDS):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self._samples: Deque[Tuple[float, bool]] = deque(maxlen=MAX_SAMPLES)  # (时间, 是否成功)
+        self._open_until = 0.0
+        self._open_count = 0  # 连续打开的次数，决定下次打开多久
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+        metrics.set_gauge(f'circuit.{name}.state', lambda: _STATE_VALUES[self.state])
+
+    def allow(self) -> None:
+        """调用下游之前检查，打开状态时抛出 CircuitOpen"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now >= self._open_until:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                # 同一时间只放行一个探测请求；探测迟迟没有结果时（如调用方没有记录）允许再探测一次
+                if self._probe_started is None or now - self._probe_started >= self._current_open_seconds():
+                    self._probe_started = now
+                    return
+            retry_after = max(self._open_until - now, 0.0)
+        metrics.incr(f'circuit.{self.name}.rejected')
+        raise CircuitOpen(self.name, retry_after)
+
+    def record(self, ok: bool) -> None:
+        """记录一次调用的结果"""
+        if not ok:
+            metrics.incr(f'circuit.{self.name}.failures')
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probe_started = None
+                if ok:
+                    self._open_count = 0
+                    self._samples.clear()
+                    self.state = CLOSED
+                else:
+                    self._trip(now)
+                return
+            if self.state == OPEN:
+                # 打开之前已经发出的调用，结果不再影响状态
+                return
+
+            self._samples.append((now, ok))
+            cutoff = now - self.window
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            if not ok:
+                failures = sum(1 for _time, success in self._samples if not success)
+                if len(self._samples) >= self.min_calls and failures / len(self._samples) >= self.error_rate:
+                    self._trip(now)
+
+    @contextmanager
+    def guard(self, failures: Union[Type[BaseException], Tuple[Type[BaseException], ...]] = Exception):
+        """检查熔断器后执行代码块：抛出 failures 中的异常记为失败，正常结束记为成功
+
+        其他异常（如参数错误、排队超时、调用被取消）说明不了下游是否健康，不计入统计。
+        """
+        self.allow()
+        try:
+            yield
+        except failures:
+            self.record(False)
+            raise
+        except BaseException:
+            with self._lock:
+                self._probe_started = None
+            raise
+        self.record(True)
+
+    def _current_open_seconds(self) -> float:
+        return min(self.open_seconds * 2 ** max(self._open_count - 1, 0), self.max_open_seconds)
+
+    def _trip(self, now: float) -> None:
+        """打开熔断器（调用方持有锁）"""
+        self._open_count += 1
+        # 加一点抖动，避免多个进程在同一时刻一起探测
+        self._open_until = now + self._current_open_seconds() * random.uniform(1.0, 1.2)
+        self._samples.clear()
+        self.state = OPEN
+        metrics.incr(f'circuit.{self.name}.opened')
+
+    def stats(self) -> Dict[str, Union[str, float]]:
+        with self._lock:
+            samples = list(self._samples)
+            state = self.state
+            retry_after = max(self._open_until - time.monotonic(), 0.0) if state == OPEN else 0.0
+        failures = sum(1 for _time, ok in samples if not ok)
+        return {
+            'state': state,
+            'calls': len(samples),
+            'error_rate': round(failures / len(samples), 3) if samples else 0.0,
+            'retry_after': round(retry_after, 1),
+        }
+
+
+# 名称 -> 熔断器，同一个下游在进程内共用一个熔断器
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **config) -> CircuitBreaker:
+    """获取（或创建）指定名称的熔断器，config 只在第一次创建时生效"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **config)
+        return breaker
+
+
+def all_breaker_stats() -> Dict[str, Dict[str, Union[str, float]]]:
+    """所有熔断器的状态"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.stats() for name, breaker in breakers.items()}
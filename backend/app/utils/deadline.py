@@ -0,0 +1,84 @@
+"""
+请求截止时间
+每个请求开始时设置一个截止时间（见 app/middleware/deadline.py），保存在上下文变量中；
+数据库、LLM、工具和远程下载都按剩余时间缩短自己的超时，时间用完时直接失败，不再占着worker等待。
+没有设置截止时间时（如后台任务）各处使用原来的超时。
+"""
+
+from contextvars import ContextVar
+from typing import Optional
+import time
+
+from app.utils import metrics
+from app.utils.circuit_breaker import CircuitOpen
+
+
+class DeadlineExceeded(Exception):
+    """请求的处理时间已经用完"""
+
+    def __init__(self, operation: str = ''):
+        self.operation = operation
+        super().__init__(f"请求处理超时{f'（{operation}）' if operation else ''}，请稍后重试")
+
+
+# 由应用统一处理的错误（超时返回504、熔断返回503并带 Retry-After，见 app/__init__.py），
+# 路由里兜底的 except Exception 之前要先原样抛出，不能变成普通的500
+PASSTHROUGH_ERRORS = (DeadlineExceeded, CircuitOpen)
+
+
+class Deadline:
+    """一个截止时间（基于 time.monotonic）"""
+
+    __slots__ = ('expires_at',)
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar('deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def set_deadline(seconds: Optional[float]):
+    """设置当前上下文的截止时间，返回用于恢复的令牌"""
+    return _current.set(Deadline(seconds) if seconds else None)
+
+
+def reset_deadline(token) -> None:
+    _current.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """剩余时间（秒），没有截止时间时返回None"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def time_left(default: Optional[float], operation: str = '') -> Optional[float]:
+    """某个操作可以使用的超时：不超过default，也不超过请求的剩余时间
+
+    时间已经用完时抛出 DeadlineExceeded。
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        metrics.incr('deadline.exceeded')
+        raise DeadlineExceeded(operation)
+    return left if default is None else min(default, left)
+
+
+def has_time(seconds: float) -> bool:
+    """剩余时间是否还够做一件至少需要seconds秒的事"""
+    left = remaining()
+    return left is None or left >= seconds
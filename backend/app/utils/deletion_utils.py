@@ -0,0 +1,223 @@
+"""
+软删除和后台级联清理
+删除请求只给记录打上 deleted_at 标记并登记一个删除任务，接口立即返回，查询时跳过带标记的记录；
+后台任务按删除计划分批删除关联数据，每批之间暂停，进度写在任务记录中，进程崩溃后从记录的步骤继续。
+对话、会话和账号删除共用同一套流程。
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import os
+import time
+
+from app.db import execute
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# 每批删除的关联记录数、批次之间的暂停时间（秒）
+DELETION_BATCH_SIZE = int(os.getenv('DELETION_BATCH_SIZE', 500))
+DELETION_BATCH_PAUSE = float(os.getenv('DELETION_BATCH_PAUSE', 0.2))
+
+# 每次运行最多占用的时间（秒），应小于调度间隔
+DELETION_RUN_BUDGET = float(os.getenv('DELETION_RUN_BUDGET', 45))
+
+# 每次运行最多处理的任务数
+DELETION_JOBS_PER_RUN = 50
+
+# 已完成的任务保留天数，用于查看进度
+DELETION_JOB_RETENTION_DAYS = 7
+
+# 删除计划：类型 -> (主表, [(关联表, 关联字段, 关联值, 子任务类型)])
+# 关联值为 'id' 时用完整记录ID（如 chat:xxx）匹配，为 'key' 时只用键匹配；
+# 子任务类型不为空时，匹配到的记录各自登记一个删除任务，而不是直接删除
+DELETION_PLANS = {
+    'chat': ('chat', [
+        ('message', 'chat_id', 'id', None),
+    ]),
+    'conversation': ('conversations', []),
+    'user': ('users', [
+        ('chat', 'user_id', 'id', 'chat'),
+        ('conversations', 'user_id', 'id', None),
+        ('quota_counter', 'user', 'key', None),
+    ]),
+}
+
+# 任务记录ID由类型和目标记录的键组成
+JOB_RECORD = "type::thing('deletion_job', [$kind, $key])"
+
+
+def _job_params(job: Dict, **params) -> Dict:
+    return {'kind': job['kind'], 'key': job['target'], **params}
+
+
+def _record_key(record_id: str) -> str:
+    """从 table:xxx 形式的记录ID中取出键"""
+    return record_id.split(':', 1)[1] if ':' in record_id else record_id
+
+
+def schedule_deletions(kind: str, record_ids: Iterable[str]) -> List[str]:
+    """隐藏记录并登记删除任务，返回任务ID
+
+    任务ID由类型和记录键决定，重复删除同一条记录不会重复登记，也不会重置已有的进度。
+    """
+    return schedule_deletions_returning(kind, record_ids)[0]
+
+
+def schedule_deletions_returning(kind: str, record_ids: Iterable[str],
+                                 fields: Sequence[str] = ()) -> Tuple[List[str], List[Dict]]:
+    """与 schedule_deletions 相同，同时返回这次真正被隐藏的记录（只包含 id 和 fields 中的字段）
+
+    不存在或之前已经删除的记录不会出现在返回的记录中，调用方可以据此只为真正删除的记录更新计数。
+    """
+    table, _steps = DELETION_PLANS[kind]
+    keys = [_record_key(str(record_id)) for record_id in record_ids]
+    if not keys:
+        return [], []
+
+    returning = ', '.join(dict.fromkeys(('id',) + tuple(fields)))
+    statements = ['BEGIN TRANSACTION;']
+    params = {'kind': kind, 'table': table}
+    for index, key in enumerate(keys):
+        params[f'key{index}'] = key
+        # 先按ID查出未删除的记录再更新：直接 UPDATE 一个不存在的记录ID会创建这条记录
+        statements.append(f"""
+        LET $ids{index} = (SELECT VALUE id FROM type::thing($table, $key{index}) WHERE deleted_at = NONE);
+        LET $hidden{index} = (UPDATE $ids{index} SET deleted_at = time::now() RETURN {returning});
+        UPDATE type::thing('deletion_job', [$kind, $key{index}]) SET
+            kind = $kind,
+            target = $key{index},
+            status = status ?? 'pending',
+            step = step ?? 0,
+            deleted = deleted ?? 0,
+            created_at = created_at ?? time::now(),
+            updated_at = time::now()
+        RETURN NONE;""")
+    statements.append(f"RETURN array::flatten([{', '.join(f'$hidden{index}' for index in range(len(keys)))}]);")
+    statements.append('COMMIT TRANSACTION;')
+
+    results = execute('\n'.join(statements), params)
+    hidden = (results[-1] if results else []) or []
+    metrics.incr(f'deletion.{kind}.scheduled', len(keys))
+    return [f'{kind}:{key}' for key in keys], hidden
+
+
+def schedule_deletion(kind: str, record_id: str) -> str:
+    """隐藏一条记录并登记删除任务"""
+    return schedule_deletions(kind, [record_id])[0]
+
+
+def _run_step(job: Dict, table: str, step, limit: int) -> int:
+    """执行一批删除计划中的一步，返回处理的记录数"""
+    child_table, field, ref, child_kind = step
+    ref_value = job['target'] if ref == 'key' else f"{table}:{job['target']}"
+
+    if child_kind:
+        # 子记录有自己的删除计划：隐藏后交给各自的删除任务
+        results = execute(
+            f"SELECT VALUE id FROM {child_table} WHERE {field} = $ref AND deleted_at = NONE LIMIT $limit",
+            {'ref': ref_value, 'limit': limit},
+        )
+        ids = (results[-1] if results else []) or []
+        if ids:
+            schedule_deletions(child_kind, ids)
+        return len(ids)
+
+    results = execute(
+        f"""
+        BEGIN TRANSACTION;
+        LET $ids = (SELECT VALUE id FROM {child_table} WHERE {field} = $ref LIMIT $limit);
+        DELETE $ids;
+        UPDATE {JOB_RECORD} SET deleted += array::len($ids), updated_at = time::now() RETURN NONE;
+        RETURN array::len($ids);
+        COMMIT TRANSACTION;
+        """,
+        _job_params(job, ref=ref_value, limit=limit),
+    )
+    return (results[-1] if results else 0) or 0
+
+
+def _finish_job(job: Dict, table: str) -> None:
+    execute(
+        f"""
+        BEGIN TRANSACTION;
+        DELETE type::thing($table, $key);
+        UPDATE {JOB_RECORD} SET status = 'done', deleted += 1, finished_at = time::now(), updated_at = time::now()
+        RETURN NONE;
+        COMMIT TRANSACTION;
+        """,
+        _job_params(job, table=table),
+    )
+
+
+def process_deletion_job(job: Dict, deadline: float, batch_size: int = DELETION_BATCH_SIZE,
+                         pause: float = DELETION_BATCH_PAUSE) -> bool:
+    """按删除计划处理一个任务直到完成或超出时间，返回任务是否已完成"""
+    table, steps = DELETION_PLANS[job['kind']]
+    step_index = job.get('step') or 0
+
+    if job.get('status') != 'running':
+        execute(f"UPDATE {JOB_RECORD} SET status = 'running', updated_at = time::now() RETURN NONE",
+                _job_params(job))
+
+    while step_index < len(steps):
+        if time.monotonic() >= deadline:
+            return False
+
+        count = _run_step(job, table, steps[step_index], batch_size)
+        metrics.incr(f'deletion.{job["kind"]}.purged', count)
+
+        if count < batch_size:
+            # 这一步已经没有剩余记录，记录进度后进入下一步
+            step_index += 1
+            execute(f"UPDATE {JOB_RECORD} SET step = $step, updated_at = time::now() RETURN NONE",
+                    _job_params(job, step=step_index))
+        time.sleep(pause)
+
+    _finish_job(job, table)
+    metrics.incr(f'deletion.{job["kind"]}.completed')
+    return True
+
+
+def run_deletion_jobs(budget: float = DELETION_RUN_BUDGET, limit: int = DELETION_JOBS_PER_RUN) -> Dict[str, int]:
+    """处理未完成的删除任务（由定时任务调用），返回本次完成和仍在进行的任务数"""
+    deadline = time.monotonic() + budget
+    results = execute(
+        """
+        SELECT * FROM deletion_job WHERE status != 'done' ORDER BY created_at LIMIT $limit;
+        DELETE deletion_job WHERE status = 'done' AND finished_at < time::now() - duration::from::days($retention);
+        """,
+        {'limit': limit, 'retention': DELETION_JOB_RETENTION_DAYS},
+    )
+    jobs = (results[0] if results else []) or []
+
+    completed = 0
+    for job in jobs:
+        if time.monotonic() >= deadline:
+            break
+        try:
+            if process_deletion_job(job, deadline):
+                completed += 1
+        except Exception as e:
+            # 任务保持未完成状态，下次运行从记录的步骤继续
+            metrics.incr('deletion.errors')
+            logger.error(f"删除任务 {job.get('id')} 执行失败: {str(e)}")
+            try:
+                execute(f"UPDATE {JOB_RECORD} SET last_error = $error, updated_at = time::now() RETURN NONE",
+                        _job_params(job, error=str(e)[:500]))
+            except Exception:
+                pass
+
+    if jobs:
+        logger.info(f"删除任务：完成 {completed} 个，剩余 {len(jobs) - completed} 个")
+    return {'completed': completed, 'pending': len(jobs) - completed}
+
+
+def get_deletion_jobs(status: Optional[str] = None, limit: int = 100) -> List[Dict]:
+    """查看删除任务及其进度"""
+    where = "WHERE status = $status" if status else ""
+    results = execute(
+        f"SELECT * FROM deletion_job {where} ORDER BY created_at DESC LIMIT $limit",
+        {'status': status, 'limit': limit},
+    )
+    return (results[-1] if results else []) or []
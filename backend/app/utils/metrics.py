@@ -0,0 +1,33 @@
+"""
+进程内运行指标
+计数器和瞬时值都保存在当前进程中，供日志和监控接口读取
+"""
+
+from typing import Callable, Dict, Union
+import threading
+
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, Union[float, Callable[[], float]]] = {}
+_lock = threading.Lock()
+
+
+def incr(name: str, value: float = 1) -> None:
+    """累加计数器"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: Union[float, Callable[[], float]]) -> None:
+    """设置瞬时值，也可以传入函数，在读取时再计算（如队列长度）"""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> Dict[str, float]:
+    """返回当前所有指标的快照"""
+    with _lock:
+        data = dict(_counters)
+        gauges = dict(_gauges)
+    for name, value in gauges.items():
+        data[name] = value() if callable(value) else value
+    return data
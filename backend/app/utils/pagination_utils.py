@@ -0,0 +1,200 @@
+"""
+列表接口的分页和流式输出
+使用游标（键集）分页，按需裁剪返回字段，并用生成器逐块输出JSON数组或CSV，
+整个列表不会一次性构建在内存中。
+"""
+
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence
+import base64
+import csv
+import io
+import json
+
+from flask import Response, request, stream_with_context
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 流式输出时每块包含的行数
+STREAM_CHUNK_SIZE = 100
+
+# 导出时每次从数据库取出的行数
+EXPORT_FETCH_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """客户端传来的游标无法解析"""
+
+
+def encode_cursor(values: Dict) -> str:
+    """把最后一行的排序键编码为不透明的游标字符串"""
+    raw = json.dumps(values, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Dict]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+    if not isinstance(values, dict):
+        raise InvalidCursor('cursor must encode an object')
+    return values
+
+
+def get_page_args(default_size: int = DEFAULT_PAGE_SIZE, max_size: int = MAX_PAGE_SIZE):
+    """从请求参数中读取 (limit, 游标)"""
+    try:
+        limit = int(request.args.get('limit', default_size))
+    except ValueError:
+        limit = default_size
+    limit = max(1, min(limit, max_size))
+    return limit, decode_cursor(request.args.get('cursor'))
+
+
+def get_fields(allowed: Sequence[str], default: Optional[Sequence[str]] = None):
+    """读取 ?fields=a,b 指定的返回字段，只保留允许的字段"""
+    requested = request.args.get('fields')
+    if not requested:
+        return tuple(default or allowed)
+    fields = tuple(field for field in requested.split(',') if field in allowed)
+    return fields or tuple(default or allowed)
+
+
+def wants_csv() -> bool:
+    return request.args.get('format') == 'csv'
+
+
+def paginate_query(query, id_column, cursor: Optional[Dict], limit: int, order_column=None):
+    """对SQLAlchemy查询做降序键集分页，返回逐行产出的迭代器和一个获取下一页游标的函数
+
+    排序键为 (order_column, id_column)；没有 order_column 时只按ID排序。
+    多取一行用于判断是否还有下一页。
+    """
+    if cursor is not None:
+        last_id = cursor.get('id')
+        if order_column is not None:
+            last_key = _parse_cursor_value(order_column, cursor.get('k'))
+            query = query.filter(
+                (order_column < last_key) | ((order_column == last_key) & (id_column < last_id)))
+        else:
+            query = query.filter(id_column < last_id)
+
+    ordering = [order_column.desc(), id_column.desc()] if order_column is not None else [id_column.desc()]
+    query = query.order_by(*ordering).limit(limit + 1)
+
+    state = {'next': None}
+    order_name = order_column.key if order_column is not None else None
+
+    def rows():
+        last = None
+        for count, row in enumerate(query.yield_per(STREAM_CHUNK_SIZE)):
+            if count == limit:
+                state['next'] = _cursor_for(last, id_column.key, order_name)
+                break
+            last = row
+            yield row
+
+    return rows(), lambda: state['next']
+
+
+def _cursor_for(row, id_name: str, order_name: Optional[str]) -> str:
+    values = {'id': getattr(row, id_name)}
+    if order_name:
+        values['k'] = getattr(row, order_name)
+    return encode_cursor(values)
+
+
+def _parse_cursor_value(column, value):
+    try:
+        python_type = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return value
+    if python_type is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'value'):  # 枚举
+        return value.value
+    return str(value)
+
+
+def iter_json_array(items: Iterable, serialize: Callable = lambda item: item,
+                    chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """逐块输出JSON数组的元素部分（不含方括号）"""
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(json.dumps(serialize(item), default=_json_default, ensure_ascii=False))
+        if len(chunk) >= chunk_size:
+            yield ('' if first else ',') + ','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+
+
+def stream_json_list(key: str, items: Iterable, serialize: Callable = lambda item: item,
+                     next_cursor: Callable[[], Optional[str]] = lambda: None,
+                     extra: Optional[Dict] = None, status: int = 200) -> Response:
+    """以 {"success": true, key: [...], "next_cursor": ...} 的形式流式输出列表
+
+    next_cursor 在数组输出完之后才调用，因此可以由逐行迭代的过程决定。
+    """
+    def generate():
+        head = {'success': True, **(extra or {})}
+        yield json.dumps(head, default=_json_default, ensure_ascii=False)[:-1]
+        yield f', {json.dumps(key)}: ['
+        yield from iter_json_array(items, serialize)
+        yield f'], "next_cursor": {json.dumps(next_cursor())}}}'
+
+    return Response(stream_with_context(generate()), status=status, mimetype='application/json')
+
+
+def stream_csv(filename: str, fields: Sequence[str], rows: Iterable[Dict],
+               chunk_size: int = STREAM_CHUNK_SIZE) -> Response:
+    """把字典行流式输出为CSV附件"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(fields), extrasaction='ignore')
+        # 带BOM，Excel打开中文不乱码
+        buffer.write('\ufeff')
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow({field: _csv_value(value) for field, value in row.items()})
+            if count % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _csv_value(value):
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default, ensure_ascii=False)
+    return _json_default(value)
+
+
+def iter_export(query, serialize: Callable, fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator[Dict]:
+    """按批从数据库取出全部行并逐行序列化，用于导出"""
+    for row in query.yield_per(fetch_size):
+        yield serialize(row)
+
+
+def select_fields(data: Dict, fields: Sequence[str]) -> Dict:
+    """只保留指定字段"""
+    return {field: data.get(field) for field in fields}
@@ -0,0 +1,400 @@
+"""
+推广链接点击采集和推广统计汇总
+重定向时只查进程内的推广码缓存并把点击事件放进内存队列，
+后台线程每隔几秒把队列中的点击批量写入点击记录表，并按链接汇总后一次性累加点击数。
+点击、注册、转化和佣金同时累加到按天和按月的汇总表，统计接口只读取汇总行。
+
+推广数据保存在SurrealDB中（表见 app/models/promotion_schema.py），
+每次记录的明细、链接计数和汇总累加在同一个事务里完成。
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from app.db import execute
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# 推广码缓存时间（秒），不存在的推广码缓存时间更短
+LINK_CACHE_TTL = 300
+LINK_CACHE_MISS_TTL = 30
+
+# 点击队列的容量、刷写间隔（秒）和每批最多写入的点击数
+CLICK_QUEUE_MAXSIZE = int(os.getenv('CLICK_QUEUE_MAXSIZE', 100000))
+CLICK_FLUSH_INTERVAL = float(os.getenv('CLICK_FLUSH_INTERVAL', 2))
+CLICK_FLUSH_BATCH_SIZE = 5000
+
+# 一批点击最多写入的次数，数据库持续拒绝时丢弃这批点击，不再无限重新入队
+CLICK_FLUSH_MAX_ATTEMPTS = int(os.getenv('CLICK_FLUSH_MAX_ATTEMPTS', 5))
+
+# 事务冲突时的重试次数（点击刷写和注册、转化会同时累加同一汇总行）
+MAX_CONFLICT_RETRIES = 3
+
+# 点击记录表中的字段
+CLICK_RECORD_FIELDS = ('link_id', 'ip_address', 'user_agent', 'referer', 'timestamp')
+
+# 汇总表中累加的统计字段
+ROLLUP_FIELDS = ('clicks', 'registrations', 'conversions', 'commission_amount')
+
+# 汇总周期 -> (汇总表, 周期的格式)，汇总行的记录ID为 [推广用户ID, 周期]
+ROLLUP_PERIODS = {
+    'day': ('promoter_stats_daily', '%Y-%m-%d'),
+    'month': ('promoter_stats_monthly', '%Y-%m'),
+}
+
+# 查找有效的推广码
+LINK_BY_CODE_QUERY = "SELECT id, user_id FROM promoter_link WHERE code = $code AND is_active = true LIMIT 1"
+
+# 被推广用户最早的注册转化
+REGISTRATION_QUERY = """
+SELECT link_id, promoter_id, timestamp FROM promoter_conversion
+WHERE user_id = $user_id AND conversion_type = 'registration'
+ORDER BY timestamp LIMIT 1
+"""
+
+
+def _record_key(record_id: str) -> str:
+    """从 table:xxx 形式的记录ID中取出键"""
+    return record_id.split(':', 1)[1] if ':' in record_id else record_id
+
+
+def _rollup_statements(deltas: Dict[Tuple[str, object], Dict[str, int]]) -> Tuple[List[str], Dict]:
+    """把 {(推广用户ID, 日期): {字段: 增量}} 转成累加日汇总和月汇总行的语句及其参数
+
+    同一天或同一月的增量先在内存中合并，每个汇总行只有一条 UPDATE；
+    汇总行不存在时 UPDATE 会创建它，+= 作用在不存在的字段上等于直接赋值。
+    """
+    rows = defaultdict(Counter)
+    for (user_id, day), values in deltas.items():
+        for period, (_table, fmt) in ROLLUP_PERIODS.items():
+            rows[(period, user_id, day.strftime(fmt))].update(values)
+
+    statements, params = [], {}
+    for i, ((period, user_id, value), counts) in enumerate(rows.items()):
+        name = f'rollup{i}'
+        params[name] = {'key': [user_id, value], 'user_id': user_id, 'period': value,
+                        **{field: counts.get(field, 0) for field in ROLLUP_FIELDS}}
+        increments = ', '.join(f'{field} += ${name}.{field}' for field in ROLLUP_FIELDS)
+        statements.append(
+            f"UPDATE type::thing('{ROLLUP_PERIODS[period][0]}', ${name}.key) SET "
+            f"user_id = ${name}.user_id, {period} = ${name}.period, {increments} RETURN NONE;")
+    return statements, params
+
+
+def _execute_transaction(statements: List[str], params: Dict):
+    """在一个事务中执行语句，写冲突时整体重试"""
+    sql = '\n'.join(['BEGIN TRANSACTION;', *statements, 'COMMIT TRANSACTION;'])
+    for attempt in range(MAX_CONFLICT_RETRIES):
+        try:
+            return execute(sql, params)
+        except RuntimeError as e:
+            if attempt == MAX_CONFLICT_RETRIES - 1:
+                raise
+            logger.info(f"推广数据事务冲突，重试: {str(e)}")
+
+
+def add_to_rollups(deltas: Dict[Tuple[str, object], Dict[str, int]]) -> None:
+    """把 {(推广用户ID, 日期): {字段: 增量}} 累加到日汇总和月汇总表"""
+    statements, params = _rollup_statements(deltas)
+    if statements:
+        _execute_transaction(statements, params)
+
+
+def _click_statements(events: List[Dict]) -> Tuple[List[str], Dict]:
+    """一批点击的写入语句：插入点击记录、按链接累加点击数、按推广用户和日期累加汇总"""
+    statements = ["INSERT INTO promoter_click $clicks RETURN NONE;"]
+    params = {'clicks': [
+        {**{field: event[field] for field in CLICK_RECORD_FIELDS}, 'timestamp': event['timestamp'].isoformat()}
+        for event in events
+    ]}
+    for i, (link_id, count) in enumerate(Counter(event['link_id'] for event in events).items()):
+        statements.append(f"UPDATE type::thing('promoter_link', $link{i}.key) SET clicks += $link{i}.count RETURN NONE;")
+        params[f'link{i}'] = {'key': _record_key(link_id), 'count': count}
+
+    rollups, rollup_params = _rollup_statements({
+        key: {'clicks': count}
+        for key, count in Counter((event['promoter_id'], event['timestamp'].date()) for event in events).items()
+    })
+    return statements + rollups, {**params, **rollup_params}
+
+
+def get_rollups(user_id: str, period: str = 'month', start: Optional[str] = None,
+                end: Optional[str] = None) -> List[Dict]:
+    """按周期升序读取推广用户的汇总行，period 为 'day' 或 'month'，start/end 为包含在内的周期"""
+    table, _fmt = ROLLUP_PERIODS[period]
+    conditions = ['user_id = $user_id']
+    if start:
+        conditions.append(f'{period} >= $start')
+    if end:
+        conditions.append(f'{period} <= $end')
+    results = execute(
+        f"SELECT {period}, {', '.join(ROLLUP_FIELDS)} FROM {table} "
+        f"WHERE {' AND '.join(conditions)} ORDER BY {period}",
+        {'user_id': user_id, 'start': start, 'end': end},
+    )
+    return (results[0] if results else None) or []
+
+
+def record_registration(link_id: str, promoter_id: str, user_id: Optional[str] = None,
+                        now: Optional[datetime] = None) -> None:
+    """记录一次通过推广链接的注册
+
+    给出被推广用户时同时保存注册转化记录，用户之后付费时据此找到推广链接（见 record_vip_purchase）。
+    """
+    now = now or datetime.utcnow()
+    statements, params = _rollup_statements({(promoter_id, now.date()): {'registrations': 1}})
+    statements.insert(0, "UPDATE type::thing('promoter_link', $link_key) SET registrations += 1 RETURN NONE;")
+    params['link_key'] = _record_key(link_id)
+    if user_id is not None:
+        statements.insert(0, "CREATE promoter_conversion CONTENT $conversion RETURN NONE;")
+        params['conversion'] = {
+            'link_id': link_id,
+            'promoter_id': promoter_id,
+            'user_id': user_id,
+            'conversion_type': 'registration',
+            'amount': 0,
+            'timestamp': now.isoformat(),
+        }
+    _execute_transaction(statements, params)
+
+
+def record_conversion(link_id: str, promoter_id: str, user_id: str, amount: int = 0, commission_rate: int = 0,
+                      now: Optional[datetime] = None) -> None:
+    """记录一次通过推广链接的付费转化，commission_rate（百分比）大于0时同时按金额生成待结算佣金"""
+    now = now or datetime.utcnow()
+    commission = amount * commission_rate // 100 if commission_rate > 0 and amount > 0 else 0
+    counts = {'conversions': 1}
+    statements = [
+        "LET $created = (CREATE promoter_conversion CONTENT $conversion)[0];",
+        "UPDATE type::thing('promoter_link', $link_key) SET conversions += 1 RETURN NONE;",
+    ]
+    params = {
+        'link_key': _record_key(link_id),
+        'conversion': {
+            'link_id': link_id,
+            'promoter_id': promoter_id,
+            'user_id': user_id,
+            'conversion_type': 'vip_purchase',
+            'amount': amount,
+            'timestamp': now.isoformat(),
+        },
+    }
+    if commission:
+        counts['commission_amount'] = commission
+        statements.append(
+            "CREATE promoter_commission CONTENT {"
+            "user_id: $commission.user_id, conversion_id: $created.id, amount: $commission.amount, "
+            "rate: $commission.rate, status: 'pending', created_at: $commission.created_at"
+            "} RETURN NONE;")
+        params['commission'] = {
+            'user_id': promoter_id,
+            'amount': commission,
+            'rate': commission_rate,
+            'created_at': now.isoformat(),
+        }
+    rollups, rollup_params = _rollup_statements({(promoter_id, now.date()): counts})
+    _execute_transaction(statements + rollups, {**params, **rollup_params})
+
+
+def cancel_commission(commission_id: str) -> bool:
+    """取消佣金，并从其产生当天的汇总中扣除；佣金不存在或已经取消时返回False"""
+    results = execute(
+        "UPDATE type::thing('promoter_commission', $key) SET status = 'cancelled' "
+        "WHERE status != 'cancelled' RETURN BEFORE",
+        {'key': _record_key(commission_id)},
+    )
+    rows = (results[0] if results else None) or []
+    if not rows:
+        return False
+    commission = rows[0]
+    day = datetime.fromisoformat(commission['created_at']).date()
+    add_to_rollups({(commission['user_id'], day): {'commission_amount': -(commission.get('amount') or 0)}})
+    return True
+
+
+def record_referred_registration(code: str, user_id) -> bool:
+    """注册请求带有推广码（推广链接重定向到 /register?ref=<code>）时计入该链接的注册
+
+    推广码无效或推广数据写入失败时返回False，不影响注册本身。
+    """
+    try:
+        cached = link_cache.get(code)
+        if cached is None:
+            return False
+        record_registration(cached[0], cached[1], user_id)
+        return True
+    except Exception as e:
+        logger.error(f"记录推广注册失败 {code}: {str(e)}")
+        return False
+
+
+def record_vip_purchase(user_id, amount: int) -> bool:
+    """被推广用户购买VIP时记录付费转化，并按推广用户的佣金比例生成佣金
+
+    用户不是通过推广链接注册的时候返回False。
+    """
+    results = execute(REGISTRATION_QUERY, {'user_id': user_id})
+    registrations = (results[0] if results else None) or []
+    if not registrations:
+        return False
+    registration = registrations[0]
+    promoter_id = registration['promoter_id']
+
+    results = execute("SELECT VALUE promoter_commission_rate FROM type::thing('users', $key)",
+                      {'key': _record_key(promoter_id)})
+    rates = (results[0] if results else None) or []
+    rate = (rates[0] if rates else 0) or 0
+    record_conversion(registration['link_id'], promoter_id, user_id, amount, commission_rate=rate)
+    return True
+
+
+class PromoterLinkCache:
+    """推广码 -> (链接ID, 推广用户ID) 的进程内缓存"""
+
+    def __init__(self, ttl: float = LINK_CACHE_TTL, miss_ttl: float = LINK_CACHE_MISS_TTL):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._entries: Dict[str, Tuple[Optional[Tuple[str, str]], float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, code: str) -> Optional[Tuple[str, str]]:
+        """返回有效推广码对应的 (链接ID, 推广用户ID)，无效或已停用时返回None"""
+        entry = self._entries.get(code)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        results = execute(LINK_BY_CODE_QUERY, {'code': code})
+        links = (results[0] if results else None) or []
+        value = (links[0]['id'], links[0]['user_id']) if links else None
+        with self._lock:
+            ttl = self.ttl if value is not None else self.miss_ttl
+            self._entries[code] = (value, time.monotonic() + ttl)
+        return value
+
+    def invalidate(self, code: str) -> None:
+        """链接停用或修改后调用，让下一次访问重新读取"""
+        with self._lock:
+            self._entries.pop(code, None)
+
+
+class ClickPipeline:
+    """点击事件队列和后台刷写线程"""
+
+    def __init__(self, maxsize: int = CLICK_QUEUE_MAXSIZE,
+                 flush_interval: float = CLICK_FLUSH_INTERVAL,
+                 batch_size: int = CLICK_FLUSH_BATCH_SIZE):
+        self.queue: "queue.Queue[dict]" = queue.Queue(maxsize=maxsize)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._app = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        metrics.set_gauge('promoter_clicks.queue_depth', self.queue.qsize)
+
+    def track(self, link_id: int, promoter_id: int, ip_address: str, user_agent: str,
+              referer: Optional[str]) -> bool:
+        """把一次点击放进队列，不等待数据库；队列已满时丢弃并返回False"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait({
+                'link_id': link_id,
+                'promoter_id': promoter_id,
+                'ip_address': ip_address,
+                'user_agent': (user_agent or '')[:255],
+                'referer': (referer or '')[:255] or None,
+                'timestamp': datetime.utcnow(),
+            })
+        except queue.Full:
+            metrics.incr('promoter_clicks.dropped')
+            return False
+        metrics.incr('promoter_clicks.enqueued')
+        return True
+
+    def flush(self) -> int:
+        """把队列中的点击写入数据库，返回写入的数量"""
+        events = []
+        while len(events) < self.batch_size:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not events:
+            return 0
+
+        started = time.monotonic()
+        try:
+            _execute_transaction(*_click_statements(events))
+        except Exception as e:
+            logger.error(f"写入推广点击失败（{len(events)} 条）: {str(e)}")
+            self._requeue(events)
+            metrics.incr('promoter_clicks.flush_errors')
+            return 0
+
+        metrics.incr('promoter_clicks.flushed', len(events))
+        metrics.set_gauge('promoter_clicks.last_flush_seconds', time.monotonic() - started)
+        return len(events)
+
+    def _requeue(self, events) -> None:
+        """失败的点击放回队列等下一次刷写，已经写了 CLICK_FLUSH_MAX_ATTEMPTS 次的丢弃"""
+        dead = 0
+        for event in events:
+            event['attempts'] = event.get('attempts', 0) + 1
+            if event['attempts'] >= CLICK_FLUSH_MAX_ATTEMPTS:
+                dead += 1
+                continue
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                metrics.incr('promoter_clicks.dropped')
+        if dead:
+            logger.error(f"推广点击写入 {CLICK_FLUSH_MAX_ATTEMPTS} 次仍然失败，丢弃 {dead} 条")
+            metrics.incr('promoter_clicks.dead_lettered', dead)
+
+    def init_app(self, app) -> None:
+        self._app = app
+
+    def _ensure_started(self) -> None:
+        # 按进程启动：预加载后fork出的worker不会继承父进程的线程
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            if self._app is None:
+                from flask import current_app
+                self._app = current_app._get_current_object()
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='promoter-click-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            self._drain()
+        self._drain()
+
+    def _drain(self) -> None:
+        with self._app.app_context():
+            while self.flush() >= self.batch_size:
+                pass
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """停止刷写线程，退出前把剩余点击写完"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+link_cache = PromoterLinkCache()
+click_pipeline = ClickPipeline()
@@ -0,0 +1,232 @@
+"""
+配额服务
+按时间窗口（天/周）给每个用户的计数器分桶，新窗口自然从0开始，不需要定时重置。
+检查和扣减在SurrealDB中一次往返完成：等级解析、读取计数、判断和递增都在同一个事务里，
+并发请求在同一计数记录上的写冲突会让其中一个事务失败并重试，不会超发。
+"""
+
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import logging
+import os
+import threading
+import time
+
+from app.db import execute
+from app.models.enums import VIPLevel
+from app.models.quota import VIP_TIER_LIMITS, QUOTA_COUNTERS, parse_vip_level
+
+logger = logging.getLogger(__name__)
+
+# 事务冲突时的重试次数
+MAX_CONFLICT_RETRIES = 3
+
+# 过期计数桶在窗口结束后保留的时间，之后由清理任务删除
+COUNTER_RETENTION = timedelta(days=1)
+
+# 用户当前等级在进程内缓存的时间（秒）：升级、到期和管理员调整最多这么久之后对限流和LLM排队生效
+VIP_LEVEL_CACHE_SECONDS = float(os.getenv('VIP_LEVEL_CACHE_SECONDS', 60))
+
+# 进程内最多缓存的用户数，超过时整体清空
+VIP_LEVEL_CACHE_SIZE = 10000
+
+# 每种配额在各等级下的限制，按等级名称和值两种写法索引，供查询中直接按用户等级取值
+QUOTA_LIMITS = {
+    kind: {
+        key: VIP_TIER_LIMITS[level][field]
+        for level in VIPLevel
+        for key in (level.name, level.value)
+    }
+    for kind, (field, _window) in QUOTA_COUNTERS.items()
+}
+
+# 单次检查并扣减配额
+CONSUME_QUOTA_QUERY = """
+BEGIN TRANSACTION;
+LET $user = (SELECT vip_level, vip_expiry FROM type::thing('users', $user_key))[0];
+LET $level = IF $user.vip_expiry != NONE AND $user.vip_expiry < $now THEN $free ELSE $user.vip_level ?? $free END;
+LET $limit = $limits[$level] ?? $limits[$free];
+LET $used = (SELECT VALUE count FROM type::thing('quota_counter', $counter_key))[0] ?? 0;
+LET $allowed = $limit < 0 OR $used + math::max([$amount, 1]) <= $limit;
+IF $allowed AND $amount > 0 THEN
+    (UPDATE type::thing('quota_counter', $counter_key) SET
+        user = $user_key, kind = $kind, bucket = $bucket,
+        count = $used + $amount, expires_at = $expires_at
+    RETURN NONE)
+END;
+RETURN {
+    allowed: $allowed,
+    used: IF $allowed THEN $used + $amount ELSE $used END,
+    limit: $limit
+};
+COMMIT TRANSACTION;
+"""
+
+# 一次读取用户所有配额的使用情况
+QUOTA_USAGE_QUERY = """
+LET $user = (SELECT vip_level, vip_expiry FROM type::thing('users', $user_key))[0];
+RETURN IF $user.vip_expiry != NONE AND $user.vip_expiry < $now THEN $free ELSE $user.vip_level ?? $free END;
+SELECT kind, bucket, count FROM quota_counter WHERE user = $user_key AND bucket IN $buckets;
+"""
+
+
+@dataclass
+class QuotaStatus:
+    """一次配额检查的结果"""
+    kind: str
+    allowed: bool
+    used: int
+    limit: int  # -1表示无限
+    resets_at: str
+
+    @property
+    def remaining(self) -> int:
+        if self.limit < 0:
+            return -1
+        return max(self.limit - self.used, 0)
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data['remaining'] = self.remaining
+        return data
+
+
+def _user_key(user_id: str) -> str:
+    """从 users:xxx 形式的记录ID中取出键"""
+    return user_id.split(':', 1)[1] if ':' in user_id else user_id
+
+
+_vip_levels: Dict[str, tuple] = {}
+_vip_levels_lock = threading.Lock()
+
+
+def get_vip_level(user_id: str, now: Optional[datetime] = None) -> Optional[VIPLevel]:
+    """从数据库读取用户当前生效的VIP等级（会员到期按Free），用户不存在时返回None
+
+    结果在进程内缓存 VIP_LEVEL_CACHE_SECONDS 秒；数据库不可用时抛出异常，由调用方决定如何降级。
+    """
+    user_key = _user_key(user_id)
+    cached = _vip_levels.get(user_key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    results = execute("SELECT vip_level, vip_expiry FROM type::thing('users', $user_key)", {'user_key': user_key})
+    rows = (results[0] if results else None) or []
+    level = None
+    if rows:
+        expiry = rows[0].get('vip_expiry')
+        expired = expiry and expiry < (now or datetime.utcnow()).isoformat()
+        level = VIPLevel.free if expired else parse_vip_level(rows[0].get('vip_level'))
+
+    with _vip_levels_lock:
+        if len(_vip_levels) >= VIP_LEVEL_CACHE_SIZE:
+            _vip_levels.clear()
+        _vip_levels[user_key] = (level, time.monotonic() + VIP_LEVEL_CACHE_SECONDS)
+    return level
+
+
+def invalidate_vip_level(user_id: str) -> None:
+    """等级变更后调用，让本进程下一次请求重新读取"""
+    with _vip_levels_lock:
+        _vip_levels.pop(_user_key(user_id), None)
+
+
+def get_window(kind: str, now: Optional[datetime] = None):
+    """返回配额当前所在的时间桶及其结束时间（UTC）"""
+    now = now or datetime.utcnow()
+    _field, window = QUOTA_COUNTERS[kind]
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if window == 'week':
+        year, week, _weekday = now.isocalendar()
+        week_start = day_start - timedelta(days=now.weekday())
+        return f"{year}-W{week:02d}", week_start + timedelta(weeks=1)
+
+    return day_start.strftime('%Y-%m-%d'), day_start + timedelta(days=1)
+
+
+def consume_quota(user_id: str, kind: str, amount: int = 1, now: Optional[datetime] = None) -> QuotaStatus:
+    """检查并扣减用户的配额，返回扣减后的使用情况
+
+    配额不足时不会扣减，返回 allowed=False。
+    amount 为0时只检查不扣减。
+    """
+    if kind not in QUOTA_COUNTERS:
+        raise ValueError(f"未知的配额类型: {kind}")
+
+    now = now or datetime.utcnow()
+    bucket, resets_at = get_window(kind, now)
+    user_key = _user_key(user_id)
+    params = {
+        'user_key': user_key,
+        'kind': kind,
+        'bucket': bucket,
+        'counter_key': [user_key, kind, bucket],
+        'amount': amount,
+        'limits': QUOTA_LIMITS[kind],
+        'free': VIPLevel.free.name,
+        'now': now.isoformat(),
+        'expires_at': (resets_at + COUNTER_RETENTION).isoformat(),
+    }
+
+    for attempt in range(MAX_CONFLICT_RETRIES):
+        try:
+            results = execute(CONSUME_QUOTA_QUERY, params)
+            break
+        except RuntimeError as e:
+            # 同一计数记录上的并发事务冲突，重试即可读到最新计数
+            if attempt == MAX_CONFLICT_RETRIES - 1:
+                raise
+            logger.info(f"配额事务冲突，重试 ({kind}, {user_id}): {str(e)}")
+
+    if not results:
+        # 模拟模式下没有数据库，不做限制
+        return QuotaStatus(kind=kind, allowed=True, used=0, limit=-1, resets_at=resets_at.isoformat())
+
+    outcome = results[-1] or {}
+    return QuotaStatus(
+        kind=kind,
+        allowed=bool(outcome.get('allowed')),
+        used=outcome.get('used') or 0,
+        limit=outcome.get('limit', -1),
+        resets_at=resets_at.isoformat(),
+    )
+
+
+def check_quota(user_id: str, kind: str, now: Optional[datetime] = None) -> QuotaStatus:
+    """只检查配额，不扣减"""
+    return consume_quota(user_id, kind, amount=0, now=now)
+
+
+def get_quota_usage(user_id: str, now: Optional[datetime] = None) -> Dict[str, Dict]:
+    """一次往返获取用户所有配额的使用情况"""
+    now = now or datetime.utcnow()
+    user_key = _user_key(user_id)
+    windows = {kind: get_window(kind, now) for kind in QUOTA_COUNTERS}
+
+    results = execute(QUOTA_USAGE_QUERY, {
+        'user_key': user_key,
+        'free': VIPLevel.free.name,
+        'now': now.isoformat(),
+        'buckets': list({bucket for bucket, _resets_at in windows.values()}),
+    })
+
+    level = results[1] if len(results) > 1 else VIPLevel.free.name
+    counts = {
+        (row.get('kind'), row.get('bucket')): row.get('count') or 0
+        for row in (results[-1] if results else []) or []
+    }
+
+    usage = {}
+    for kind, (bucket, resets_at) in windows.items():
+        limit = QUOTA_LIMITS[kind].get(level, QUOTA_LIMITS[kind][VIPLevel.free.name])
+        used = counts.get((kind, bucket), 0)
+        usage[kind] = QuotaStatus(
+            kind=kind,
+            allowed=limit < 0 or used < limit,
+            used=used,
+            limit=limit,
+            resets_at=resets_at.isoformat(),
+        ).to_dict()
+    return usage
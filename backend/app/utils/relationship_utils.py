@@ -1,7 +1,21 @@
 # backend/app/utils/relationship_utils.py
 from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Optional
 
-from app.models.relationship import Relationship, RelationshipStatus
+from app.db import execute
+from app.models.enums import RelationshipStatus
+
+if TYPE_CHECKING:
+    from app.models.relationship import Relationship
+
+# RIS计算参数，单条计算和批量重算共用同一组常量
+MAX_INTERACTIONS = 200  # 满分所需的交互次数
+EMOTIONAL_WINDOW = 30  # 情感密度的统计窗口（交互次数）
+RIS_WEIGHTS = (0.4, 0.35, 0.25)  # 交互频率、情感密度、协作深度的权重
+
+# 关系状态衰减阈值（天），单条更新和批量衰减任务共用
+COOLING_AFTER_DAYS = 7
+SILENT_AFTER_DAYS = 14
 
 
 def calculate_interaction_frequency(interaction_count: int) -> float:
@@ -16,12 +30,11 @@ def calculate_interaction_frequency(interaction_count: int) -> float:
     """
     # Assuming the calculation is based on the last 7 days
     # and a maximum of 200 interactions for full score
-    max_interactions = 200
-    return min(interaction_count / max_interactions, 1.0)
+    return min(interaction_count / MAX_INTERACTIONS, 1.0)
 
 
 def calculate_emotional_density(
-    emotional_resonance_count: int, total_interactions: int = 30
+    emotional_resonance_count: int, total_interactions: int = EMOTIONAL_WINDOW
 ) -> float:
     """
     Calculate the emotional density factor.
@@ -38,7 +51,7 @@ def calculate_emotional_density(
     return emotional_resonance_count / total_interactions
 
 
-def calculate_collaboration_depth(relationship: Relationship) -> float:
+def calculate_collaboration_depth(relationship: "Relationship") -> float:
     """
     Calculate the collaboration depth factor.
 
@@ -71,11 +84,120 @@ def calculate_ris(
     Returns:
         float: The Relationship Intensity Score (RIS).
     """
-    A, B, C = 0.4, 0.35, 0.25  # Weights for each factor
+    A, B, C = RIS_WEIGHTS  # Weights for each factor
     return A * interaction_frequency + B * emotional_density + C * collaboration_depth
 
 
-def update_relationship_status(relationship: Relationship) -> None:
+def compute_ris_components(relationship: dict) -> dict:
+    """
+    Compute the RIS and its component factors for a stored relationship record.
+
+    Args:
+        relationship (dict): The relationship record as stored in SurrealDB.
+
+    Returns:
+        dict: The materialized RIS fields, ready to be written back to the record.
+    """
+    interaction_frequency = calculate_interaction_frequency(
+        relationship.get("interaction_count") or 0
+    )
+    emotional_density = calculate_emotional_density(
+        relationship.get("emotional_resonance_count") or 0
+    )
+    collaboration_depth = calculate_collaboration_depth(relationship)
+
+    return {
+        "interaction_frequency": interaction_frequency,
+        "emotional_density": emotional_density,
+        "collaboration_depth": collaboration_depth,
+        "ris": calculate_ris(interaction_frequency, emotional_density, collaboration_depth),
+        "ris_updated_at": datetime.utcnow().isoformat(),
+    }
+
+
+def record_interaction_event(
+    relationship_id: str, emotional_resonance: bool = False
+) -> Optional[dict]:
+    """
+    Record one interaction and incrementally refresh the materialized RIS fields.
+
+    The counters are incremented atomically on the server. The factors are then
+    written back only if no concurrent event has moved the counters since, so a
+    slower writer never overwrites a newer score.
+
+    Args:
+        relationship_id (str): The ID of the relationship.
+        emotional_resonance (bool, optional): Whether the AI responded with emotional resonance.
+
+    Returns:
+        Optional[dict]: The updated relationship record, or None if it does not exist.
+    """
+    records = _record_interactions(
+        "relationship_id = $relationship_id",
+        {"relationship_id": relationship_id},
+        emotional_resonance,
+    )
+    return records[0] if records else None
+
+
+def record_pair_interaction(
+    human_id: str, ai_id: str, emotional_resonance: bool = False
+) -> int:
+    """
+    Record one chat exchange between a user and an AI on their relationship.
+
+    Args:
+        human_id (str): The user's record ID (``users:<key>``); relationships
+            created with the bare key are matched too.
+        ai_id (str): The ID of the AI.
+        emotional_resonance (bool, optional): Whether the AI responded with emotional resonance.
+
+    Returns:
+        int: The number of relationships updated (0 if the pair has none).
+    """
+    human_ids = [human_id, human_id.split(":", 1)[1]] if ":" in human_id else [human_id]
+    return len(_record_interactions(
+        "human_id IN $human_ids AND ai_id = $ai_id",
+        {"human_ids": human_ids, "ai_id": ai_id},
+        emotional_resonance,
+    ))
+
+
+def _record_interactions(condition: str, params: dict, emotional_resonance: bool) -> list:
+    """Increment the counters of the matching relationships and refresh their RIS."""
+    results = execute(
+        f"""
+        UPDATE relationship SET
+            interaction_count += 1,
+            emotional_resonance_count += $resonance,
+            last_active_time = $now,
+            status = IF status = 'broken' THEN status ELSE 'active' END
+        WHERE {condition}
+        RETURN AFTER
+        """,
+        {
+            **params,
+            "resonance": 1 if emotional_resonance else 0,
+            "now": datetime.utcnow().isoformat(),
+        },
+    )
+    records = results[0] if results else []
+
+    for relationship in records:
+        components = compute_ris_components(relationship)
+        execute(
+            "UPDATE $id MERGE $components WHERE interaction_count = $interaction_count RETURN NONE",
+            {
+                "id": relationship["id"],
+                "components": components,
+                "interaction_count": relationship.get("interaction_count"),
+            },
+        )
+        relationship.update(components)
+    return records
+
+
+def update_relationship_status(relationship: "Relationship") -> None:
     """
     Update the status of a relationship based on activity.
 
@@ -83,8 +205,8 @@ def update_relationship_status(relationship: Relationship) -> None:
         relationship (Relationship): The Relationship object.
     """
     now = datetime.utcnow()
-    seven_days_ago = now - timedelta(days=7)
-    fourteen_days_ago = now - timedelta(days=14)
+    seven_days_ago = now - timedelta(days=COOLING_AFTER_DAYS)
+    fourteen_days_ago = now - timedelta(days=SILENT_AFTER_DAYS)
 
     if relationship.last_active_time <= fourteen_days_ago:
         relationship.status = RelationshipStatus.SILENT
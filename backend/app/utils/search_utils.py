@@ -0,0 +1,166 @@
+"""
+聊天消息全文搜索
+消息写入时在应用层分词（见 app/utils/text_utils.py），
+结果以空格连接存入 search_text 字段，由 SurrealDB 的全文索引按空格建立倒排索引并用BM25排序。
+查询词使用同样的分词，高亮在原文上完成。
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+import html
+import logging
+import re
+
+from app.db import execute
+from app.utils.chat_cache import chat_owner_cache, chat_key
+from app.utils.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 参与索引的最大文本长度，超长消息只索引开头部分
+MAX_INDEXED_CHARS = 20000
+
+# 查询最多使用的词数
+MAX_QUERY_TERMS = 32
+
+# 搜索结果数量上限和高亮片段的长度
+MAX_SEARCH_RESULTS = 50
+SNIPPET_LENGTH = 120
+
+# 回填时每批处理的消息数
+BACKFILL_BATCH_SIZE = 500
+
+# 只供全文索引使用的消息字段，不返回给客户端
+INDEX_ONLY_FIELDS = ('search_text',)
+
+
+def index_fields(content: Optional[str]) -> Dict[str, str]:
+    """消息写入时需要附带的索引字段"""
+    return {'search_text': ' '.join(tokenize(content, MAX_INDEXED_CHARS))}
+
+
+def without_index_fields(message: Dict) -> Dict:
+    """去掉消息记录中只供索引使用的字段"""
+    return {key: value for key, value in message.items() if key not in INDEX_ONLY_FIELDS}
+
+
+def query_terms(text: str) -> List[str]:
+    """查询词，去重后保持原有顺序"""
+    return list(dict.fromkeys(tokenize(text)))[:MAX_QUERY_TERMS]
+
+
+def highlight(content: str, terms: List[str], length: int = SNIPPET_LENGTH,
+              pre: str = '<mark>', post: str = '</mark>') -> str:
+    """截取第一个命中位置附近的片段，并标出所有命中的词（原文会做HTML转义）"""
+    content = content or ''
+    if not terms:
+        return html.escape(content[:length])
+
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)),
+                         re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - length // 4) if first else 0
+    snippet = content[start:start + length]
+
+    parts = []
+    last = 0
+    for match in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[last:match.start()]))
+        parts.append(pre + html.escape(match.group(0)) + post)
+        last = match.end()
+    parts.append(html.escape(snippet[last:]))
+
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if start + length < len(content) else ''
+    return prefix + ''.join(parts) + suffix
+
+
+def _stored_format(value: datetime) -> str:
+    """转换成消息 timestamp 字段的格式：不带时区的本地时间"""
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.isoformat()
+
+
+def search_messages(user_id: str, text: str, chat_id: Optional[str] = None,
+                    since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    limit: int = 20, offset: int = 0) -> List[Dict]:
+    """在用户的聊天消息中做全文搜索，按BM25得分降序返回"""
+    terms = query_terms(text)
+    if not terms:
+        return []
+
+    conditions = ["user_id = $user_id", "search_text @1@ $terms", "chat_id NOT IN $hidden"]
+    if chat_id:
+        conditions.append("chat_id = $chat_ref")
+    # timestamp 保存的是本地时间的ISO字符串（datetime.now().isoformat()），按同样的格式比较字符串
+    if since:
+        conditions.append("timestamp >= $since")
+    if until:
+        conditions.append("timestamp < $until")
+
+    results = execute(
+        f"""
+        LET $hidden = (SELECT VALUE <string> id FROM chat WHERE user_id = $user_id AND deleted_at != NONE);
+        SELECT id, chat_id, role, content, timestamp, search::score(1) AS score FROM message
+        WHERE {' AND '.join(conditions)}
+        ORDER BY score DESC
+        LIMIT $limit START $offset;
+        """,
+        {
+            'user_id': user_id,
+            'terms': ' '.join(terms),
+            'chat_ref': f'chat:{chat_key(chat_id)}' if chat_id else None,
+            'since': _stored_format(since) if since else None,
+            'until': _stored_format(until) if until else None,
+            'limit': min(limit, MAX_SEARCH_RESULTS),
+            'offset': offset,
+        },
+    )
+    rows = (results[-1] if results else []) or []
+
+    return [{
+        'message_id': row.get('id'),
+        'chat_id': row.get('chat_id'),
+        'role': row.get('role'),
+        'timestamp': row.get('timestamp'),
+        'score': row.get('score'),
+        'highlight': highlight(row.get('content', ''), terms),
+    } for row in rows]
+
+
+def backfill_message_search(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """为建立索引之前写入的消息补上 user_id 和 search_text，返回处理的消息数
+
+    只需要在上线全文搜索后运行一次：python -m app.utils.search_utils
+    """
+    total = 0
+    while True:
+        results = execute(
+            "SELECT id, chat_id, content FROM message WHERE search_text = NONE LIMIT $limit",
+            {'limit': batch_size},
+        )
+        rows = (results[-1] if results else []) or []
+        if not rows:
+            break
+
+        statements = []
+        params = {}
+        for index, row in enumerate(rows):
+            params[f'id{index}'] = str(row.get('id')).split(':', 1)[-1]
+            params[f'fields{index}'] = {
+                'user_id': chat_owner_cache.get_owner(row.get('chat_id')),
+                **index_fields(row.get('content')),
+            }
+            statements.append(f"UPDATE type::thing('message', $id{index}) MERGE $fields{index} RETURN NONE;")
+        execute('\n'.join(statements), params)
+
+        total += len(rows)
+        logger.info(f"已为 {total} 条消息建立搜索索引")
+        if len(rows) < batch_size:
+            break
+    return total
+
+
+if __name__ == '__main__':
+    backfill_message_search()
@@ -0,0 +1,29 @@
+"""
+文本分词
+中日韩文字切成相邻两字的词组（bigram），其他文字按单词切分并转为小写。
+全文搜索和记忆检索共用，不依赖数据库。
+"""
+
+from typing import List, Optional
+import re
+
+# 中日韩文字（汉字、假名、谚文）
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_RE = re.compile(f'([{CJK_CHARS}]+)|([^\\W_{CJK_CHARS}]+)')
+
+
+def tokenize(text: Optional[str], max_chars: Optional[int] = None) -> List[str]:
+    """把文本切分为词，max_chars 限制参与切分的文本长度"""
+    text = text or ''
+    if max_chars is not None:
+        text = text[:max_chars]
+
+    tokens = []
+    for cjk, word in TOKEN_RE.findall(text):
+        if word:
+            tokens.append(word.lower())
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
@@ -0,0 +1,82 @@
+"""
+生产环境的Gunicorn配置
+在 backend 目录下运行：gunicorn -c gunicorn.conf.py（或 python run.py --prod）
+
+- 预先fork多个工作进程，每个进程用线程池处理请求（gthread）：LLM调用和SSE流大部分时间在等待网络，
+  一个慢请求只占用一个线程，不会阻塞整个服务
+- 主进程预加载应用和Agent模块后再fork，只读的配置表（模型等级、工具定义、限流和截止时间规则等）
+  由各工作进程以写时复制的方式共享
+- 数据库连接池在每个工作进程启动后建立并预热，进程退出时排空（见 app/db.py）
+- 每个进程处理一定数量的请求后自动重启，避免内存缓慢增长
+- 平滑重启：kill -HUP <主进程> 按新配置逐个替换工作进程；预加载模式下代码更新需要
+  kill -USR2 <主进程> 启动新的主进程，确认正常后再 kill -TERM 旧的主进程
+
+注意LLM并发名额（LLM_MAX_CONCURRENCY）、响应缓存和熔断器都是按进程计算的。
+"""
+
+import gc
+import importlib
+import multiprocessing
+import os
+
+# 应用工厂：数据库在工作进程中初始化（post_worker_init），主进程不建立连接
+wsgi_app = 'app:create_app(init_database=False)'
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+
+# 工作进程数默认等于CPU核数，每个进程的线程数决定同时处理的请求数
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+# 线程数要多于LLM并发名额（与 app/agent/admission.py 的默认值一致）：LLM请求在名额调度器里按VIP等级排队，
+# 线程数不够时请求会先堵在Gunicorn的连接队列里，调度器排不上队，优先级也就不起作用；
+# 多出来的线程留给不调用LLM的普通请求
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 32))
+NON_LLM_THREADS = 16
+threads = int(os.getenv('GUNICORN_THREADS', max(LLM_MAX_CONCURRENCY, 0) + NON_LLM_THREADS))
+
+# gthread 的心跳由主线程发送，长时间的LLM请求和SSE流不会被 timeout 误杀
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# 退出或重启时等待进行中的请求（最长的LLM请求预算为90秒，见 app/middleware/deadline.py）
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 90))
+keepalive = 5
+
+# 处理这么多请求后重启工作进程，加随机抖动避免所有进程同时重启
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() != 'false'
+
+# 预加载时在主进程中提前导入的模块（启动时默认是延迟导入的，见 scripts/check_import_time.py）
+PRELOAD_MODULES = (
+    'app.agent.ai_assistant',
+    'app.agent.llm_router',
+    'app.agent.response_cache',
+)
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    """主进程就绪、开始fork工作进程之前"""
+    if not server.cfg.preload_app:
+        return
+    for module_name in PRELOAD_MODULES:
+        importlib.import_module(module_name)
+    # 把预加载的对象移出垃圾回收的扫描范围，工作进程里的GC不会改写这些内存页，写时复制的共享才能保持
+    gc.freeze()
+    server.log.info(f"Preloaded {len(PRELOAD_MODULES)} modules, {gc.get_freeze_count()} objects frozen")
+
+
+def post_worker_init(worker):
+    """工作进程加载完应用、开始接受请求之前：建立并预热数据库连接池"""
+    from app.db import init_db
+    init_db(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    """工作进程退出时排空进行中的数据库查询并关闭连接"""
+    from app.db import shutdown_db
+    shutdown_db()
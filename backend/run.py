@@ -1,5 +1,3 @@
-from app import app
-from app.db import init_db
 import os
 import sys
 import asyncio
@@ -9,8 +7,8 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
-# 初始化数据库
-init_db(app)
+# 生产模式使用的Gunicorn配置
+GUNICORN_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
 
 # 处理Windows上的asyncio事件循环清理
 def handle_asyncio_cleanup():
@@ -45,7 +43,19 @@ def handle_asyncio_cleanup():
 import logging
 logging.getLogger('asyncio').setLevel(logging.ERROR)
 
+def serve_production():
+    """多进程Gunicorn（配置见 gunicorn.conf.py），替换当前进程"""
+    os.chdir(os.path.dirname(GUNICORN_CONFIG))
+    os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '--config', GUNICORN_CONFIG])
+
 if __name__ == '__main__':
+    if '--prod' in sys.argv[1:]:
+        serve_production()
+    
+    # 开发模式：单进程的Werkzeug开发服务器，带调试器和自动重载，不要用于生产环境
+    # 应用工厂（app/__init__.py 的 create_app）会初始化数据库连接池
+    from app import app
+    
     # 应用asyncio清理处理
     handle_asyncio_cleanup()
     
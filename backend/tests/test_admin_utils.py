@@ -0,0 +1,94 @@
+"""管理后台的增量计数和仪表盘快照（app/utils/admin_utils.py）"""
+
+from datetime import datetime
+
+import pytest
+
+from app.models.enums import VIPLevel
+from app.utils import admin_utils
+from app.utils.admin_utils import (
+    get_dashboard_snapshot, invalidate_dashboard_snapshot, record_user_active, record_user_registered,
+    record_vip_change,
+)
+
+NOW = datetime(2025, 3, 5, 15, 30)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(admin_utils, 'execute', lambda sql, params=None: calls.append((sql, params)) or [])
+    invalidate_dashboard_snapshot()
+    yield calls
+    invalidate_dashboard_snapshot()
+
+
+def test_registration_updates_totals_and_today_in_one_round_trip(calls):
+    record_user_registered('pro', now=NOW)
+
+    assert len(calls) == 1
+    sql, params = calls[0]
+    assert 'system_counter:users' in sql and "type::thing('system_daily', $day)" in sql
+    assert params['totals'] == {'total_users': 1, 'vip_users': 1}
+    assert params['daily'] == {'new_users': 1}
+    assert params['day'] == '2025-03-05'
+
+
+def test_free_registration_skips_zero_fields(calls):
+    record_user_registered(VIPLevel.free.value, now=NOW)
+
+    assert calls[0][1]['totals'] == {'total_users': 1}
+
+
+def test_only_first_login_of_the_day_counts(calls):
+    record_user_active('2025-03-05T08:00:00', now=NOW)
+    record_user_active(datetime(2025, 3, 4, 23, 0), now=NOW)
+
+    assert len(calls) == 1
+    assert calls[0][1]['daily'] == {'active_users': 1}
+
+
+@pytest.mark.parametrize('old, new, totals, daily', [
+    ('free', 'pro', {'vip_users': 1}, {'vip_conversions': 1}),
+    (VIPLevel.pro, VIPLevel.free, {'vip_users': -1}, {}),
+])
+def test_vip_change(calls, old, new, totals, daily):
+    record_vip_change(old, new, now=NOW)
+
+    assert calls[0][1]['totals'] == totals
+    assert calls[0][1]['daily'] == daily
+
+
+def test_vip_to_vip_change_is_not_counted(calls):
+    record_vip_change('pro', 'premium', now=NOW)
+
+    assert calls == []
+
+
+def test_counter_failure_does_not_raise(monkeypatch):
+    def execute(sql, params=None):
+        raise RuntimeError('connection refused')
+
+    monkeypatch.setattr(admin_utils, 'execute', execute)
+
+    record_user_registered(now=NOW)
+
+
+def test_snapshot_is_cached(monkeypatch):
+    calls = []
+
+    def execute(sql, params=None):
+        calls.append(params)
+        return [[{'total_users': 10, 'vip_users': 2}], [{'new_users': 3}], [{'new_users': 20, 'vip_conversions': 5}]]
+
+    monkeypatch.setattr(admin_utils, 'execute', execute)
+    invalidate_dashboard_snapshot()
+    try:
+        first = get_dashboard_snapshot()
+        second = get_dashboard_snapshot()
+    finally:
+        invalidate_dashboard_snapshot()
+
+    assert len(calls) == 1
+    assert second is first
+    assert (first['total_users'], first['new_users_today'], first['conversion_rate']) == (10, 3, 0.25)
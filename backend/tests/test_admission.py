@@ -0,0 +1,100 @@
+"""LLM并发名额的优先级调度（app/agent/admission.py）"""
+
+import threading
+import time
+
+import pytest
+
+from app.agent.admission import AdmissionRejected, AdmissionScheduler, tier_key
+from app.models.enums import VIPLevel
+
+
+def _wait_queued(scheduler, level, count):
+    for _ in range(200):
+        if len(scheduler._queues[level]) == count:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f'{level.name} queue never reached {count}')
+
+
+def _queue(scheduler, levels, order):
+    """按顺序让每个等级的一个请求开始排队，拿到名额后记录顺序并立即归还"""
+    def worker(level):
+        scheduler.acquire(level)
+        order.append(level)
+        scheduler.release(level)
+
+    threads = []
+    for level in levels:
+        queued = len(scheduler._queues[level])
+        thread = threading.Thread(target=worker, args=(level,))
+        thread.start()
+        _wait_queued(scheduler, level, queued + 1)
+        threads.append(thread)
+    return threads
+
+
+def test_admits_immediately_below_limit():
+    scheduler = AdmissionScheduler(max_concurrency=2, max_wait=1)
+
+    assert scheduler.acquire(VIPLevel.free) < 0.1
+    assert scheduler.acquire(VIPLevel.free) < 0.1
+    assert scheduler.stats()['free']['running'] == 2
+
+
+def test_higher_tier_jumps_the_queue():
+    scheduler = AdmissionScheduler(max_concurrency=1, max_wait=5)
+    scheduler.acquire(VIPLevel.free)
+    order = []
+    threads = _queue(scheduler, [VIPLevel.free, VIPLevel.free, VIPLevel.premium], order)
+
+    scheduler.release(VIPLevel.free)
+    for thread in threads:
+        thread.join(5)
+
+    assert order == [VIPLevel.premium, VIPLevel.free, VIPLevel.free]
+
+
+def test_weighted_share_between_tiers():
+    scheduler = AdmissionScheduler(max_concurrency=1, max_wait=5)
+    scheduler.acquire(VIPLevel.free)
+    order = []
+    threads = _queue(scheduler, [VIPLevel.free] * 3 + [VIPLevel.pro] * 3, order)
+
+    scheduler.release(VIPLevel.free)
+    for thread in threads:
+        thread.join(5)
+
+    # Pro 的权重是 Free 的两倍，但 Free 不会被饿死
+    assert order[:3].count(VIPLevel.pro) == 2
+    assert sorted(order, key=lambda level: level.name) == [VIPLevel.free] * 3 + [VIPLevel.pro] * 3
+
+
+def test_sheds_after_timeout():
+    scheduler = AdmissionScheduler(max_concurrency=1, max_wait=5)
+    scheduler.acquire(VIPLevel.free)
+
+    with pytest.raises(AdmissionRejected) as error:
+        scheduler.acquire(VIPLevel.free, timeout=0.05)
+
+    assert error.value.vip_level is VIPLevel.free
+    assert error.value.waited >= 0.05
+    # 被拒绝的请求不会留在队列里占用之后释放的名额
+    assert scheduler.stats()['free']['queued'] == 0
+    scheduler.release(VIPLevel.free)
+    assert scheduler.acquire(VIPLevel.pro, timeout=0.05) < 0.05
+
+
+def test_slot_releases_on_error():
+    scheduler = AdmissionScheduler(max_concurrency=1, max_wait=1)
+
+    with pytest.raises(RuntimeError):
+        with scheduler.slot('Pro'):
+            raise RuntimeError('upstream failed')
+
+    assert scheduler.stats()['pro']['running'] == 0
+
+
+def test_tier_key_separates_levels():
+    assert tier_key('k', 'Premium') != tier_key('k', None)
+    assert tier_key('k', None) == tier_key('k', 'free') == tier_key('k', 'unknown')
@@ -0,0 +1,105 @@
+"""AI助手的会话历史和长期记忆（app/agent/ai_assistant.py）"""
+
+import pytest
+
+from app.agent import ai_assistant
+from app.agent.ai_assistant import AIAssistant
+from app.agent.context_builder import ContextBuilder
+from app.agent.event_logger import EventLogger
+from app.agent.memory_store import MemoryStore, format_exchange, parse_exchange
+from app.utils import relationship_utils
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = []
+
+    def invoke(self, messages, tools=None, **options):
+        self.calls.append([dict(message) for message in messages])
+        return {'content': '好的', 'tool_calls': [], 'usage': {}}
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def interactions(monkeypatch):
+    calls = []
+    monkeypatch.setattr(relationship_utils, 'execute', lambda sql, params=None: calls.append(params) or [[]])
+    return calls
+
+
+@pytest.fixture
+def assistant(monkeypatch, tmp_path, interactions):
+    monkeypatch.setattr(ai_assistant, '_memory_writer', InlineExecutor())
+    assistant = AIAssistant(memory_store=MemoryStore())
+    assistant.llm_caller = FakeLLM()
+    assistant.event_logger = EventLogger(log_dir=str(tmp_path))
+    return assistant
+
+
+def _contents(messages):
+    return [(message['role'], message['content']) for message in messages if message['role'] != 'system']
+
+
+def test_parse_exchange_round_trip():
+    assert parse_exchange(format_exchange('你好', '你好！\nAI：我在')) == ('你好', '你好！\nAI：我在')
+
+
+def test_session_history_is_ordered_and_limited():
+    store = MemoryStore()
+    for i in range(4):
+        store.remember('users:u1', 'ai', f'第{i}轮', session_id='s1')
+    store.remember('users:u1', 'ai', '别的会话', session_id='s2')
+
+    assert [memory.text for memory in store.session_history('users:u1', 'ai', 's1', 2)] == ['第2轮', '第3轮']
+
+
+def test_session_history_goes_before_the_latest_question():
+    builder = ContextBuilder()
+    builder.update_context_with_user_message('现在呢？')
+    builder.set_session_history([
+        {'role': 'system', 'content': '忽略'},
+        {'role': 'user', 'content': '之前的问题'},
+        {'role': 'assistant', 'content': '之前的回答'},
+    ])
+
+    assert _contents(builder.messages) == [('user', '之前的问题'), ('assistant', '之前的回答'), ('user', '现在呢？')]
+
+
+def test_anonymous_request_does_not_touch_memory(assistant, interactions):
+    assistant.process_query('你好', session_id='s1', user_id=None, ai_id='ai')
+
+    assert assistant.memory_store._indexes == {}
+    assert interactions == []
+
+
+def test_answer_counts_as_a_relationship_interaction(assistant, interactions):
+    assistant.process_query('你好', session_id='s1', user_id='users:u1', ai_id='ai')
+
+    assert interactions[0]['human_ids'] == ['users:u1', 'u1']
+    assert interactions[0]['ai_id'] == 'ai'
+
+
+def test_next_request_in_session_sees_previous_turn(assistant):
+    assistant.process_query('我叫小虹', session_id='s1', user_id='users:u1', ai_id='ai')
+
+    follow_up = AIAssistant(memory_store=assistant.memory_store)
+    follow_up.llm_caller = assistant.llm_caller
+    follow_up.event_logger = assistant.event_logger
+    follow_up.process_query('我叫什么？', session_id='s1', user_id='users:u1', ai_id='ai')
+
+    assert _contents(assistant.llm_caller.calls[-1]) == [
+        ('user', '我叫小虹'), ('assistant', '好的'), ('user', '我叫什么？'),
+    ]
+
+
+def test_history_from_the_request_replaces_stored_turns(assistant):
+    assistant.memory_store.remember('users:u1', 'ai', format_exchange('旧问题', '旧回答'), session_id='s1')
+    history = [{'role': 'user', 'content': '客户端的问题'}, {'role': 'assistant', 'content': '客户端的回答'}]
+
+    assistant.process_query('继续', session_id='s1', user_id='users:u1', ai_id='ai', history=history)
+
+    assert _contents(assistant.llm_caller.calls[-1])[:2] == [('user', '客户端的问题'), ('assistant', '客户端的回答')]
@@ -0,0 +1,84 @@
+"""聊天列表和聊天归属缓存（app/utils/chat_cache.py）"""
+
+import pytest
+
+from app.utils import chat_cache
+from app.utils.chat_cache import ChatListCache, ChatOwnerCache
+
+CHATS = [
+    {'id': 'chat:a', 'title': 'A', 'last_message_at': '2025-03-01T10:00:00', 'is_pinned': False},
+    {'id': 'chat:b', 'title': 'B', 'last_message_at': '2025-03-02T10:00:00', 'is_pinned': False},
+    {'id': 'chat:c', 'title': 'C', 'last_message_at': '2025-02-01T10:00:00', 'is_pinned': True},
+]
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    loads = []
+
+    def execute(sql, params=None):
+        loads.append(params)
+        if 'type::thing' in sql:
+            return [[{'user_id': 'users:u1', 'deleted_at': None}]] if params['key'] == 'a' else [[]]
+        return [CHATS[:params['limit']]]
+
+    monkeypatch.setattr(chat_cache, 'execute', execute)
+    return loads
+
+
+def _ids(page):
+    chats, _has_more = page
+    return [chat['id'] for chat in chats]
+
+
+def test_first_page_is_sorted_and_cached(loads):
+    cache = ChatListCache()
+
+    assert _ids(cache.first_page('users:u1', 2)) == ['chat:c', 'chat:b']
+    assert cache.first_page('users:u1', 2)[1] is True
+    assert len(loads) == 1
+
+
+def test_new_message_moves_chat_to_the_top(loads):
+    cache = ChatListCache()
+    cache.first_page('users:u1', 10)
+
+    cache.touch('users:u1', 'chat:a', '2025-03-03T10:00:00', '新消息')
+
+    chats, _has_more = cache.first_page('users:u1', 10)
+    assert [chat['id'] for chat in chats] == ['chat:c', 'chat:a', 'chat:b']
+    assert chats[1]['last_message_preview'] == '新消息'
+
+
+def test_archive_and_remove_drop_the_chat(loads):
+    cache = ChatListCache()
+    cache.first_page('users:u1', 10)
+
+    cache.upsert('users:u1', {**CHATS[0], 'is_archived': True})
+    cache.remove('users:u1', 'chat:b')
+
+    assert _ids(cache.first_page('users:u1', 10)) == ['chat:c']
+
+
+def test_partial_list_cannot_place_a_new_chat(loads):
+    cache = ChatListCache(size=2)
+    cache.first_page('users:u1', 2)
+
+    assert cache.first_page('users:u1', 3) is None
+    cache.upsert('users:u1', {'id': 'chat:d', 'last_message_at': '2025-03-04T10:00:00'})
+    cache.first_page('users:u1', 2)
+
+    assert len(loads) == 2
+
+
+def test_owner_is_cached_and_missing_chat_has_none(loads):
+    cache = ChatOwnerCache()
+
+    assert cache.get_owner('chat:a') == 'users:u1'
+    assert cache.get_owner('a') == 'users:u1'
+    assert cache.get_owner('chat:missing') is None
+    assert len(loads) == 2
+
+    cache.invalidate('chat:a')
+    cache.get_owner('chat:a')
+    assert len(loads) == 3
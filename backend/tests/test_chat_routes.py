@@ -0,0 +1,67 @@
+"""/api/chat 接口（app/routes/chat_routes.py）"""
+
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from app.agent.response_cache import ResponseCache
+from app.middleware import rate_limit
+from app.routes import chat_routes
+from app.utils.quota_utils import QuotaStatus
+
+
+def _completion(content='彩虹城是一个AI共生社区'):
+    message = SimpleNamespace(content=content, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], model='gpt-4o-mini', created=1700000000)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    def create_completion(vip_level, **params):
+        calls.append(params)
+        return _completion()
+
+    cache = ResponseCache()
+    monkeypatch.setattr(chat_routes, 'enforce_quota', lambda kind='chat': None)
+    monkeypatch.setattr(chat_routes, '_create_completion', create_completion)
+    monkeypatch.setattr('app.agent.response_cache.get_response_cache', lambda: cache)
+    app = Flask(__name__)
+    app.register_blueprint(chat_routes.chat_bp)
+    client = app.test_client()
+    client.calls = calls
+    return client
+
+
+def _ask(client, *messages):
+    return client.post('/api/chat', json={'messages': [{'role': 'user', 'content': text} for text in messages]})
+
+
+def test_repeated_question_is_served_from_cache(client):
+    first = _ask(client, '彩虹城是什么？')
+    second = _ask(client, '彩虹城是什么？')
+
+    assert len(client.calls) == 1
+    assert first.get_json()['response']['content'] == second.get_json()['response']['content']
+    assert second.get_json()['cached'] == 'exact'
+
+
+def test_follow_up_question_is_not_cached(client):
+    _ask(client, '彩虹城是什么？', '再说详细一点')
+    _ask(client, '彩虹城是什么？', '再说详细一点')
+
+    assert len(client.calls) == 2
+
+
+def test_exhausted_quota_stops_before_the_llm(client, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'authenticated_user_id', lambda: 'users:u1')
+    monkeypatch.setattr(rate_limit, 'consume_quota',
+                        lambda user_id, kind: QuotaStatus(kind, False, 10, 10, '2999-01-01T00:00:00'))
+    monkeypatch.setattr(chat_routes, 'enforce_quota', rate_limit.enforce_quota)
+
+    response = _ask(client, '彩虹城是什么？')
+
+    assert response.status_code == 429
+    assert client.calls == []
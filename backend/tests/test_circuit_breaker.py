@@ -0,0 +1,127 @@
+"""熔断器的状态转换（app/utils/circuit_breaker.py）"""
+
+import pytest
+
+from app.utils import circuit_breaker
+from app.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    # 去掉打开时间的随机抖动
+    monkeypatch.setattr(circuit_breaker.random, 'uniform', lambda low, high: low)
+    return clock
+
+
+def _breaker(**config):
+    config = {'window': 30, 'min_calls': 4, 'error_rate': 0.5, 'open_seconds': 5, 'max_open_seconds': 15,
+              **config}
+    return CircuitBreaker('test', **config)
+
+
+def _trip(breaker):
+    for ok in (True, True, False, False):
+        breaker.record(ok)
+
+
+def test_opens_at_error_rate(clock):
+    breaker = _breaker()
+    for ok in (True, True, False):
+        breaker.record(ok)
+    assert breaker.state == CLOSED
+
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as error:
+        breaker.allow()
+    assert error.value.retry_after == 5
+
+
+def test_needs_min_calls(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record(False)
+
+    assert breaker.state == CLOSED
+
+
+def test_old_failures_leave_the_window(clock):
+    breaker = _breaker()
+    breaker.record(False)
+    breaker.record(False)
+    clock.now += 31
+    breaker.record(True)
+    breaker.record(False)
+
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_one_probe(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 5
+
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 5
+    breaker.allow()
+    breaker.record(True)
+
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_failed_probe_reopens_with_backoff(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    for expected in (10, 15, 15):
+        clock.now = breaker._open_until
+        breaker.allow()
+        breaker.record(False)
+        assert breaker.state == OPEN
+        assert breaker._open_until - clock.now == expected
+
+
+def test_guard_counts_only_listed_failures(clock):
+    breaker = _breaker(min_calls=1)
+
+    with pytest.raises(ValueError):
+        with breaker.guard(ConnectionError):
+            raise ValueError('bad request')
+    assert breaker.state == CLOSED
+
+    with pytest.raises(ConnectionError):
+        with breaker.guard(ConnectionError):
+            raise ConnectionError('refused')
+    assert breaker.state == OPEN
+
+
+def test_guard_releases_probe_on_ignored_error(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 5
+
+    with pytest.raises(ValueError):
+        with breaker.guard(ConnectionError):
+            raise ValueError('bad request')
+    # 没有结论的探测不占着探测名额
+    with breaker.guard(ConnectionError):
+        pass
+    assert breaker.state == CLOSED
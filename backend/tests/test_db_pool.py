@@ -0,0 +1,120 @@
+"""进程内的数据库连接池（app/db.py）"""
+
+import asyncio
+
+import pytest
+
+from app import db
+from app.db import ConnectionPool
+from app.utils.circuit_breaker import CircuitBreaker
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.alive = True
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    connections = []
+
+    async def connect():
+        connections.append(FakeConnection(len(connections)))
+        return connections[-1]
+
+    async def is_connection_alive(conn):
+        return conn.alive
+
+    monkeypatch.setattr(db, '_connect', connect)
+    monkeypatch.setattr(db, 'is_connection_alive', is_connection_alive)
+    monkeypatch.setattr(db, 'db_breaker', CircuitBreaker('test.surrealdb'))
+    return connections
+
+
+def test_released_connection_is_reused(connections):
+    async def scenario():
+        pool = ConnectionPool(size=2)
+        conn = await pool.acquire()
+        pool.release(conn)
+        return conn, await pool.acquire()
+
+    first, second = asyncio.run(scenario())
+
+    assert second is first
+    assert len(connections) == 1
+
+
+def test_acquire_waits_for_a_release_at_the_size_limit(connections):
+    async def scenario():
+        pool = ConnectionPool(size=1)
+        held = await pool.acquire()
+        waiting = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done() and pool.stats()['waiting'] == 1
+        pool.release(held)
+        return held, await waiting
+
+    held, next_conn = asyncio.run(scenario())
+
+    assert next_conn is held
+    assert len(connections) == 1
+
+
+def test_idle_connection_is_checked_and_replaced_when_dead(connections):
+    async def scenario():
+        pool = ConnectionPool(size=2, idle_check=0)
+        conn = await pool.acquire()
+        pool.release(conn)
+        conn.db.alive = False
+        return conn, await pool.acquire()
+
+    dead, replacement = asyncio.run(scenario())
+
+    assert replacement is not dead
+    assert dead.db.closed
+
+
+def test_failed_query_marks_connection_suspect(connections):
+    async def failing():
+        await db.get_db()
+        raise RuntimeError('bad query')
+
+    async def scenario():
+        pool = ConnectionPool(size=1)
+        with pytest.raises(RuntimeError):
+            await db._run(failing(), pool, None)
+        return pool
+
+    pool = asyncio.run(scenario())
+
+    assert pool._idle[0].last_used == 0.0
+
+
+def test_warm_up_opens_up_to_the_pool_size(connections):
+    pool = ConnectionPool(size=3)
+
+    assert asyncio.run(pool.warm_up(5)) == 3
+    assert len(connections) == 3
+
+
+def test_close_drains_running_queries_then_closes_everything(connections):
+    async def scenario():
+        pool = ConnectionPool(size=2)
+        await pool.warm_up(1)
+        busy = await pool.acquire()
+        closing = asyncio.ensure_future(pool.close(timeout=5))
+        await asyncio.sleep(0.01)
+        assert not closing.done()
+        pool.release(busy)
+        await closing
+        with pytest.raises(RuntimeError):
+            await pool.acquire()
+
+    asyncio.run(scenario())
+
+    assert all(conn.closed for conn in connections)
@@ -0,0 +1,110 @@
+"""请求截止时间（app/utils/deadline.py）"""
+
+import threading
+import time
+
+import jwt
+import pytest
+from flask import Flask
+
+from app.middleware.deadline import init_deadlines
+from app.routes import chat_history_routes
+from app.utils.circuit_breaker import CircuitOpen
+from app.utils.deadline import (
+    DeadlineExceeded, current_deadline, has_time, remaining, reset_deadline, set_deadline, time_left,
+)
+
+SECRET_KEY = 'deadline-test-secret-key-0123456789'
+
+
+@pytest.fixture
+def deadline():
+    tokens = []
+
+    def set_for(seconds):
+        tokens.append(set_deadline(seconds))
+
+    yield set_for
+    for token in reversed(tokens):
+        reset_deadline(token)
+
+
+def test_no_deadline_uses_default():
+    assert remaining() is None
+    assert time_left(60) == 60
+    assert time_left(None) is None
+    assert has_time(1e9)
+
+
+def test_time_left_is_capped_by_deadline(deadline):
+    deadline(5)
+
+    assert 4.5 < time_left(60) <= 5
+    assert 4.5 < time_left(None) <= 5
+    assert time_left(2) == 2
+
+
+def test_expired_deadline_raises(deadline):
+    deadline(0.01)
+    time.sleep(0.02)
+
+    with pytest.raises(DeadlineExceeded) as error:
+        time_left(60, 'LLM')
+    assert error.value.operation == 'LLM'
+    assert remaining() == 0
+
+
+def test_has_time(deadline):
+    deadline(3)
+
+    assert has_time(2)
+    assert not has_time(5)
+
+
+def test_zero_clears_deadline(deadline):
+    deadline(5)
+    deadline(0)
+
+    assert current_deadline() is None
+    assert time_left(60) == 60
+
+
+def test_deadline_is_per_thread(deadline):
+    deadline(5)
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(remaining()))
+    thread.start()
+    thread.join()
+
+    assert seen == [None]
+
+
+def test_reset_restores_previous(deadline):
+    outer = set_deadline(5)
+    inner = set_deadline(1)
+    reset_deadline(inner)
+
+    assert remaining() > 4
+    reset_deadline(outer)
+    assert remaining() is None
+
+
+@pytest.mark.parametrize('error, status', [(DeadlineExceeded('数据库'), 504), (CircuitOpen('surrealdb', 7), 503)])
+def test_route_does_not_turn_deadline_or_open_circuit_into_500(monkeypatch, error, status):
+    def search_messages(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(chat_history_routes, 'search_messages', search_messages)
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.register_blueprint(chat_history_routes.chat_history_bp)
+    init_deadlines(app)
+
+    @app.errorhandler(CircuitOpen)
+    def handle_circuit_open(error):
+        return {'error': str(error)}, 503
+
+    token = jwt.encode({'id': 'users:u1'}, SECRET_KEY, algorithm='HS256')
+    response = app.test_client().get('/api/chats/search?q=彩虹', headers={'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == status
@@ -0,0 +1,95 @@
+"""软删除和后台级联清理（app/utils/deletion_utils.py）"""
+
+import pytest
+
+from app.utils import deletion_utils
+from app.utils.deletion_utils import process_deletion_job, run_deletion_jobs, schedule_deletions_returning
+
+FAR = float('inf')
+
+
+class FakeDB:
+    """按语句内容返回预设结果，记录所有调用"""
+
+    def __init__(self, batches=(), child_ids=()):
+        self.calls = []
+        self.batches = list(batches)
+        self.child_ids = list(child_ids)
+
+    def execute(self, sql, params=None):
+        self.calls.append((sql, params))
+        if 'DELETE $ids' in sql:
+            return [None, None, None, self.batches.pop(0) if self.batches else 0]
+        if sql.startswith('SELECT VALUE id FROM chat'):
+            ids, self.child_ids = self.child_ids[:params['limit']], self.child_ids[params['limit']:]
+            return [ids]
+        return []
+
+    def statements(self, text):
+        return [params for sql, params in self.calls if text in sql]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(deletion_utils, 'execute', db.execute)
+    monkeypatch.setattr(deletion_utils.time, 'sleep', lambda seconds: None)
+    return db
+
+
+def test_schedule_hides_records_and_registers_jobs_in_one_transaction(monkeypatch, db):
+    db.execute = lambda sql, params=None: db.calls.append((sql, params)) or [[{'id': 'chat:c1'}]]
+    monkeypatch.setattr(deletion_utils, 'execute', db.execute)
+
+    job_ids, hidden = schedule_deletions_returning('chat', ['chat:c1', 'c2'], fields=('user_id',))
+
+    assert job_ids == ['chat:c1', 'chat:c2']
+    assert hidden == [{'id': 'chat:c1'}]
+    sql, params = db.calls[0]
+    assert sql.startswith('BEGIN TRANSACTION;') and sql.endswith('COMMIT TRANSACTION;')
+    assert (params['key0'], params['key1']) == ('c1', 'c2')
+    assert 'RETURN id, user_id' in sql
+
+
+def test_schedule_nothing(db):
+    assert schedule_deletions_returning('chat', []) == ([], [])
+    assert db.calls == []
+
+
+def test_job_deletes_in_batches_then_removes_the_record(db):
+    db.batches = [2, 2, 1]
+
+    assert process_deletion_job({'kind': 'chat', 'target': 'c1'}, deadline=FAR, batch_size=2)
+
+    assert [params['ref'] for params in db.statements('DELETE $ids')] == ['chat:c1'] * 3
+    assert db.statements('SET step = $step')[0]['step'] == 1
+    assert db.statements("status = 'done'")[0]['key'] == 'c1'
+
+
+def test_job_stops_at_the_deadline_and_resumes_from_its_step(db):
+    assert process_deletion_job({'kind': 'user', 'target': 'u1'}, deadline=0) is False
+    assert db.statements('DELETE $ids') == []
+
+    assert process_deletion_job({'kind': 'user', 'target': 'u1', 'step': 2, 'status': 'running'}, deadline=FAR)
+    assert [params['ref'] for params in db.statements('DELETE $ids')] == ['u1']
+
+
+def test_user_chats_get_their_own_jobs(db):
+    db.child_ids = ['chat:c1', 'chat:c2']
+
+    process_deletion_job({'kind': 'user', 'target': 'u1', 'step': 0, 'status': 'running'}, deadline=FAR)
+
+    scheduled = db.statements('deletion_job')
+    assert any(params.get('kind') == 'chat' and params.get('key0') == 'c1' for params in scheduled)
+
+
+def test_failed_job_is_kept_with_its_error(monkeypatch, db):
+    def process(job, deadline):
+        raise RuntimeError('connection reset')
+
+    db.execute = lambda sql, params=None: db.calls.append((sql, params)) or [[{'kind': 'chat', 'target': 'c1'}]]
+    monkeypatch.setattr(deletion_utils, 'execute', db.execute)
+    monkeypatch.setattr(deletion_utils, 'process_deletion_job', process)
+
+    assert run_deletion_jobs() == {'completed': 0, 'pending': 1}
+    assert db.statements('last_error')[0]['error'] == 'connection reset'
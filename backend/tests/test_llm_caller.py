@@ -0,0 +1,130 @@
+"""OpenAI调用器（app/agent/llm_caller.py）"""
+
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from app.agent import llm_caller
+from app.agent.llm_caller import OpenAILLMCaller
+from app.agent.response_cache import LLM_DEFAULT_TEMPERATURE, ResponseCache
+from app.agent.single_flight import SingleFlight
+from app.utils.circuit_breaker import CLOSED, OPEN, CircuitBreaker
+from app.utils.deadline import DeadlineExceeded, reset_deadline, set_deadline
+
+MESSAGES = [{'role': 'user', 'content': '彩虹城是什么？'}]
+
+
+def _response(content='彩虹城是一个AI共生社区'):
+    message = SimpleNamespace(content=content, tool_calls=None)
+    usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class FakeCompletions:
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def create(self, **params):
+        self.calls.append(params)
+        if self.error is not None:
+            raise self.error
+        return _response()
+
+
+def _caller(completions, name='openai', **kwargs):
+    caller = OpenAILLMCaller('gpt-4o', cache=ResponseCache(), flight=SingleFlight('test_llm'), name=name, **kwargs)
+    caller._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    caller.breaker = CircuitBreaker(f'test.{name}', min_calls=1)
+    return caller
+
+
+def _timeout_error():
+    return openai.APITimeoutError(request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+
+
+def test_single_question_is_cached_at_default_temperature():
+    completions = FakeCompletions()
+    caller = _caller(completions)
+
+    first = caller.invoke(MESSAGES)
+    first['content'] = 'changed by the caller'
+    second = caller.invoke(MESSAGES)
+
+    assert len(completions.calls) == 1
+    assert completions.calls[0]['temperature'] <= caller.cache.max_temperature
+    assert second['content'] == '彩虹城是一个AI共生社区'
+    assert second['cached'] == 'exact'
+
+
+def test_conversation_uses_default_temperature_and_bypasses_cache():
+    completions = FakeCompletions()
+    caller = _caller(completions)
+    messages = [{'role': 'user', 'content': '你好'}, {'role': 'assistant', 'content': '你好！'}] + MESSAGES
+
+    caller.invoke(messages)
+    caller.invoke(messages)
+
+    assert len(completions.calls) == 2
+    assert completions.calls[0]['temperature'] == LLM_DEFAULT_TEMPERATURE
+
+
+def test_personal_context_is_not_cached():
+    completions = FakeCompletions()
+    caller = _caller(completions)
+
+    caller.invoke(MESSAGES, cacheable=False)
+    caller.invoke(MESSAGES, cacheable=False)
+
+    assert len(completions.calls) == 2
+
+
+def test_flight_key_includes_backend_and_tier():
+    keys = []
+
+    class RecordingFlight(SingleFlight):
+        def do(self, key, fn, timeout=None):
+            keys.append(key)
+            return super().do(key, fn, timeout)
+
+    callers = [_caller(FakeCompletions(), name=name) for name in ('primary', 'backup')]
+    for caller in callers:
+        caller.flight = RecordingFlight('test_llm')
+    callers[0].invoke(MESSAGES, vip_level='Free', cacheable=False)
+    callers[1].invoke(MESSAGES, vip_level='Free', cacheable=False)
+    callers[0].invoke(MESSAGES, vip_level='Premium', cacheable=False)
+
+    assert len(set(keys)) == 3
+
+
+def test_explicit_model_is_used_only_with_override():
+    completions = FakeCompletions()
+    _caller(completions).invoke(MESSAGES, model='gpt-4o-mini')
+    _caller(completions, model_override=False).invoke(MESSAGES, model='gpt-4o-mini')
+
+    assert [call['model'] for call in completions.calls] == ['gpt-4o-mini', 'gpt-4o']
+
+
+def test_upstream_timeout_counts_as_failure():
+    caller = _caller(FakeCompletions(error=_timeout_error()))
+
+    result = caller.invoke(MESSAGES)
+
+    assert 'error' in result
+    assert caller.breaker.state == OPEN
+
+
+def test_deadline_timeout_is_not_an_upstream_failure():
+    completions = FakeCompletions(error=_timeout_error())
+    caller = _caller(completions)
+    token = set_deadline(5)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            caller.invoke(MESSAGES)
+    finally:
+        reset_deadline(token)
+
+    assert completions.calls[0]['timeout'] < llm_caller.LLM_REQUEST_TIMEOUT
+    assert caller.breaker.state == CLOSED
@@ -0,0 +1,83 @@
+"""按复杂度选择模型等级（app/agent/model_selector.py）"""
+
+import pytest
+
+from app.agent import model_selector
+from app.agent.model_selector import ModelTier, classify, extract_features, resolve_model, select_model
+
+SYSTEM = {'role': 'system', 'content': '你是彩虹城系统的AI助手'}
+
+
+def _conversation(question, turns=0, answer='好的'):
+    messages = [SYSTEM]
+    for i in range(turns):
+        messages += [{'role': 'user', 'content': f'问题{i}'}, {'role': 'assistant', 'content': answer}]
+    return messages + [{'role': 'user', 'content': question}]
+
+
+@pytest.mark.parametrize('question, tier', [
+    ('你好', 'fast'),
+    ('Hello there, how are you doing today? I have a fairly long question to ask you about the city.', 'fast'),
+    ('彩虹城是什么？', 'fast'),
+    ('为什么天空是蓝色的？', 'fast'),
+    ('我们的关系怎么样', 'fast'),
+    ('你的频率是多少', 'fast'),
+    ('北京明天天气怎么样', 'standard'),
+    ('帮我生成一个AI-ID', 'standard'),
+    ('请详细分析一下一体七翼系统的设计', 'advanced'),
+    ('这段代码有什么问题？\n```\nprint(1)\n```', 'advanced'),
+    ('def add(a, b): return a + b 对吗', 'advanced'),
+])
+def test_tier_by_question(question, tier):
+    assert select_model(_conversation(question)).tier == tier
+
+
+def test_medium_length_question_is_standard():
+    assert select_model(_conversation('我' * 200)).tier == 'standard'
+
+
+@pytest.mark.parametrize('turns, tier', [(5, 'fast'), (6, 'standard'), (10, 'standard'), (11, 'advanced')])
+def test_deep_conversation_is_advanced(turns, tier):
+    # 深度包括本轮的问题
+    assert select_model(_conversation('好的', turns=turns)).tier == tier
+
+
+def test_long_history_is_advanced():
+    assert select_model(_conversation('继续', turns=2, answer='长' * 800)).tier == 'advanced'
+
+
+def test_system_prompt_does_not_count():
+    messages = [{'role': 'system', 'content': '长' * 5000}, {'role': 'user', 'content': '你好'}]
+    features = extract_features(messages)
+
+    assert features.total_chars == 2
+    assert features.depth == 1
+
+
+def test_image_needs_at_least_standard():
+    message = {'role': 'user', 'content': [
+        {'type': 'text', 'text': '这是什么'},
+        {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,AAAA'}},
+    ]}
+    features = extract_features([SYSTEM, message])
+
+    assert features.has_image and features.chars == 4
+    assert classify(features) == 'standard'
+
+
+def test_file_needs_at_least_standard():
+    assert select_model(_conversation('看看这个'), has_file=True).tier == 'standard'
+
+
+def test_choice_uses_tier_limits():
+    choice = select_model(_conversation('你好'))
+
+    assert choice.model == model_selector.MODEL_TIERS['fast'].model
+    assert choice.max_tokens == model_selector.MODEL_TIERS['fast'].max_tokens
+
+
+def test_non_vision_model_falls_back_for_images(monkeypatch):
+    monkeypatch.setattr(model_selector, 'MODEL_TIERS', {'fast': ModelTier('fast', 'local-7b', 500)})
+
+    assert resolve_model('fast') == 'local-7b'
+    assert resolve_model('fast', has_image=True) == model_selector.VISION_FALLBACK_MODEL
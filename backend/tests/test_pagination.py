@@ -0,0 +1,76 @@
+"""键集游标分页（app/utils/pagination_utils.py）"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from app.utils.pagination_utils import InvalidCursor, decode_cursor, encode_cursor, paginate_query
+
+Base = declarative_base()
+
+
+class Row(Base):
+    __tablename__ = 'rows'
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    start = datetime(2025, 1, 1)
+    with Session(engine) as session:
+        # 每两行时间相同，分页必须靠ID区分同一时间的行
+        session.add_all(Row(id=i, created_at=start + timedelta(hours=i // 2)) for i in range(1, 12))
+        session.commit()
+        yield session
+
+
+def _all_pages(session, limit, order_column=None):
+    pages, cursor = [], None
+    while True:
+        rows, next_cursor = paginate_query(session.query(Row), Row.id, cursor, limit, order_column)
+        pages.append([row.id for row in rows])
+        token = next_cursor()
+        if token is None:
+            return pages
+        # 游标经过客户端原样传回
+        cursor = decode_cursor(token)
+
+
+def test_cursor_round_trip():
+    values = {'id': 'chat:abc', 'k': datetime(2025, 1, 2, 3, 4, 5)}
+
+    assert decode_cursor(encode_cursor(values)) == {'id': 'chat:abc', 'k': '2025-01-02T03:04:05'}
+    assert '=' not in encode_cursor(values)
+
+
+def test_empty_cursor_means_first_page():
+    assert decode_cursor(None) is None
+    assert decode_cursor('') is None
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', encode_cursor({'id': 1})[:-3] + '@@', 'WzEsMl0'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_pages_by_id(session):
+    assert _all_pages(session, 4) == [[11, 10, 9, 8], [7, 6, 5, 4], [3, 2, 1]]
+
+
+def test_pages_by_timestamp_with_ties(session):
+    pages = _all_pages(session, 3, Row.created_at)
+
+    assert pages == [[11, 10, 9], [8, 7, 6], [5, 4, 3], [2, 1]]
+
+
+def test_exact_multiple_has_no_extra_page(session):
+    session.query(Row).filter(Row.id > 8).delete()
+    session.commit()
+
+    assert _all_pages(session, 4) == [[8, 7, 6, 5], [4, 3, 2, 1]]
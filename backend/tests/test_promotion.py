@@ -0,0 +1,155 @@
+"""推广注册、转化和统计汇总（app/utils/promotion_utils.py）"""
+
+from datetime import date, datetime
+
+import pytest
+
+from app.utils import promotion_utils
+from app.utils.promotion_utils import (
+    ClickPipeline, PromoterLinkCache, add_to_rollups, record_conversion, record_referred_registration, record_vip_purchase,
+)
+
+NOW = datetime(2025, 3, 5, 15, 30)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(promotion_utils, 'link_cache', PromoterLinkCache())
+    monkeypatch.setattr(promotion_utils, 'execute', lambda sql, params=None: calls.append((sql, params)) or [])
+    return calls
+
+
+def _rollups(params):
+    return sorted((value['key'], value['clicks'], value['commission_amount'])
+                  for name, value in params.items() if name.startswith('rollup'))
+
+
+def test_rollups_merge_per_day_and_month(calls):
+    add_to_rollups({
+        ('users:p1', date(2025, 3, 5)): {'clicks': 2},
+        ('users:p1', date(2025, 3, 6)): {'clicks': 3, 'commission_amount': 100},
+    })
+
+    assert len(calls) == 1
+    sql, params = calls[0]
+    assert sql.startswith('BEGIN TRANSACTION;') and sql.endswith('COMMIT TRANSACTION;')
+    assert "type::thing('promoter_stats_daily'" in sql and "type::thing('promoter_stats_monthly'" in sql
+    assert _rollups(params) == [
+        (['users:p1', '2025-03'], 5, 100),
+        (['users:p1', '2025-03-05'], 2, 0),
+        (['users:p1', '2025-03-06'], 3, 100),
+    ]
+
+
+def test_empty_rollups_do_not_query(calls):
+    add_to_rollups({})
+
+    assert calls == []
+
+
+def test_unknown_code_is_not_recorded(calls):
+    assert record_referred_registration('NOPE', 'users:u1') is False
+    assert len(calls) == 1
+
+
+def test_referred_registration_counts_link_and_rollups(calls):
+    promotion_utils.link_cache._entries['RC1'] = (('promoter_link:l1', 'users:p1'), float('inf'))
+
+    assert record_referred_registration('RC1', 'users:u1') is True
+    sql, params = calls[0]
+    assert 'CREATE promoter_conversion' in sql
+    assert params['link_key'] == 'l1'
+    assert params['conversion']['promoter_id'] == 'users:p1'
+    assert params['conversion']['conversion_type'] == 'registration'
+
+
+def test_failed_write_does_not_raise(monkeypatch):
+    def execute(sql, params=None):
+        raise RuntimeError('SurrealQL statement failed: connection reset')
+
+    cache = PromoterLinkCache()
+    cache._entries['RC1'] = (('promoter_link:l1', 'users:p1'), float('inf'))
+    monkeypatch.setattr(promotion_utils, 'link_cache', cache)
+    monkeypatch.setattr(promotion_utils, 'execute', execute)
+
+    assert record_referred_registration('RC1', 'users:u1') is False
+
+
+def test_conversion_books_commission_in_the_same_transaction(calls):
+    record_conversion('promoter_link:l1', 'users:p1', 'users:u1', amount=9900, commission_rate=15, now=NOW)
+
+    assert len(calls) == 1
+    sql, params = calls[0]
+    assert 'CREATE promoter_commission' in sql
+    assert params['commission']['amount'] == 1485
+    assert (['users:p1', '2025-03-05'], 0, 1485) in _rollups(params)
+
+
+def test_conversion_without_rate_has_no_commission(calls):
+    record_conversion('promoter_link:l1', 'users:p1', 'users:u1', amount=9900, now=NOW)
+
+    sql, params = calls[0]
+    assert 'promoter_commission' not in sql
+    assert 'commission' not in params
+
+
+def test_vip_purchase_without_referral(calls):
+    assert record_vip_purchase('users:u1', 9900) is False
+    assert len(calls) == 1
+
+
+def test_vip_purchase_uses_promoter_rate(monkeypatch):
+    writes = []
+    registration = {'link_id': 'promoter_link:l1', 'promoter_id': 'users:p1', 'timestamp': NOW.isoformat()}
+
+    def execute(sql, params=None):
+        if sql.lstrip().startswith('SELECT link_id'):
+            return [[registration]]
+        if 'promoter_commission_rate' in sql:
+            assert params == {'key': 'p1'}
+            return [[20]]
+        writes.append(params)
+        return []
+
+    monkeypatch.setattr(promotion_utils, 'execute', execute)
+
+    assert record_vip_purchase('users:u1', 1000) is True
+    assert writes[0]['commission']['amount'] == 200
+    assert writes[0]['conversion']['link_id'] == 'promoter_link:l1'
+
+
+def _pipeline(clicks=3):
+    pipeline = ClickPipeline(flush_interval=60)
+    for i in range(clicks):
+        pipeline.queue.put_nowait({
+            'link_id': f'promoter_link:l{i % 2}', 'promoter_id': 'users:p1', 'ip_address': '1.2.3.4',
+            'user_agent': 'test', 'referer': None, 'timestamp': NOW,
+        })
+    return pipeline
+
+
+def test_flush_writes_one_batch(calls):
+    assert _pipeline().flush() == 3
+
+    assert len(calls) == 1
+    sql, params = calls[0]
+    assert 'INSERT INTO promoter_click $clicks' in sql
+    assert params['clicks'][0]['timestamp'] == NOW.isoformat()
+    assert sorted((params[name]['key'], params[name]['count']) for name in ('link0', 'link1')) == [('l0', 2), ('l1', 1)]
+    assert (['users:p1', '2025-03-05'], 3, 0) in _rollups(params)
+
+
+def test_failing_batch_is_dropped_after_max_attempts(monkeypatch):
+    def execute(sql, params=None):
+        raise RuntimeError('SurrealQL statement failed: bad data')
+
+    monkeypatch.setattr(promotion_utils, 'execute', execute)
+    monkeypatch.setattr(promotion_utils, 'MAX_CONFLICT_RETRIES', 1)
+    pipeline = _pipeline()
+
+    for _ in range(promotion_utils.CLICK_FLUSH_MAX_ATTEMPTS - 1):
+        assert pipeline.flush() == 0
+        assert pipeline.queue.qsize() == 3
+    assert pipeline.flush() == 0
+    assert pipeline.queue.qsize() == 0
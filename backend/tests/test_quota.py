@@ -0,0 +1,120 @@
+"""按时间窗口分桶的配额计数（app/utils/quota_utils.py）"""
+
+from datetime import datetime
+
+import pytest
+
+from app.utils import quota_utils
+from app.models.enums import VIPLevel
+from app.utils.quota_utils import QUOTA_LIMITS, consume_quota, get_vip_level, get_window, invalidate_vip_level
+
+NOW = datetime(2025, 3, 5, 15, 30)  # 星期三
+
+
+def test_daily_window():
+    bucket, resets_at = get_window('chat', NOW)
+
+    assert bucket == '2025-03-05'
+    assert resets_at == datetime(2025, 3, 6)
+
+
+def test_weekly_window_starts_on_monday():
+    bucket, resets_at = get_window('invite', NOW)
+
+    assert bucket == '2025-W10'
+    assert resets_at == datetime(2025, 3, 10)
+
+
+def test_limits_are_indexed_by_level_name_and_value():
+    assert QUOTA_LIMITS['chat']['free'] == QUOTA_LIMITS['chat']['Free'] == 10
+    assert QUOTA_LIMITS['chat']['team'] == 1000
+
+
+def test_consume_sends_one_transaction(monkeypatch):
+    calls = []
+
+    def execute(query, params):
+        calls.append((query, params))
+        return [None] * 6 + [{'allowed': True, 'used': 3, 'limit': 10}]
+
+    monkeypatch.setattr(quota_utils, 'execute', execute)
+    status = consume_quota('users:abc', 'chat', now=NOW)
+
+    assert len(calls) == 1
+    query, params = calls[0]
+    assert query.strip().startswith('BEGIN TRANSACTION')
+    assert params['user_key'] == 'abc'
+    assert params['counter_key'] == ['abc', 'chat', '2025-03-05']
+    assert params['expires_at'] == '2025-03-07T00:00:00'
+    assert (status.allowed, status.used, status.limit, status.remaining) == (True, 3, 10, 7)
+
+
+def test_rejected_quota_reports_current_usage(monkeypatch):
+    monkeypatch.setattr(quota_utils, 'execute',
+                        lambda query, params: [{'allowed': False, 'used': 10, 'limit': 10}])
+    status = consume_quota('abc', 'chat', now=NOW)
+
+    assert status.allowed is False
+    assert status.remaining == 0
+
+
+def test_conflict_is_retried(monkeypatch):
+    attempts = []
+
+    def execute(query, params):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError('SurrealQL statement failed: Transaction conflict')
+        return [{'allowed': True, 'used': 1, 'limit': 10}]
+
+    monkeypatch.setattr(quota_utils, 'execute', execute)
+
+    assert consume_quota('abc', 'chat', now=NOW).allowed is True
+    assert len(attempts) == 3
+
+
+def test_conflict_gives_up_after_max_retries(monkeypatch):
+    def execute(query, params):
+        raise RuntimeError('SurrealQL statement failed: Transaction conflict')
+
+    monkeypatch.setattr(quota_utils, 'execute', execute)
+    with pytest.raises(RuntimeError):
+        consume_quota('abc', 'chat', now=NOW)
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        consume_quota('abc', 'nope', now=NOW)
+
+
+def test_unlimited_without_database(monkeypatch):
+    monkeypatch.setattr(quota_utils, 'execute', lambda query, params: [])
+    status = consume_quota('abc', 'chat', now=NOW)
+
+    assert status.allowed is True
+    assert status.remaining == -1
+
+
+@pytest.mark.parametrize('row, level', [
+    ({'vip_level': 'pro', 'vip_expiry': '2025-04-01T00:00:00'}, VIPLevel.pro),
+    ({'vip_level': 'Premium'}, VIPLevel.premium),
+    ({'vip_level': 'pro', 'vip_expiry': '2025-03-01T00:00:00'}, VIPLevel.free),
+])
+def test_vip_level_from_database(monkeypatch, row, level):
+    monkeypatch.setattr(quota_utils, 'execute', lambda query, params: [[row]])
+    invalidate_vip_level('users:abc')
+
+    assert get_vip_level('users:abc', now=NOW) == level
+
+
+def test_vip_level_is_cached_until_invalidated(monkeypatch):
+    calls = []
+    monkeypatch.setattr(quota_utils, 'execute', lambda query, params: calls.append(params) or [[{'vip_level': 'pro'}]])
+    invalidate_vip_level('users:abc')
+
+    get_vip_level('users:abc')
+    get_vip_level('abc')
+    invalidate_vip_level('users:abc')
+    get_vip_level('users:abc')
+
+    assert calls == [{'user_key': 'abc'}] * 2
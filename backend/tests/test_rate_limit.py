@@ -0,0 +1,224 @@
+"""令牌桶限流（app/middleware/rate_limit.py）"""
+
+import jwt
+import pytest
+from flask import Flask
+
+from app.middleware import rate_limit
+from app.middleware.rate_limit import (
+    MemoryRateLimitBackend, RateLimitConflict, RateLimitRule, RateLimiter, SurrealRateLimitBackend,
+    authenticated_user_id, enforce_quota, identify_request,
+)
+from app.models.enums import VIPLevel
+from app.utils.quota_utils import QuotaStatus
+
+SECRET_KEY = 'rate-limit-test-secret-key-32-bytes'
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+
+def test_bucket_allows_burst_then_rejects(clock):
+    backend = MemoryRateLimitBackend()
+    results = [backend.consume('k', capacity=3, period=3) for _ in range(4)]
+
+    assert [allowed for allowed, _left, _wait in results] == [True, True, True, False]
+    assert results[2][1] == 0
+    assert results[3][2] == pytest.approx(1.0)
+
+
+def test_bucket_refills_over_time(clock):
+    backend = MemoryRateLimitBackend()
+    for _ in range(3):
+        backend.consume('k', capacity=3, period=3)
+
+    clock.now += 1.0
+    assert backend.consume('k', capacity=3, period=3)[0] is True
+    assert backend.consume('k', capacity=3, period=3)[0] is False
+
+    # 补充的令牌不会超过桶的容量
+    clock.now += 100
+    assert backend.consume('k', capacity=3, period=3)[1] == 2
+
+
+def test_buckets_are_per_key(clock):
+    backend = MemoryRateLimitBackend()
+    assert backend.consume('a', capacity=1, period=60)[0] is True
+    assert backend.consume('a', capacity=1, period=60)[0] is False
+    assert backend.consume('b', capacity=1, period=60)[0] is True
+
+
+def test_prune_drops_only_full_buckets(clock):
+    backend = MemoryRateLimitBackend(max_keys=2)
+    backend.consume('full', capacity=1, period=1)
+    backend.consume('busy', capacity=10, period=100)
+    clock.now += 2
+
+    backend.consume('new', capacity=1, period=1)
+
+    assert 'full' not in backend._buckets
+    assert set(backend._buckets) == {'busy', 'new'}
+
+
+def test_surreal_backend_reads_transaction_result(clock, monkeypatch):
+    calls = []
+
+    def execute(query, params):
+        calls.append(params)
+        return [None, None, None, None, None, {'allowed': False, 'tokens': 0.25}]
+
+    monkeypatch.setattr(rate_limit, 'execute', execute)
+    allowed, left, retry_after = SurrealRateLimitBackend().consume('k', capacity=2, period=4)
+
+    assert (allowed, left) == (False, 0)
+    assert retry_after == pytest.approx(1.5)
+    assert calls[0]['rate'] == 0.5 and calls[0]['now'] == clock.now
+
+
+def test_surreal_backend_raises_conflict(monkeypatch):
+    def execute(query, params):
+        raise RuntimeError('SurrealQL statement failed: Transaction conflict: Resource busy')
+
+    monkeypatch.setattr(rate_limit, 'execute', execute)
+    with pytest.raises(RateLimitConflict):
+        SurrealRateLimitBackend().consume('k', capacity=2, period=4)
+
+
+class _Backend:
+    def __init__(self, error=None):
+        self.error = error
+
+    def consume(self, key, capacity, period, cost=1):
+        raise self.error
+
+
+def _client(backend):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    app.add_url_rule('/limited', 'limited', lambda: 'ok')
+    rule = RateLimitRule(name='test', endpoints=('limited',), limits={VIPLevel.free: (1, 60)})
+    RateLimiter(rules=(rule,), backend=backend).init_app(app)
+    return app.test_client()
+
+
+def test_conflict_is_rejected_with_429():
+    response = _client(_Backend(RateLimitConflict('k'))).get('/limited')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_backend_failure_fails_open():
+    response = _client(_Backend(RuntimeError('connection refused'))).get('/limited')
+
+    assert response.status_code == 200
+
+
+def test_limit_applies_per_client(clock):
+    client = _client(MemoryRateLimitBackend())
+
+    assert client.get('/limited').status_code == 200
+    response = client.get('/limited')
+    assert response.status_code == 429
+    assert response.get_json()['retry_after'] == 60
+
+
+def _bearer(secret, **claims):
+    claims = {'user_id': 'users:u1', **claims}
+    return {'Authorization': 'Bearer ' + jwt.encode(claims, secret, algorithm='HS256')}
+
+
+def _request(headers):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    return app.test_request_context('/', method='POST', headers=headers, json={'user_id': 'users:victim'})
+
+
+@pytest.mark.parametrize('headers, user_id', [
+    (_bearer(SECRET_KEY), 'users:u1'),
+    (_bearer('another-secret-key-of-32-bytes-min'), None),
+    ({}, None),
+])
+def test_authenticated_user_comes_only_from_the_token(monkeypatch, headers, user_id):
+    monkeypatch.setattr(rate_limit, 'get_vip_level', lambda user_id: VIPLevel.free)
+
+    with _request(headers):
+        assert authenticated_user_id() == user_id
+
+
+def test_level_comes_from_the_database(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'get_vip_level', lambda user_id: VIPLevel.premium)
+
+    with _request(_bearer(SECRET_KEY, vip_level='free')):
+        assert identify_request() == ('user:users:u1', VIPLevel.premium)
+
+
+def test_token_level_is_used_when_database_fails(monkeypatch):
+    def get_vip_level(user_id):
+        raise RuntimeError('connection refused')
+
+    monkeypatch.setattr(rate_limit, 'get_vip_level', get_vip_level)
+
+    with _request(_bearer(SECRET_KEY, vip_level='pro', vip_expiry='2999-01-01T00:00:00')):
+        assert identify_request()[1] == VIPLevel.pro
+    with _request(_bearer(SECRET_KEY, vip_level='pro', vip_expiry='2000-01-01T00:00:00')):
+        assert identify_request()[1] == VIPLevel.free
+
+
+@pytest.fixture
+def quota_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(rate_limit, 'get_vip_level', lambda user_id: VIPLevel.free)
+    return calls
+
+
+def _consume(calls, allowed):
+    def consume_quota(user_id, kind):
+        calls.append((user_id, kind))
+        return QuotaStatus(kind, allowed, 10, 10, '2999-01-01T00:00:00')
+    return consume_quota
+
+
+def test_anonymous_request_has_no_quota(monkeypatch, quota_calls):
+    monkeypatch.setattr(rate_limit, 'consume_quota', _consume(quota_calls, False))
+
+    with _request({}):
+        assert enforce_quota('chat') is None
+    assert quota_calls == []
+
+
+def test_exhausted_quota_is_rejected(monkeypatch, quota_calls):
+    monkeypatch.setattr(rate_limit, 'consume_quota', _consume(quota_calls, False))
+
+    with _request(_bearer(SECRET_KEY)):
+        response = enforce_quota('chat')
+
+    assert quota_calls == [('users:u1', 'chat')]
+    assert response.status_code == 429
+    assert response.get_json()['quota']['remaining'] == 0
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_quota_failure_fails_open(monkeypatch, quota_calls):
+    def consume_quota(user_id, kind):
+        raise RuntimeError('connection refused')
+
+    monkeypatch.setattr(rate_limit, 'consume_quota', consume_quota)
+
+    with _request(_bearer(SECRET_KEY)):
+        assert enforce_quota('chat') is None
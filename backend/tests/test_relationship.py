@@ -0,0 +1,103 @@
+"""关系强度评分的增量更新、批量重算和状态衰减（app/utils/relationship_utils.py、app/tasks/relationship_tasks.py）"""
+
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.tasks import relationship_tasks
+from app.tasks.relationship_tasks import apply_status_decay, compute_ris_batch, recompute_relationship_ris
+from app.utils import relationship_utils
+from app.utils.relationship_utils import compute_ris_components, record_interaction_event, record_pair_interaction
+
+RELATIONSHIPS = [
+    {'id': 'relationship:a', 'interaction_count': 0, 'emotional_resonance_count': 0},
+    {'id': 'relationship:b', 'interaction_count': 50, 'emotional_resonance_count': 6},
+    {'id': 'relationship:c', 'interaction_count': 500, 'emotional_resonance_count': 30},
+]
+
+
+def test_batch_matches_single_computation():
+    _frequency, _density, _depth, ris = compute_ris_batch(
+        np.array([row['interaction_count'] for row in RELATIONSHIPS], dtype=float),
+        np.array([row['emotional_resonance_count'] for row in RELATIONSHIPS], dtype=float),
+        np.zeros(len(RELATIONSHIPS)),
+    )
+
+    assert ris == pytest.approx([compute_ris_components(row)['ris'] for row in RELATIONSHIPS])
+
+
+def test_recompute_pages_by_id_and_writes_each_batch(monkeypatch):
+    calls = []
+
+    def execute(sql, params=None):
+        calls.append((sql, params))
+        if sql.strip().startswith('SELECT'):
+            rows = [row for row in RELATIONSHIPS if params['cursor'] is None or row['id'] > params['cursor']]
+            return [rows[:params['limit']]]
+        return []
+
+    monkeypatch.setattr(relationship_tasks, 'execute', execute)
+
+    assert recompute_relationship_ris(batch_size=2) == 3
+    updates = [params['updates'] for sql, params in calls if 'FOR $row' in sql]
+    assert [len(batch) for batch in updates] == [2, 1]
+    assert updates[1][0]['ris'] == pytest.approx(compute_ris_components(RELATIONSHIPS[2])['ris'])
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def execute(sql, params=None):
+        calls.append((sql, params))
+        if sql.strip().startswith('UPDATE relationship'):
+            return [[{'id': 'relationship:b', 'interaction_count': 51, 'emotional_resonance_count': 7}]]
+        return []
+
+    monkeypatch.setattr(relationship_utils, 'execute', execute)
+    return calls
+
+
+def test_interaction_refreshes_ris_only_if_counters_did_not_move(calls):
+    relationship = record_interaction_event('rel-1', emotional_resonance=True)
+
+    (_sql, increment), (write, components) = calls
+    assert increment['relationship_id'] == 'rel-1' and increment['resonance'] == 1
+    assert 'WHERE interaction_count = $interaction_count' in write
+    assert components['interaction_count'] == 51
+    assert relationship['ris'] == components['components']['ris']
+
+
+def test_missing_relationship(monkeypatch):
+    monkeypatch.setattr(relationship_utils, 'execute', lambda sql, params=None: [[]])
+
+    assert record_interaction_event('rel-missing') is None
+    assert record_pair_interaction('users:u1', 'ai') == 0
+
+
+def test_pair_interaction_matches_user_id_forms(calls):
+    assert record_pair_interaction('users:u1', 'ai') == 1
+
+    assert calls[0][1]['human_ids'] == ['users:u1', 'u1']
+    assert calls[0][1]['ai_id'] == 'ai'
+
+
+def test_status_decay_runs_set_based_batches_on_relationship(monkeypatch):
+    calls = []
+    batches = iter([2, 1, 0, 0])
+
+    def execute(sql, params=None):
+        calls.append((sql, params))
+        return [None, None, next(batches)]
+
+    monkeypatch.setattr(relationship_tasks, 'execute', execute)
+
+    report = apply_status_decay(batch_size=2, now=datetime(2025, 3, 15))
+
+    assert report == {'active/cooling->silent': 3, 'active->cooling': 0, 'cooling/silent->active': 0}
+    assert all('FROM relationship WHERE' in sql for sql, _params in calls)
+    silent = calls[0][1]
+    assert silent['older_than'] == '2025-03-01T00:00:00' and silent['newer_than'] is None
+    cooling = calls[2][1]
+    assert (cooling['older_than'], cooling['newer_than']) == ('2025-03-08T00:00:00', '2025-03-01T00:00:00')
@@ -0,0 +1,96 @@
+"""任务调度器的租约锁（app/tasks/scheduler.py）"""
+
+import pytest
+
+from app.tasks import scheduler
+from app.tasks.scheduler import LocalLock, Scheduler, SurrealLeaseLock
+
+
+def test_local_lock_lease():
+    lock = LocalLock()
+
+    assert lock.acquire('job', ttl=60) is True
+    assert lock.acquire('job', ttl=60) is False
+    lock.release('job')
+    assert lock.acquire('job', ttl=60) is True
+
+
+def test_local_lock_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler.time, 'time', lambda: now[0])
+    lock = LocalLock()
+
+    assert lock.acquire('job', ttl=10) is True
+    now[0] += 11
+    assert lock.acquire('job', ttl=10) is True
+
+
+@pytest.mark.parametrize('owners, acquired', [
+    ([['host:1']], True),
+    ([['host:2']], False),
+    ([[]], False),
+    ([], False),
+])
+def test_surreal_lock_acquired_only_when_owner_written(monkeypatch, owners, acquired):
+    calls = []
+
+    def execute(query, params):
+        calls.append(params)
+        return owners
+
+    monkeypatch.setattr(scheduler, 'execute', execute)
+    lock = SurrealLeaseLock(owner='host:1')
+
+    assert lock.acquire('job', ttl=30) is acquired
+    assert calls[0]['owner'] == 'host:1'
+    assert calls[0]['expires_at'] > calls[0]['now']
+
+
+def test_surreal_lock_conflict_is_not_acquired(monkeypatch):
+    def execute(query, params):
+        raise RuntimeError('SurrealQL statement failed: Transaction conflict')
+
+    monkeypatch.setattr(scheduler, 'execute', execute)
+
+    assert SurrealLeaseLock(owner='host:1').acquire('job', ttl=30) is False
+
+
+def test_successful_run_keeps_lease_for_part_of_the_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler.time, 'time', lambda: now[0])
+    runs = []
+    tasks = Scheduler(lock=LocalLock())
+    job = tasks.add_job('job', lambda: runs.append(1), interval=60)
+
+    assert tasks.run_job(job) is True
+    # 刚运行过，其他进程拿不到租约
+    now[0] += 10
+    assert tasks.run_job(job) is False
+    # 按同样周期触发的外部cron在下一个周期不会被上一次的租约挡住
+    now[0] += 50
+    assert tasks.run_job(job) is True
+    assert runs == [1, 1]
+
+
+def test_failed_run_releases_lease():
+    def fail():
+        raise RuntimeError('boom')
+
+    tasks = Scheduler(lock=LocalLock())
+    job = tasks.add_job('job', fail, interval=60)
+
+    assert tasks.run_job(job) is True
+    assert tasks.lock.acquire('job', ttl=60) is True
+
+
+def test_only_one_scheduler_runs_a_job():
+    runs = []
+    lock = LocalLock()
+    first, second = Scheduler(lock=lock), Scheduler(lock=lock)
+    for tasks in (first, second):
+        tasks.add_job('job', lambda: runs.append(1), interval=60, run_immediately=True)
+
+    first.run_pending()
+    second.run_pending()
+
+    assert runs == [1]
@@ -0,0 +1,37 @@
+"""数据库模式的创建（app/models/schema.py）"""
+
+import asyncio
+
+from app.models.chat_schema import CHAT_SCHEMA, MESSAGE_SCHEMA
+from app.models.schema import apply_schema, split_statements
+
+
+class FakeDB:
+    def __init__(self, indexes=(), analyzers=()):
+        self.indexes = set(indexes)
+        self.analyzers = set(analyzers)
+        self.statements = []
+
+    async def query(self, statement):
+        if statement.startswith('INFO FOR TABLE'):
+            return [{'result': {'indexes': {name: '' for name in self.indexes}}, 'status': 'OK'}]
+        if statement == 'INFO FOR DB':
+            return [{'result': {'analyzers': {name: '' for name in self.analyzers}}, 'status': 'OK'}]
+        self.statements.append(statement)
+        return [{'result': None, 'status': 'OK'}]
+
+
+def test_existing_indexes_and_analyzers_are_not_rebuilt():
+    db = FakeDB(indexes={'idx_chat_messages'}, analyzers={'message_search'})
+
+    applied, skipped = asyncio.run(apply_schema(db, MESSAGE_SCHEMA))
+
+    assert (applied, skipped) == (2, 2)
+    assert [statement.split()[2] for statement in db.statements] == ['idx_message_search', 'idx_message_user']
+
+
+def test_chat_tables_stay_schemaless():
+    # 路由写入的是ISO字符串时间和 'chat:<id>' 字符串，带类型约束的表定义会拒绝这些写入
+    statements = split_statements(CHAT_SCHEMA + MESSAGE_SCHEMA)
+
+    assert all(statement.startswith(('DEFINE INDEX', 'DEFINE ANALYZER')) for statement in statements)
@@ -0,0 +1,67 @@
+"""聊天消息全文搜索（app/utils/search_utils.py）"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from app.utils import search_utils
+from app.utils.search_utils import highlight, index_fields, query_terms, search_messages, without_index_fields
+
+
+def test_index_fields_store_tokens_separated_by_spaces():
+    assert index_fields('Hello World') == {'search_text': 'hello world'}
+
+
+def test_query_terms_are_unique_and_ordered():
+    assert query_terms('world hello World') == ['world', 'hello']
+
+
+def test_highlight_escapes_html_around_matches():
+    assert highlight('<b>彩虹城</b> 欢迎你', ['彩虹城']) == '&lt;b&gt;<mark>彩虹城</mark>&lt;/b&gt; 欢迎你'
+
+
+def test_highlight_snippet_starts_near_the_first_match():
+    snippet = highlight('前' * 200 + '目标' + '后' * 200, ['目标'], length=40)
+
+    assert snippet.startswith('…') and snippet.endswith('…')
+    assert '<mark>目标</mark>' in snippet
+
+
+def test_index_fields_are_not_returned():
+    message = {'id': 'message:m1', 'content': 'Hello', **index_fields('Hello')}
+
+    assert without_index_fields(message) == {'id': 'message:m1', 'content': 'Hello'}
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def execute(sql, params=None):
+        calls.append((sql, params))
+        return [None, [{'id': 'message:m1', 'chat_id': 'chat:c1', 'role': 'user',
+                        'content': 'hello there', 'timestamp': '2025-03-05T10:00:00', 'score': 1.5}]]
+
+    monkeypatch.setattr(search_utils, 'execute', execute)
+    return calls
+
+
+def test_search_filters_by_user_chat_and_time(calls):
+    since = datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+    results = search_messages('users:u1', 'Hello', chat_id='c1', since=since, limit=500)
+
+    sql, params = calls[0]
+    assert 'search_text @1@ $terms' in sql and 'chat_id = $chat_ref' in sql and 'timestamp >= $since' in sql
+    assert 'search_text,' not in sql.split('FROM message')[0]
+    assert params['terms'] == 'hello'
+    assert params['chat_ref'] == 'chat:c1'
+    assert params['since'] == since.astimezone().replace(tzinfo=None).isoformat()
+    assert params['limit'] == search_utils.MAX_SEARCH_RESULTS
+    assert results[0]['highlight'] == '<mark>hello</mark> there'
+    assert 'content' not in results[0]
+
+
+def test_empty_query_does_not_search(calls):
+    assert search_messages('users:u1', '  ') == []
+    assert calls == []
@@ -0,0 +1,118 @@
+"""相同请求的合并（app/agent/single_flight.py）"""
+
+import threading
+import time
+
+import pytest
+
+from app.agent.single_flight import SingleFlight
+
+
+def _start_followers(flight, key, count, fn, results, timeout=None):
+    threads = [threading.Thread(target=lambda: results.append(flight.do(key, fn, timeout=timeout)))
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    # 等待者挂到进行中的调用上
+    time.sleep(0.1)
+    return threads
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight('test_flight')
+    calls = []
+    release = threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {'content': 'answer'}
+
+    leader = []
+    leader_thread = threading.Thread(target=lambda: leader.append(flight.do('k', fn)))
+    leader_thread.start()
+    time.sleep(0.05)
+    followers = []
+    threads = _start_followers(flight, 'k', 4, fn, followers)
+
+    release.set()
+    for thread in [leader_thread, *threads]:
+        thread.join(5)
+
+    assert calls == [1]
+    assert leader[0][1] is False
+    assert [shared for _result, shared in followers] == [True] * 4
+    assert all(result is leader[0][0] for result, _shared in followers)
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight('test_flight')
+
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight('test_flight')
+    calls = []
+
+    for _ in range(2):
+        flight.do('k', lambda: calls.append(1))
+
+    assert calls == [1, 1]
+
+
+def test_error_is_shared_with_followers():
+    flight = SingleFlight('test_flight')
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ConnectionError('upstream down')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('k', fail)
+        except ConnectionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert len({id(error) for error in errors}) == 1
+
+
+def test_follower_stops_waiting_after_timeout():
+    flight = SingleFlight('test_flight')
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do('k', lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    result = flight.do('k', lambda: 'own', timeout=0.05)
+
+    assert result == ('own', False)
+    assert time.monotonic() - started < 1
+    release.set()
+    leader.join(5)
+
+
+def test_leader_error_clears_the_key():
+    flight = SingleFlight('test_flight')
+
+    def fail():
+        raise ValueError('bad')
+
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+
+    assert flight.do('k', lambda: 'ok') == ('ok', False)
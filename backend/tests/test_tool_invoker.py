@@ -0,0 +1,72 @@
+"""按问题筛选工具定义（app/agent/tool_invoker.py）"""
+
+from app.agent.tool_invoker import DEFAULT_TOOLS, ToolInvoker
+from app.utils.deadline import reset_deadline, set_deadline
+
+
+def _names(definitions):
+    return [definition['function']['name'] for definition in definitions]
+
+
+def test_unrelated_question_sends_no_tools():
+    assert ToolInvoker().select_tool_definitions('你好，今天过得怎么样') == []
+
+
+def test_keyword_selects_matching_tool():
+    assert _names(ToolInvoker().select_tool_definitions('上海明天会下雨吗')) == ['get_weather']
+
+
+def test_keywords_are_case_insensitive():
+    assert 'get_weather' in _names(ToolInvoker().select_tool_definitions('What is the WEATHER in Paris'))
+
+
+def test_attachment_selects_tool_without_keyword():
+    invoker = ToolInvoker()
+    by_attachment = {spec.attachment: spec.name for spec in DEFAULT_TOOLS if spec.attachment}
+
+    assert _names(invoker.select_tool_definitions('这是什么', attachment='image')) == [by_attachment['image']]
+    assert _names(invoker.select_tool_definitions('这是什么', attachment='document')) == [by_attachment['document']]
+
+
+def test_tool_names_are_unique():
+    names = _names(ToolInvoker().get_tool_definitions())
+
+    assert len(names) == len(set(names)) == len(DEFAULT_TOOLS)
+
+
+def test_tool_without_keywords_is_always_sent():
+    invoker = ToolInvoker()
+    invoker.register_tool('echo', lambda text: text, '原样返回', {'text': {'type': 'string'}})
+
+    assert _names(invoker.select_tool_definitions('你好')) == ['echo']
+
+
+def test_register_replaces_same_name():
+    invoker = ToolInvoker()
+    invoker.register_tool('get_weather', lambda city: f'{city}: 晴', '天气', {'city': {'type': 'string'}},
+                          keywords=('天气',))
+
+    assert len(invoker.get_tool_definitions()) == len(DEFAULT_TOOLS)
+    assert invoker.invoke_tool('get_weather', city='北京') == '北京: 晴'
+
+
+def test_optional_parameters_are_not_required():
+    invoker = ToolInvoker()
+    invoker.register_tool('search', lambda query, limit=5: query, '搜索',
+                          {'query': {'type': 'string'}, 'limit': {'type': 'integer', 'optional': True}})
+    parameters = invoker.tools['search'].definition['function']['parameters']
+
+    assert parameters['required'] == ['query']
+    assert 'optional' not in parameters['properties']['limit']
+
+
+def test_tool_is_skipped_without_time_left():
+    invoker = ToolInvoker()
+    invoker.register_tool('echo', lambda text: text, '原样返回', {'text': {'type': 'string'}})
+    token = set_deadline(0.5)
+    try:
+        result = invoker.invoke_tool('echo', text='hi')
+    finally:
+        reset_deadline(token)
+
+    assert result.startswith('处理时间不足')
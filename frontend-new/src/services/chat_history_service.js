@@ -18,26 +18,35 @@ export const getUserChats = async () => {
   }
 
   try {
-    const response = await fetch(`${API_BASE_URL}/api/chats`, {
-      method: 'GET',
-      headers: {
-        'Authorization': `Bearer ${token}`
+    // 接口按游标分页，依次取完所有页
+    const chats = [];
+    let cursor = null;
+    do {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${API_BASE_URL}/api/chats${query}`, {
+        method: 'GET',
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+
+      if (response.status === 401) {
+        console.log('Token已过期，清除登录状态');
+        localStorage.removeItem('token');
+        localStorage.removeItem('userId');
+        return [];
       }
-    });
 
-    if (response.status === 401) {
-      console.log('Token已过期，清除登录状态');
-      localStorage.removeItem('token');
-      localStorage.removeItem('userId');
-      return [];
-    }
+      if (!response.ok) {
+        throw new Error(`获取聊天会话失败: ${response.status}`);
+      }
 
-    if (!response.ok) {
-      throw new Error(`获取聊天会话失败: ${response.status}`);
-    }
+      const data = await response.json();
+      chats.push(...(data.chats || []));
+      cursor = data.next_cursor;
+    } while (cursor);
 
-    const data = await response.json();
-    return data.chats || [];
+    return chats;
   } catch (error) {
     console.error('获取聊天会话失败:', error);
     return [];
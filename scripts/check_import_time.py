@@ -0,0 +1,86 @@
+"""
+启动耗时检查
+在子进程中用 `python -X importtime` 创建应用（不连接数据库），检查两件事：
+- 所有模块的导入总耗时不超过预算
+- 应该在第一次使用时才加载的重依赖（openai、stripe、numpy等）没有在启动时被导入
+任一项不满足时以非0状态退出，可以放在CI中防止启动变慢。
+
+用法：python scripts/check_import_time.py [--budget-ms 500] [--runs 3]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+# 启动时不应导入的模块
+LAZY_MODULES = ('openai', 'stripe', 'numpy', 'sqlalchemy', 'requests', 'PIL', 'hnswlib')
+
+# 默认的导入耗时预算（毫秒），可以用环境变量 IMPORT_TIME_BUDGET_MS 覆盖
+DEFAULT_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', 500))
+
+STARTUP_CODE = 'from app import create_app; create_app(init_database=False)'
+
+# -X importtime 的输出行：import time: self [us] | cumulative | imported package
+LINE_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure():
+    """运行一次启动，返回 (导入总耗时毫秒, 导入的模块名集合, 最慢的顶层模块)"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"创建应用失败:\n{result.stderr[-2000:]}")
+
+    total_us = 0
+    modules = set()
+    top_level = []
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        total_us += int(self_us)
+        modules.add(name)
+        # 缩进为1个空格的是顶层导入（输出中没有嵌套关系的前缀）
+        if len(indent) == 1:
+            top_level.append((int(cumulative_us), name))
+    top_level.sort(reverse=True)
+    return total_us / 1000, modules, top_level[:10]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查应用启动的导入耗时')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help='导入总耗时预算（毫秒）')
+    parser.add_argument('--runs', type=int, default=3, help='运行次数，取最快的一次以减少抖动')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(args.runs, 1))]
+    total_ms, modules, slowest = min(runs, key=lambda run: run[0])
+
+    print(f"导入总耗时: {total_ms:.0f} ms（预算 {args.budget_ms:.0f} ms）")
+    print("最慢的顶层导入:")
+    for cumulative_us, name in slowest:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = sorted(name for name in LAZY_MODULES if name in modules)
+    if eager:
+        failures.append(f"以下模块应在第一次使用时加载，却在启动时被导入: {', '.join(eager)}"
+                        f"（用 python -X importtime 查看是谁导入的）")
+    if total_ms > args.budget_ms:
+        failures.append(f"导入总耗时 {total_ms:.0f} ms 超过预算 {args.budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"失败: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+创建数据库索引
+部署时在启动应用之前运行一次：python scripts/init_db.py
+只创建缺少的索引、分析器和字段定义，已存在的索引不会重建，重复运行是安全的。
+应用启动时默认不创建索引；开发环境可以设置 DB_AUTO_SCHEMA=true，让工作进程启动时也检查。
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+
+def main():
+    from app.db import init_schema, shutdown_db
+
+    try:
+        ok = init_schema()
+    finally:
+        shutdown_db()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())